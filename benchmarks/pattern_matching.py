@@ -0,0 +1,91 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+"""
+Per request cost of the blockedlist/allowedlist check against the number of patterns.
+
+Compares the former pattern x metric name loop of re.match calls with the compiled
+MetricMatcher, without (cold) and with (warm) its decision cache.
+
+Usage:
+PYTHONPATH=. python benchmarks/pattern_matching.py [--patterns 10 100 1000] [--names 5] [--requests 2000]
+"""
+
+import argparse
+import random
+import re
+import time
+
+from protector.guard.matcher import MetricMatcher
+
+
+def make_patterns(count):
+    """
+    Mostly anchored prefixes, like real blockedlists, plus a few unanchored ones
+    """
+    patterns = []
+    for i in range(count):
+        if i % 10 == 9:
+            patterns.append(".*legacy{}.*debug.*".format(i))
+        else:
+            patterns.append("^team{}\\.service{}\\.".format(i % 50, i))
+    return patterns
+
+
+def make_requests(count, names):
+    random.seed(1)
+    return [["team{}.service{}.requests.p{}".format(random.randint(0, 80), random.randint(0, 2000), n)
+             for n in range(names)] for _ in range(count)]
+
+
+def loop_check(patterns, requests):
+    for names in requests:
+        for pattern in patterns:
+            for name in names:
+                if re.match(pattern, name):
+                    break
+
+
+def matcher_check(matcher, requests):
+    for names in requests:
+        for name in names:
+            if matcher.decide(name)[0]:
+                break
+
+
+def measure(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--patterns', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--names', type=int, default=5, help='Metric names per request')
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    requests = make_requests(args.requests, args.names)
+    print("{:>9} {:>14} {:>14} {:>14}".format("patterns", "re.match loop", "matcher cold", "matcher warm"))
+    for count in args.patterns:
+        patterns = make_patterns(count)
+        loop = measure(loop_check, patterns, requests)
+        matcher = MetricMatcher(patterns, cache_size=0)
+        cold = measure(matcher_check, matcher, requests)
+        matcher = MetricMatcher(patterns)
+        matcher_check(matcher, requests)
+        warm = measure(matcher_check, matcher, requests)
+        print("{:>9} {:>11.1f} us {:>11.1f} us {:>11.1f} us".format(
+            count, loop / args.requests * 1e6, cold / args.requests * 1e6, warm / args.requests * 1e6))
+
+
+if __name__ == '__main__':
+    main()
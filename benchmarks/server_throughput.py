@@ -0,0 +1,160 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+"""
+Throughput comparison of the proxy server engines.
+
+Starts a fake OpenTSDB backend with a fixed response latency, puts the
+protector in front of it (once per server engine) and hammers /api/query
+with concurrent clients.
+
+Usage:
+PYTHONPATH=. python benchmarks/server_throughput.py [--clients 200] [--duration 10] [--latency 0.05] [--keepalive]
+"""
+
+import argparse
+import gzip
+import http.client
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+from mock import MagicMock
+from result import Ok
+
+from protector.proxy import request_handler
+from protector.proxy import server
+from protector.proxy import async_server
+
+QUERY = json.dumps({
+    "start": "1h-ago",
+    "queries": [{"metric": "bench.metric", "aggregator": "sum", "downsample": "1m-avg", "filters": []}]
+}).encode()
+
+RESPONSE = json.dumps([
+    {"metric": "bench.metric", "tags": {}, "aggregateTags": [], "dps": {str(1600000000 + i * 60): i for i in range(60)}},
+    {"statsSummary": {"emittedDPs": 60, "queryIdx_00": {}}}
+]).encode()
+RESPONSE_GZIP = gzip.compress(RESPONSE)
+
+
+class BackendHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.05
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(RESPONSE_GZIP)))
+        self.end_headers()
+        self.wfile.write(RESPONSE_GZIP)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BackendServer(server.ThreadingHTTPServer):
+    request_queue_size = 1024
+
+
+class QuietProxyRequestHandler(request_handler.ProxyRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start(httpd):
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def client(port, deadline, counters, keepalive):
+    conn = None
+    while time.time() < deadline:
+        if conn is None:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        try:
+            conn.request("POST", "/api/query", body=QUERY,
+                         headers={"Content-Type": "application/json", "Accept-Encoding": "gzip"})
+            response = conn.getresponse()
+            response.read()
+            counters['ok' if response.status == 200 else 'error'] += 1
+        except Exception:
+            counters['error'] += 1
+            keep = False
+        else:
+            keep = keepalive and not response.will_close
+        if not keep:
+            conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+
+
+def run(server_class, backend_port, clients, duration, keepalive):
+    protector = MagicMock()
+    protector.check.return_value = Ok(True)
+    protector.safe_mode = False
+
+    QuietProxyRequestHandler.protocol_version = "HTTP/1.1"
+    QuietProxyRequestHandler.protector = protector
+    QuietProxyRequestHandler.backend_address = ("127.0.0.1", backend_port)
+    QuietProxyRequestHandler.timeout = 30
+
+    httpd = server_class(("127.0.0.1", 0), QuietProxyRequestHandler)
+    start(httpd)
+
+    counters = {'ok': 0, 'error': 0}
+    deadline = time.time() + duration
+    threads = [threading.Thread(target=client, args=(httpd.server_address[1], deadline, counters, keepalive)) for _ in range(clients)]
+    started = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - started
+
+    httpd.shutdown()
+    httpd.server_close()
+
+    print("{:<10} {:>8} ok {:>6} errors {:>10.1f} req/s".format(
+        server_class.__name__, counters['ok'], counters['error'], counters['ok'] / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Proxy server engine throughput comparison')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--latency', type=float, default=0.05, help='Fake backend latency in seconds')
+    parser.add_argument('--async_workers', type=int, default=64)
+    parser.add_argument('--keepalive', action='store_true', help='Reuse client connections')
+    args = parser.parse_args()
+
+    BackendHandler.latency = args.latency
+    backend = BackendServer(("127.0.0.1", 0), BackendHandler)
+    start(backend)
+
+    async_server.AsyncHTTPServer.max_workers = args.async_workers
+
+    print("clients: {}, duration: {}s, backend latency: {}s, keep-alive: {}".format(
+        args.clients, args.duration, args.latency, args.keepalive))
+    for server_class in (server.ThreadingHTTPServer, async_server.AsyncHTTPServer):
+        run(server_class, backend.server_address[1], args.clients, args.duration, args.keepalive)
+
+    backend.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+"""
+save_stats latency against a Redis server (>= 5.0): the former sequence of commands, one round trip
+each, compared with the single MULTI/EXEC pipeline.
+
+Uses the keys of made up queries in the selected database, and deletes them afterwards.
+
+Usage:
+PYTHONPATH=. python benchmarks/stats_persistence.py [--host localhost] [--port 6379] [--db 15] [--queries 50] [--saves 2000]
+"""
+
+import argparse
+import datetime as dt
+import json
+import statistics
+import time
+
+import redis
+
+from protector.protector_main import Protector
+from protector.query.query import OpenTSDBQuery
+from protector.store.redis_store import RedisStore
+
+
+class Response(object):
+
+    def __init__(self, emitted_dps):
+        self.stats = {'emittedDPs': emitted_dps}
+
+    def get_stats(self):
+        return self.stats
+
+
+def make_queries(count):
+    return [OpenTSDBQuery(json.dumps({
+        "start": "1h-ago",
+        "queries": [{"metric": "bench.metric{}".format(i), "aggregator": "sum", "downsample": "1m-avg", "filters": []}]
+    })) for i in range(count)]
+
+
+def sequential_save_stats(db, ttl, query, response, duration, timeout=False):
+    """
+    The former save_stats, one round trip per command
+    """
+    db.ping()
+    key_prefix = query.get_id()
+    current_time = int(round(time.time()))
+    interval = int((query.get_end_timestamp() - query.get_start_timestamp()) / 60)
+
+    if not db.exists("{}_query".format(key_prefix)):
+        db.set("{}_query".format(key_prefix), json.dumps(query.q), ex=(ttl or None))
+
+    summary = response.get_stats() if response is not None else {}
+    sum_dp = summary.get('emittedDPs', 0)
+    stats = {'timestamp': current_time, 'start': int(query.get_start_timestamp()), 'end': query.get_end(),
+             'duration': duration, 'summary': summary, 'timeout': timeout}
+    db.rpush("{}_stats".format(key_prefix), json.dumps(stats))
+    if ttl and db.ttl("{}_stats".format(key_prefix)) == -1:
+        db.expire("{}_stats".format(key_prefix), ttl)
+
+    interval_key = "{}_{}".format(key_prefix, interval)
+    global_stats = {'duration': duration, 'timestamp': current_time, 'emittedDPs': sum_dp}
+    if not db.hexists(interval_key, 'first_occurrence'):
+        global_stats['first_occurrence'] = current_time
+    db.hset(interval_key, mapping=global_stats)
+    if ttl and db.ttl(interval_key) == -1:
+        db.expire(interval_key, ttl)
+    db.hincrby(interval_key, "total_counter", 1)
+
+    d = dt.datetime.now()
+    for toptype, value in (('dps', sum_dp), ('duration', duration)):
+        top_key = "top_{}_{}_{}".format(toptype, d.day, d.hour)
+        sc = db.zscore(top_key, interval_key)
+        if not sc:
+            db.zadd(top_key, {interval_key: value})
+            if ttl:
+                db.expire(top_key, ttl)
+        elif float(value) > float(sc):
+            db.zadd(top_key, {interval_key: value})
+
+
+def measure(save, queries, saves):
+    latencies = []
+    for i in range(saves):
+        start = time.perf_counter()
+        save(queries[i % len(queries)], Response(i), 0.1 + i % 7)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return statistics.mean(latencies), latencies[int(len(latencies) * 0.99)]
+
+
+def cleanup(db, queries):
+    d = dt.datetime.now()
+    keys = ["top_dps_{}_{}".format(d.day, d.hour), "top_duration_{}_{}".format(d.day, d.hour)]
+    for query in queries:
+        keys.extend(db.keys("{}_*".format(query.get_id())))
+    if keys:
+        db.delete(*keys)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--db', type=int, default=15)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--saves', type=int, default=2000)
+    args = parser.parse_args()
+
+    protector = Protector({}, db_config={'type': 'memory'})
+    db = redis.Redis(host=args.host, port=args.port, db=args.db, decode_responses=True)
+    protector.store = RedisStore(db, ttl=3600)
+    queries = make_queries(args.queries)
+
+    print("{:>12} {:>12} {:>12}".format("", "mean", "p99"))
+    for name, save in (('sequential', lambda *a: sequential_save_stats(db, protector.store.ttl, *a)),
+                       ('pipeline', protector.save_stats)):
+        cleanup(db, queries)
+        mean, p99 = measure(save, queries, args.saves)
+        print("{:>12} {:>9.1f} us {:>9.1f} us".format(name, mean * 1e6, p99 * 1e6))
+    cleanup(db, queries)
+
+
+if __name__ == '__main__':
+    main()
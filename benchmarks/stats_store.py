@@ -0,0 +1,91 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+"""
+Throughput of the stats stores: writes of single records and of batches (as the background stats writer does),
+hash loads (every guarded query) and hourly tops.
+
+The Redis store is only measured with --redis host:port/db, that database is flushed.
+
+Usage:
+PYTHONPATH=. python benchmarks/stats_store.py [--queries 500] [--operations 5000] [--batch 100] [--redis localhost:6379/15]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import redis
+
+from protector.store.memory_store import MemoryStore
+from protector.store.redis_store import RedisStore
+from protector.store.sqlite_store import SqliteStore
+from protector.tests.store_test.test_store import make_record
+
+
+def measure(fn, count):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def run(name, store, args):
+    random.seed(1)
+    records = [make_record("query{}".format(random.randrange(args.queries)), duration=random.random() * 10,
+                           sum_dp=random.randrange(10000), timeout=random.random() < 0.05)
+               for _ in range(args.operations)]
+
+    def single():
+        for record in records:
+            store.write([record])
+
+    def batches():
+        for i in range(0, len(records), args.batch):
+            store.write(records[i:i + args.batch])
+
+    def loads():
+        for record in records:
+            store.load(record['interval_key'])
+
+    def tops():
+        for _ in range(args.operations // 100):
+            store.top('duration', [(1, hour) for hour in range(23, -1, -1)], 100)
+
+    results = [measure(single, len(records)), measure(batches, len(records)), measure(loads, len(records)),
+               measure(tops, args.operations // 100)]
+    print("{:>8} {:>11.1f} us {:>11.1f} us {:>11.1f} us {:>11.1f} us".format(name, *results))
+    store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--operations', type=int, default=5000)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--redis', help='host:port/db of a Redis server (>= 5.0), flushed')
+    args = parser.parse_args()
+
+    print("{:>8} {:>14} {:>14} {:>14} {:>14}".format("store", "write", "batch write", "load", "top"))
+    run("memory", MemoryStore(ttl=3600), args)
+    with tempfile.TemporaryDirectory() as directory:
+        run("sqlite", SqliteStore(os.path.join(directory, "stats.db"), ttl=3600), args)
+    if args.redis:
+        address, db = args.redis.split('/')
+        host, port = address.split(':')
+        client = redis.Redis(host=host, port=int(port), db=int(db), decode_responses=True)
+        client.flushdb()
+        run("redis", RedisStore(client, ttl=3600), args)
+        client.flushdb()
+
+
+if __name__ == '__main__':
+    main()
@@ -13,9 +13,8 @@ import sys
 import daemonocle
 
 
-from protector.daemon import ProtectorDaemon
 from protector.config import loader
-from protector.protector_main import Protector
+from protector import metrics
 
 __title__ = 'opentsdb-protector'
 __author__ = 'Valentin Rojco'
@@ -107,6 +106,13 @@ def start_proxy(config):
     :param config:
     :return:
     """
+    if config.workers > 1:
+        # Must happen before prometheus_client is imported
+        metrics.enable_multiprocess(config.metrics_dir)
+
+    from protector.daemon import ProtectorDaemon
+    from protector.protector_main import Protector
+
     protector = Protector(config.rules, config.blockedlist, config.allowedlist, config.db, config.safe_mode)
     protector_daemon = ProtectorDaemon(config=config, protector=protector)
 
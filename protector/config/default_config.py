@@ -15,8 +15,101 @@ DEFAULT_CONFIG = {
     # Connection to the time series database API
     'backend_host': 'localhost',
     'backend_port': 4242,
+    # Keep-alive connections to the backend: max connections (0 = unlimited)
+    # and seconds after which idle connections are closed
+    'backend_pool_size': 64,
+    'backend_pool_idle_timeout': 30,
     'safe_mode': False,
     'timeout': 20,
+    # Server engine: 'threading' (one thread per connection)
+    # or 'asyncio' (event loop + bounded pool of request processing threads)
+    'server_mode': 'threading',
+    # Number of worker processes sharing the port, each with its own server.
+    # Prometheus metrics of all workers are aggregated in metrics_dir (temporary directory if empty)
+    'workers': 1,
+    'metrics_dir': None,
+    # Size of the request processing pool in asyncio mode
+    'async_workers': 64,
+    # Number of handler threads in threading mode (0 starts a thread per connection)
+    'server_threads': 0,
+    # Requests waiting for a handler thread (server_threads or async_workers busy),
+    # beyond that they are rejected right away with a 503 and a Retry-After of shed_retry_after seconds
+    'server_queue': 256,
+    'shed_retry_after': 1,
+    # Persistent client connections: idle timeout in seconds (0 disables keep-alive)
+    # and max number of requests per connection
+    'keepalive_timeout': 5,
+    'keepalive_max_requests': 100,
+    # Send gzip/deflate query results to the client as received from the backend
+    # (the statsSummary element is not removed), stats are read from a decompressed copy
+    'compressed_passthrough': False,
+    # Compression level (1-9) used when query results are re-encoded
+    'compression_level': 6,
+    # Max /api/query requests outstanding against the backend (0 means unlimited), plus optional
+    # caps per metric name pattern, e.g. [{'pattern': '^sys\\.cpu\\.', 'limit': 4}].
+    # Queries wait up to backend_limit_wait seconds for a slot and are rejected with a 503 afterwards
+    'backend_max_queries': 0,
+    'backend_metric_limits': [],
+    'backend_limit_wait': 10,
+    # Identical /api/query requests in flight (same query and time range) share one backend response
+    'coalesce_queries': True,
+    # In-process cache of query results, bounded by size in bytes (0 disables it).
+    # Results of ranges ending less than response_cache_recent_window seconds ago are kept
+    # response_cache_recent_ttl seconds, older ones response_cache_historical_ttl seconds
+    'response_cache_max_bytes': 0,
+    'response_cache_recent_ttl': 10,
+    'response_cache_historical_ttl': 3600,
+    'response_cache_recent_window': 600,
+    # Relative, downsampled queries: keep the datapoints older than tail_cache_settle seconds for up to
+    # tail_cache_entries queries and only fetch the newer ones on refresh (0 disables it)
+    'tail_cache_entries': 0,
+    'tail_cache_settle': 120,
+    # Query results cache in Redis (db.redis), shared by all protector instances. Entries are compressed,
+    # larger ones than shared_cache_max_entry_bytes are not cached and expire like the response cache ones.
+    # A single instance fills a missing entry, the others wait up to shared_cache_lock_timeout seconds for it
+    'shared_cache': False,
+    'shared_cache_max_entry_bytes': 1048576,
+    'shared_cache_lock_timeout': 30,
+    # Idempotent GET endpoints cached with their TTL in seconds (empty list disables the cache)
+    # and max number of cached responses. Clients can revalidate them with If-None-Match
+    'metadata_cache': [
+        {'path': '/api/suggest', 'ttl': 60},
+        {'path': '/api/search/lookup', 'ttl': 60},
+        {'path': '/api/aggregators', 'ttl': 3600},
+        {'path': '/api/config', 'ttl': 3600},
+    ],
+    'metadata_cache_entries': 1024,
+    # Path label of the request metrics: the path without query string, or the label of the first route
+    # whose pattern matches it ({'pattern': <regular expression>, 'label': <label>}, before the OpenTSDB ones).
+    # Beyond metrics_max_paths different labels (0 = no limit), unknown paths are labelled 'other'
+    'metrics_path_routes': [],
+    'metrics_max_paths': 100,
+    # Local copy of the query stats read from Redis, used for stats_cache_ttl seconds (0 disables it)
+    # for up to stats_cache_entries queries. Local writes update it, with stats_cache_notifications
+    # the writes of other instances do too (requires notify-keyspace-events Khg on the Redis server)
+    'stats_cache_ttl': 0,
+    'stats_cache_entries': 10000,
+    'stats_cache_notifications': False,
+    # Write the query stats on a background thread, stats_writer_batch records per Redis round trip at most
+    # every stats_writer_interval seconds. Up to stats_writer_queue records wait to be written, once full a
+    # request waits up to stats_writer_block seconds for room (0 drops the record right away)
+    'stats_writer': False,
+    'stats_writer_queue': 10000,
+    'stats_writer_batch': 100,
+    'stats_writer_interval': 1,
+    'stats_writer_block': 0,
+    # Every stats_compaction_interval seconds (0 disables it), drop the executions older than
+    # stats_compaction_retention seconds from the query histories (they remain in the hourly aggregates)
+    # and the hourly aggregates older than stats_compaction_hourly_retention seconds (0 keeps them),
+    # stats_compaction_batch keys per Redis round trip
+    'stats_compaction_interval': 0,
+    'stats_compaction_retention': 86400,
+    'stats_compaction_hourly_retention': 0,
+    'stats_compaction_batch': 100,
+    # Queries per hour or day returned by /top/duration and /top/dps, unless the request sets a limit,
+    # which can't exceed top_max_limit
+    'top_limit': 100,
+    'top_max_limit': 1000,
     'rules': {
         'query_no_tags_filters': None,
         'query_no_aggregator': None,
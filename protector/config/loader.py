@@ -8,7 +8,7 @@
 #  written permission of Adobe.
 #
 
-import collections
+import collections.abc
 import yaml
 import logging
 import argparse
@@ -91,7 +91,7 @@ def flatten(d, parent_key='', sep='_'):
     items = []
     for k, v in d.items():
         new_key = parent_key + sep + k if parent_key else k
-        if isinstance(v, collections.MutableMapping):
+        if isinstance(v, collections.abc.MutableMapping):
             items.extend(flatten(v, new_key, sep=sep).items())
         else:
             items.append((new_key, v))
@@ -109,6 +109,8 @@ def parse_args(args=sys.argv[1:]):
                         help='OpenTSDB hostname (default: localhost)')
     parser.add_argument('--backend_port', type=int, default=argparse.SUPPRESS,
                         help='OpenTSDB port (default: 4242)')
+    parser.add_argument('--server_mode', type=str, choices=('threading', 'asyncio'), default=argparse.SUPPRESS,
+                        help='Server engine (default: threading)')
     parser.add_argument('-c', '--configfile', type=str, default=argparse.SUPPRESS,
                         help='Configfile path (default: None)')
     parser.add_argument('-v', '--verbose', action='count', default=argparse.SUPPRESS,
@@ -13,28 +13,66 @@
 import logging
 import logging.handlers as handlers
 
+import os
+import signal
 import sys
+import time
+
+from protector import metrics
+from protector import redis_client
+from protector import stats_cache
+from protector import stats_compactor
+from protector import stats_writer
+from protector.store.memory_store import MemoryStore
+from protector.store.redis_store import RedisStore
 
 from protector.proxy import server
+from protector.proxy import async_server
 from protector.proxy import request_handler
+from protector.proxy import http_request
+from protector.proxy import limiter
+from protector.proxy import coalescer
+from protector.proxy import response_cache
+from protector.proxy import tail_cache
+from protector.proxy import shared_cache
+from protector.proxy import metadata_cache
+from protector.proxy import path_labels
 
 
 class ProtectorDaemon(object):
+
+    server_classes = {
+        'threading': server.ThreadingHTTPServer,
+        'asyncio': async_server.AsyncHTTPServer
+    }
+
     def __init__(self,
                  config,
                  protector,
                  handler_class=request_handler.ProxyRequestHandler,
-                 server_class=server.ThreadingHTTPServer,
+                 server_class=None,
                  protocol="HTTP/1.1"
                  ):
         self.config = config
         self.protector = protector
         self.handler_class = handler_class
-        self.server_class = server_class
+        self.server_class = server_class or self.get_server_class(config.server_mode)
         self.protocol = protocol
 
+        # StatsCompactor, run by a single worker process unless each worker has its own store
+        self.stats_compactor = None
+        self.compactor_pid = None
+
+    def get_server_class(self, server_mode):
+        if server_mode not in self.server_classes:
+            raise Exception("Unknown server_mode: {}. Supported: {}".format(server_mode, ", ".join(self.server_classes)))
+        return self.server_classes[server_mode]
+
     def show_startup_message(self):
-        logging.info("Serving Protector on {}:{}...".format(self.config.host, self.config.port))
+        logging.info("Serving Protector on {}:{} ({} mode)...".format(self.config.host, self.config.port,
+                                                                    self.config.server_mode))
+        if self.config.workers > 1:
+            logging.info("Running {} worker processes".format(self.config.workers))
         logging.info("Backend host (connection to Time Series Database) at {}:{}...".format(self.config.backend_host,
                                                                                             self.config.backend_port))
         logging.info("The following rules are enabled:")
@@ -72,9 +110,163 @@ class ProtectorDaemon(object):
         self.handler_class.protector = self.protector
         self.handler_class.backend_address = backend_address
         self.handler_class.timeout = self.config.timeout
+        self.handler_class.keepalive_timeout = self.config.keepalive_timeout
+        self.handler_class.keepalive_max_requests = self.config.keepalive_max_requests
+        self.handler_class.compressed_passthrough = self.config.compressed_passthrough
+        self.handler_class.compression_level = self.config.compression_level
+        self.handler_class.path_labels = path_labels.PathLabels(self.config.metrics_path_routes,
+                                                                self.config.metrics_max_paths)
+
+        http_request.HTTPRequest.max_pool_size = self.config.backend_pool_size
+        http_request.HTTPRequest.pool_idle_timeout = self.config.backend_pool_idle_timeout
+
+        if self.config.backend_max_queries or self.config.backend_metric_limits:
+            self.handler_class.limiter = limiter.ConcurrencyLimiter(self.config.backend_max_queries,
+                                                                    self.config.backend_metric_limits,
+                                                                    self.config.backend_limit_wait)
+        if self.config.coalesce_queries:
+            self.handler_class.coalescer = coalescer.Coalescer()
+        ttl = response_cache.FreshnessTTL(self.config.response_cache_recent_ttl,
+                                          self.config.response_cache_historical_ttl,
+                                          self.config.response_cache_recent_window)
+        if self.config.response_cache_max_bytes:
+            self.handler_class.response_cache = response_cache.ResponseCache(self.config.response_cache_max_bytes, ttl)
+        if self.config.shared_cache:
+            db = redis_client.connect(self.config.db['redis'])
+            circuit = redis_client.CircuitBreaker(self.config.db.get('circuit_failures', 3),
+                                                  self.config.db.get('circuit_backoff', 10))
+            self.handler_class.shared_cache = shared_cache.SharedCache(db, self.config.shared_cache_max_entry_bytes, ttl,
+                                                                       self.config.shared_cache_lock_timeout,
+                                                                       compression_level=self.config.compression_level,
+                                                                       circuit=circuit)
+        if self.config.metadata_cache:
+            self.handler_class.metadata_cache = metadata_cache.MetadataCache(self.config.metadata_cache,
+                                                                             self.config.metadata_cache_entries)
+        if self.config.tail_cache_entries:
+            self.handler_class.tail_cache = tail_cache.TailCache(self.config.tail_cache_entries,
+                                                                 self.config.tail_cache_settle)
+
+        self.protector.top_limit = self.config.top_limit
+        self.protector.top_max_limit = self.config.top_max_limit
+        if self.config.stats_cache_ttl:
+            self.protector.stats_cache = stats_cache.StatsCache(self.config.stats_cache_ttl,
+                                                                self.config.stats_cache_entries)
+        if self.config.stats_writer:
+            self.protector.stats_writer = stats_writer.StatsWriter(self.protector.write_stats,
+                                                                   self.config.stats_writer_queue,
+                                                                   self.config.stats_writer_batch,
+                                                                   self.config.stats_writer_interval,
+                                                                   self.config.stats_writer_block)
+        if self.config.stats_compaction_interval:
+            self.stats_compactor = stats_compactor.StatsCompactor(self.protector.store,
+                                                                  self.config.stats_compaction_interval,
+                                                                  self.config.stats_compaction_retention,
+                                                                  self.config.stats_compaction_hourly_retention,
+                                                                  self.config.stats_compaction_batch)
+
+        if self.server_class is async_server.AsyncHTTPServer:
+            self.server_class.max_workers = self.config.async_workers
+        else:
+            self.server_class.max_threads = self.config.server_threads
+        self.server_class.max_queue = self.config.server_queue
+        self.server_class.retry_after = self.config.shed_retry_after
+
+        if self.config.workers > 1:
+            self.run_workers(server_address)
+        else:
+            httpd = self.server_class(server_address, self.handler_class)
+            self.start_background_tasks()
+            try:
+                self.serve_forever(httpd)
+            finally:
+                self.stop_background_tasks()
+
+    def run_workers(self, server_address):
+        """
+        Fork the configured number of worker processes, all serving the same port (SO_REUSEPORT),
+        and restart them if they exit. Runs until the daemon is stopped.
+        """
+        self.server_class.reuse_port = True
+        workers = {}
+
+        try:
+            for _ in range(self.config.workers):
+                self.spawn_worker(workers, server_address)
+
+            while True:
+                pid, status = os.wait()
+                if pid not in workers:
+                    continue
+
+                started = workers.pop(pid)
+                metrics.mark_process_dead(pid)
+                logging.error("Worker {} exited with status {}, restarting".format(pid, status))
+
+                # Don't spin if workers die right after start
+                if time.time() - started < 1:
+                    time.sleep(1)
+                self.spawn_worker(workers, server_address)
+        finally:
+            for pid in workers:
+                os.kill(pid, signal.SIGTERM)
+            for pid in workers:
+                os.waitpid(pid, 0)
+                metrics.mark_process_dead(pid)
+
+    def spawn_worker(self, workers, server_address):
+        compact = isinstance(self.protector.store, MemoryStore) or self.compactor_pid not in workers
+        pid = os.fork()
+        if pid:
+            workers[pid] = time.time()
+            if compact:
+                self.compactor_pid = pid
+            logging.info("Started worker {}".format(pid))
+            return
+
+        # Worker process: the supervisor owns the pidfile and the shutdown hooks
+        signal.signal(signal.SIGTERM, self.exit_worker)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 0
+        try:
+            httpd = self.server_class(server_address, self.handler_class)
+            self.start_background_tasks(compact)
+            self.serve_forever(httpd)
+        except Exception as e:
+            logging.error("Worker {} failed: {}".format(os.getpid(), e))
+            code = 1
+        finally:
+            self.stop_background_tasks()
+            os._exit(code)
+
+    @staticmethod
+    def exit_worker(signum, frame):
+        # Unwinds serve_forever, so that the worker stops its background tasks
+        raise SystemExit(0)
+
+    def start_background_tasks(self, compact=True):
+        """
+        Start the threads serving a process, once forked
+        :param compact: Whether the process compacts the stats
+        """
+        store = self.protector.store
+        if self.protector.stats_cache and self.config.stats_cache_notifications and isinstance(store, RedisStore):
+            try:
+                self.protector.stats_cache.listen(store.db)
+            except Exception as e:
+                logging.error("Could not subscribe to keyspace notifications: {}".format(e))
+        if self.protector.stats_writer:
+            self.protector.stats_writer.start()
+        if self.stats_compactor and compact:
+            self.stats_compactor.start()
 
-        httpd = self.server_class(server_address, self.handler_class)
-        self.serve_forever(httpd)
+    def stop_background_tasks(self):
+        """
+        Write the stats still queued before the process exits
+        """
+        if self.protector.stats_writer:
+            self.protector.stats_writer.stop()
+        if self.stats_compactor:
+            self.stats_compactor.stop()
 
     @staticmethod
     def serve_forever(httpd):
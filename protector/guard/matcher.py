@@ -0,0 +1,152 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import functools
+import re
+
+# Characters with a special meaning in a pattern
+SPECIAL = set('.^$*+?{}[]\\|()')
+# Quantifiers, they apply to the character before them
+QUANTIFIERS = set('*+?{')
+
+
+def has_alternatives(pattern):
+    """
+    :return: True if the pattern has a | outside of groups and character sets
+    """
+    depth = 0
+    in_set = False
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 1
+        elif in_set:
+            in_set = c != ']'
+        elif c == '[':
+            in_set = True
+            # A ] right after [ (or [^) is a literal
+            if pattern[i + 1:i + 2] == '^':
+                i += 1
+            if pattern[i + 1:i + 2] == ']':
+                i += 1
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            return True
+        i += 1
+    return False
+
+
+def literal_prefix(pattern):
+    """
+    Split a pattern (applied with re.match) into the literal text every match starts with and the rest
+    Example: '^sys\\.cpu\\..*user' => ('sys.cpu.', '.*user')
+    :return: (prefix, rest of the pattern)
+    """
+    if has_alternatives(pattern):
+        # Alternatives may not share a prefix
+        return '', pattern
+
+    i = 1 if pattern.startswith('^') else 0
+    prefix = []
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                # Character class (\d, \w, ...) or back reference
+                break
+            literal, step = pattern[i + 1], 2
+        elif c in SPECIAL:
+            break
+        else:
+            literal, step = c, 1
+        if i + step < len(pattern) and pattern[i + step] in QUANTIFIERS:
+            break
+        prefix.append(literal)
+        i += step
+    return ''.join(prefix), pattern[i:]
+
+
+class Pattern(object):
+
+    def __init__(self, pattern, index, blocked):
+        self.pattern = pattern
+        self.index = index
+        self.blocked = blocked
+        self.prefix, self.rest = literal_prefix(pattern)
+        self.regex = re.compile(pattern)
+
+    def matches(self, name):
+        """
+        :param name: Metric name, known to start with the prefix
+        """
+        if not self.rest:
+            return True
+        return self.regex.match(name) is not None
+
+
+class MetricMatcher(object):
+    """
+    The blockedlist and the allowedlist compiled into one matcher.
+
+    Patterns are indexed in a trie by their literal prefix, so a metric name is only checked
+    against the patterns whose prefix it starts with (and the ones without a prefix).
+    Decisions are kept in a bounded LRU cache, as dashboards keep querying the same metrics.
+    """
+
+    def __init__(self, blockedlist=None, allowedlist=None, cache_size=10000):
+        blockedlist = list(blockedlist or [])
+        allowedlist = list(allowedlist or [])
+
+        self.patterns = [Pattern(p, i, True) for i, p in enumerate(blockedlist)]
+        self.patterns += [Pattern(p, i, False) for i, p in enumerate(allowedlist)]
+        self.allowed_count = len(allowedlist)
+
+        # Nested dicts keyed by character, patterns ending at a node are listed under the None key
+        self.trie = {}
+        for pattern in self.patterns:
+            node = self.trie
+            for c in pattern.prefix:
+                node = node.setdefault(c, {})
+            node.setdefault(None, []).append(pattern)
+
+        self.decide = functools.lru_cache(maxsize=cache_size)(self._decide)
+
+    def candidates(self, name):
+        """
+        :return: Patterns whose literal prefix the name starts with
+        """
+        node = self.trie
+        found = list(node.get(None, []))
+        for c in name:
+            node = node.get(c)
+            if node is None:
+                break
+            found.extend(node.get(None, []))
+        return found
+
+    def _decide(self, name):
+        """
+        :return: (blocked, allowed) blocked if any blockedlist pattern matches the name,
+                 allowed if every allowedlist pattern does (and there are some)
+        """
+        blocked = False
+        allowed_matches = set()
+        for pattern in self.candidates(name):
+            if not pattern.matches(name):
+                continue
+            if pattern.blocked:
+                blocked = True
+            else:
+                allowed_matches.add(pattern.index)
+        return blocked, bool(self.allowed_count) and len(allowed_matches) == self.allowed_count
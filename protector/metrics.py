@@ -0,0 +1,71 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+"""
+Prometheus metrics exposition, aggregated across worker processes if there are several.
+
+prometheus_client decides between in-process and multiprocess metric values when it is
+first imported, so enable_multiprocess() has to run before anything imports it.
+This module therefore only imports prometheus_client inside its functions.
+"""
+
+import glob
+import os
+import tempfile
+
+MULTIPROC_ENV = ('prometheus_multiproc_dir', 'PROMETHEUS_MULTIPROC_DIR')
+
+
+def enable_multiprocess(path=None):
+    """
+    Store metric values in files shared by all worker processes
+    :param path: Directory for the metric files, a temporary one is created if empty
+    :return: The directory in use
+    """
+    if not path:
+        path = tempfile.mkdtemp(prefix='protector-metrics-')
+    os.makedirs(path, exist_ok=True)
+
+    # Values left over from a previous run would be added to ours
+    for f in glob.glob(os.path.join(path, '*.db')):
+        os.remove(f)
+
+    for env in MULTIPROC_ENV:
+        os.environ[env] = path
+    return path
+
+
+def is_multiprocess():
+    return any(env in os.environ for env in MULTIPROC_ENV)
+
+
+def generate_latest():
+    """
+    :return: Metrics in the Prometheus text format
+    """
+    from prometheus_client import generate_latest, CollectorRegistry
+    from prometheus_client import multiprocess
+
+    if not is_multiprocess():
+        return generate_latest()
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def mark_process_dead(pid):
+    """
+    Drop the live gauges of a worker process which has exited
+    """
+    from prometheus_client import multiprocess
+
+    if is_multiprocess():
+        multiprocess.mark_process_dead(pid)
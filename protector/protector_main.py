@@ -12,21 +12,35 @@ import logging
 import time
 import datetime as dt
 from result import Ok, Err
-import re
 import json
-import redis
 
+from protector import redis_client
+from protector.store import history
+from protector.store import sketch
+from protector.store.base import StoreError
+from protector.store.loader import load_store
 from protector.guard.guard import Guard
+from protector.guard.matcher import MetricMatcher
 from prometheus_client import Counter, Summary, Histogram, Gauge
 
+# Tops are kept by day of the month, so that ranges can't span more than a month
+TOP_MAX_HOURS = 7 * 24
+TOP_MAX_DAYS = 28
+
 
 class Protector(object):
     """
     The main protector class which checks for malicious queries
     """
 
-    db = None
-    ttl = 0
+    store = None
+    # StatsCache, local copy of the interval stats
+    stats_cache = None
+    # StatsWriter, writes the stats in the background
+    stats_writer = None
+    # Queries per bucket returned by get_top by default and at most
+    top_limit = 100
+    top_max_limit = 1000
 
     def __init__(self, rules, blockedlist=[], allowedlist=[], db_config={}, safe_mode=False):
         """
@@ -38,18 +52,15 @@ class Protector(object):
         """
         self.guard = Guard(rules)
 
+        self._blockedlist = []
+        self._allowedlist = []
         self.blockedlist = blockedlist
         self.allowedlist = allowedlist
         self.safe_mode = safe_mode
 
-        if db_config.get('expire', 0) > 0:
-            self.ttl = db_config['expire']
-
-        self.db = redis.Redis(
-            host=db_config['redis']['host'],
-            port=db_config['redis']['port'],
-            password=db_config['redis']['password'],
-            decode_responses=True)
+        self.store = load_store(db_config)
+        self.circuit = redis_client.CircuitBreaker(db_config.get('circuit_failures', 3),
+                                                   db_config.get('circuit_backoff', 10))
 
         self.REQUESTS_COUNT = Counter('requests_total', 'Total number of requests', ['method', 'path', 'return_code'])
         self.REQUESTS_BLOCKED = Counter('requests_blocked', 'Total number of blocked requests. Tags: safe mode, matched rule', ['safe_mode', 'rule'])
@@ -64,28 +75,43 @@ class Protector(object):
         # Prometheus histogram based on query start time age in days
         self.TSDB_REQUEST_INTERVAL = Histogram('tsdb_request_interval', 'OpenTSDB Requests interval based on query start time', ['interval'],buckets=(1,30,90))
 
+    @property
+    def blockedlist(self):
+        return self._blockedlist
+
+    @blockedlist.setter
+    def blockedlist(self, patterns):
+        self._blockedlist = patterns
+        self.matcher = MetricMatcher(self._blockedlist, self._allowedlist)
+
+    @property
+    def allowedlist(self):
+        return self._allowedlist
+
+    @allowedlist.setter
+    def allowedlist(self, patterns):
+        self._allowedlist = patterns
+        self.matcher = MetricMatcher(self._blockedlist, self._allowedlist)
+
     def check(self, query):
 
         logging.debug("Checking OpenTSDBQuery: {}".format(query.get_id()))
 
         if query:
             qs_names = query.get_metric_names()
+            # (blocked, allowed) for every metric name
+            decisions = [self.matcher.decide(qn) for qn in qs_names]
 
-            if self.blockedlist:
-                for pattern in self.blockedlist:
-                    for qn in qs_names:
-                        match = re.match(pattern, qn)
-                        if match:
-                            return Err({"msg": "Metric name: {} is blocked".format(qn), "rule": "blockedlist"})
+            for qn, (blocked, _) in zip(qs_names, decisions):
+                if blocked:
+                    return Err({"msg": "Metric name: {} is blocked".format(qn), "rule": "blockedlist"})
 
             if self.allowedlist:
                 all_match = True
-                for pattern in self.allowedlist:
-                    for qn in qs_names:
-                        match = re.match(pattern, qn)
-                        all_match = all_match and bool(match)
-                        if match:
-                            logging.info("Allowedlist metric matched: {}".format(qn))
+                for qn, (_, allowed) in zip(qs_names, decisions):
+                    all_match = all_match and allowed
+                    if allowed:
+                        logging.info("Allowedlist metric matched: {}".format(qn))
 
                 if all_match:
                     self.REQUESTS_ALLOWEDLIST_MATCHED.inc()
@@ -98,63 +124,23 @@ class Protector(object):
             logging.info(error_msg)
             return Err({"msg": error_msg})
 
-    def set_top_duration(self, key_prefix, interval, duration):
-
-        # Get current day of the month and hour of the day
-        d = dt.datetime.now()
-        hour = d.hour
-        day = d.day
-
-        # Top durations
-        top_duration_key = "top_duration_{}_{}".format(day, hour)
-        zkey = "{}_{}".format(key_prefix, interval)
-
-        sc = self.db.zscore(top_duration_key, zkey)
-
-        if not sc:
-            self.db.zadd(top_duration_key, {zkey: duration})
-            if self.ttl:
-                self.db.expire(top_duration_key, self.ttl)
-        else:
-            if float(duration) > float(sc):
-                self.db.zadd(top_duration_key, {zkey: duration})
-        ###
-
-    def set_top_dps(self, key_prefix, interval, sum_dp):
-
-        # Get current day of the month and hour of the day
-        d = dt.datetime.now()
-        hour = d.hour
-        day = d.day
-
-        # Top datapoints
-        top_dps_key = "top_dps_{}_{}".format(day, hour)
-        zkey = "{}_{}".format(key_prefix, interval)
-
-        sc = self.db.zscore(top_dps_key, zkey)
-
-        if not sc:
-            self.db.zadd(top_dps_key, {zkey: sum_dp})
-            if self.ttl:
-                self.db.expire(top_dps_key, self.ttl)
-        else:
-            if int(sum_dp) > int(sc):
-                self.db.zadd(top_dps_key, {zkey: sum_dp})
-        ###
-
     def save_stats(self, query, response, duration, timeout=False):
+        """
+        Record a query execution, through the background writer if there is one
+        """
+        record = self.stats_record(query, response, duration, timeout)
+        if self.stats_writer:
+            self.stats_writer.put(record)
+        else:
+            self.write_stats([record])
 
-        try:
-            self.db.ping()
-        except Exception as e:
-            logging.error("Redis server connection issue: {}".format(e))
-            return
-
+    def stats_record(self, query, response, duration, timeout=False):
+        """
+        :return: The stats of a query execution, as written by write_stats
+        """
         key_prefix = query.get_id()
 
-        time_raw = time.time()
-        current_time = int(round(time_raw))
-        current_time_milli = int(round(time_raw * 1000))
+        current_time = int(round(time.time()))
 
         end_time = query.get_end_timestamp()
         start_time = query.get_start_timestamp()
@@ -162,10 +148,6 @@ class Protector(object):
 
         logging.info("[{}] start: {}, end: {}, interval: {} minutes".format(query.get_id(), int(query.get_start_timestamp()), end_time, interval))
 
-        # store query
-        if not self.db.exists("{}_{}".format(key_prefix, 'query')):
-            self.db.set("{}_{}".format(key_prefix, 'query'), json.dumps(query.q), ex=(self.ttl or None))
-
         # store query summary stats + meta
         summary = {}
         if response is not None:
@@ -173,6 +155,9 @@ class Protector(object):
 
         sum_dp = summary.get('emittedDPs', 0)
 
+        if sum_dp > 0:
+            self.DATAPOINTS_SERVED_COUNT.inc(sum_dp)
+
         # Let's record everything!
         stats = {
             'timestamp': current_time, # query execution timestamp
@@ -183,17 +168,6 @@ class Protector(object):
             'timeout': timeout
         }
 
-        # Push/create stats list
-        self.db.rpush("{}_{}".format(key_prefix, 'stats'), json.dumps(stats))
-
-        # Set TTL if supplied
-        if self.ttl:
-            if self.db.ttl("{}_{}".format(key_prefix, 'stats')) == -1:
-                self.db.expire("{}_{}".format(key_prefix, 'stats'), self.ttl)
-
-        if sum_dp > 0:
-            self.DATAPOINTS_SERVED_COUNT.inc(sum_dp)
-
         global_stats = {
             'duration': duration, # last query duration
             'timestamp': current_time # last query timestamp
@@ -204,79 +178,169 @@ class Protector(object):
         else:
             global_stats["emittedDPs"] = sum_dp
 
-        if not self.db.hexists("{}_{}".format(key_prefix, interval), 'first_occurrence'):
-            global_stats['first_occurrence'] = current_time
+        # Current day of the month and hour of the day
+        d = dt.datetime.now()
 
-        self.db.hmset("{}_{}".format(key_prefix, interval), global_stats)
+        return {
+            'id': key_prefix,
+            'query': json.dumps(query.q),
+            'stats': history.encode(stats),
+            'hourly': history.increments(stats),
+            'hourly_max': history.hourly_max(stats),
+            'sketch': sketch.increments(interval, duration, None if timeout else sum_dp),
+            'interval_key': "{}_{}".format(key_prefix, interval),
+            'global_stats': global_stats,
+            'timestamp': current_time,
+            'duration': duration,
+            'sum_dp': sum_dp,
+            'timeout': timeout,
+            'day': d.day,
+            'hour': d.hour
+        }
 
-        # Set TTL if supplied
-        if self.ttl:
-            if self.db.ttl("{}_{}".format(key_prefix, interval)) == -1:
-                self.db.expire("{}_{}".format(key_prefix, interval), self.ttl)
+    def write_stats(self, records):
+        """
+        Write query execution records
+        :return: True if the records were written
+        """
+        if not self.circuit.allow():
+            return False
 
-        # Total counter, for convenience. Should match LLEN of stats list
-        self.db.hincrby("{}_{}".format(key_prefix, interval), "total_counter", 1)
+        start = time.time()
+        try:
+            created = self.store.write(records)
+        except StoreError as e:
+            self.circuit.failure(e)
+            return False
+        self.circuit.success()
+
+        for record, hash_created in zip(records, created):
+            if self.stats_cache:
+                global_stats = dict(record['global_stats'])
+                if hash_created:
+                    global_stats['first_occurrence'] = record['timestamp']
+                increments = {'total_counter': 1}
+                if record['timeout']:
+                    increments['timeout_counter'] = 1
+                self.stats_cache.update(record['interval_key'], global_stats, increments, hash_created)
+
+            if not record['timeout']:
+                logging.info("[{}] emittedDPs: {}".format(record['id'], record['sum_dp']))
+            logging.info("[{}] duration: {}".format(record['id'], record['duration']))
+            logging.info("[{}] stats saved".format(record['id']))
+
+        logging.debug("Time spent in write_stats: {} ms ({} records)".format(int((time.time() - start) * 1000),
+                                                                             len(records)))
+        return True
 
-        if timeout:
-            self.db.hincrby("{}_{}".format(key_prefix, interval), "timeout_counter", 1)
-        else:
-            # DPS, if not timeout
-            logging.info("[{}] emittedDPs: {}".format(query.get_id(), sum_dp))
+    def load_stats(self, query):
 
-            # Save dps stats
-            self.set_top_dps(key_prefix, interval, sum_dp)
+        end_time = query.get_end_timestamp()
 
-        logging.info("[{}] duration: {}".format(query.get_id(), duration))
+        interval = int((end_time - query.get_start_timestamp()) / 60)
+        key = "{}_{}".format(query.get_id(), interval)
 
-        # Save duration stats
-        self.set_top_duration(key_prefix, interval, duration)
+        if self.stats_cache:
+            found, stats = self.stats_cache.get(key)
+            if found:
+                if stats:
+                    logging.info("[{}] Found previous stats for this interval: {} minutes (cached)".format(query.get_id(), interval))
+                    query.set_stats(stats)
+                return
 
-        logging.info("[{}] stats saved".format(query.get_id()))
+        if not self.circuit.allow():
+            return
 
-        now_time = int(round(time.time() * 1000))
-        logging.debug("Time spent in save_stats: {} ms".format(now_time - current_time_milli))
+        try:
+            # Empty if there are no stats
+            stats = self.store.load(key)
+        except StoreError as e:
+            self.circuit.failure(e)
+            return
+        self.circuit.success()
 
-    def load_stats(self, query):
+        if stats:
+            logging.info("[{}] Found previous stats for this interval: {} minutes".format(query.get_id(), interval))
+            query.set_stats(stats)
 
-        try:
-            self.db.ping()
-        except Exception as e:
-            logging.error("Redis server connection issue: {}".format(e))
+        if self.stats_cache:
+            self.stats_cache.put(key, stats)
+
+    def get_stats(self, query_id):
+        """
+        :return: JSON {'intervals': {interval: {'duration': summary, 'dps': summary}}, 'all': summary of all intervals}
+                 with the count and quantiles of the query executions (see sketch.Sketch.summary),
+                 None if the store could not be read
+        """
+        if not self.circuit.allow():
             return
 
-        end_time = query.get_end_timestamp()
+        try:
+            sketches = self.store.sketches(query_id)
+        except StoreError as e:
+            self.circuit.failure(e)
+            return
+        self.circuit.success()
 
-        interval = int((end_time - query.get_start_timestamp()) / 60)
-        key = "{}_{}".format(query.get_id(), interval)
+        merged = {'duration': sketch.Sketch(), 'dps': sketch.Sketch()}
+        intervals = {}
+        for interval, interval_sketches in sorted(sketches.items()):
+            intervals[interval] = {name: values.summary() for name, values in interval_sketches.items()}
+            for name, values in interval_sketches.items():
+                merged[name].merge(values)
 
-        if self.db.exists(key):
-            logging.info("[{}] Found previous stats for this interval: {} minutes".format(query.get_id(), interval))
-            query.set_stats(self.db.hgetall(key))
+        data = {'intervals': intervals, 'all': {name: values.summary() for name, values in merged.items()}}
+        return json.dumps(data).encode()
 
-    def get_top(self, toptype="duration"):
+    def get_top(self, toptype="duration", limit=None, offset=0, hours=None, days=None):
+        """
+        :param limit: Max queries per bucket, top_limit by default
+        :param offset: Rank of the first query of each bucket, to page through them
+        :param hours: Hourly tops of the last hours, keyed by <date>T<hour>, instead of the hours of the current day
+        :param days: Day leaderboards of the last days, keyed by <date>
+        :return: JSON {bucket: [[<query_id>_<interval>, max value], ...] by decreasing value},
+                 None if the store could not be read
+        :raise ValueError: Invalid parameters
+        """
 
         if (toptype != "duration" and toptype != "dps"):
             logging.error("Unsupported toptype: {}".format(toptype))
             return
 
-        try:
-            self.db.ping()
-        except Exception as e:
-            logging.error("Redis server connection issue: {}".format(e))
+        limit = self.top_limit if limit is None else limit
+        if not 0 < limit <= self.top_max_limit:
+            raise ValueError("limit must be between 1 and {}".format(self.top_max_limit))
+        if offset < 0:
+            raise ValueError("offset can not be negative")
+        if hours is not None and not 0 < hours <= TOP_MAX_HOURS:
+            raise ValueError("hours must be between 1 and {}".format(TOP_MAX_HOURS))
+        if days is not None and not 0 < days <= TOP_MAX_DAYS:
+            raise ValueError("days must be between 1 and {}".format(TOP_MAX_DAYS))
+
+        if not self.circuit.allow():
             return
 
-        # Get current day of the month and hour of the day
+        # Tops are kept by day of the month and hour of the day
         d = dt.datetime.now()
-        hour = d.hour
-        day = d.day
-
-        data = {}
-        # Dump all hourly tops for today
-        while hour >= 0:
-            # Top
-            top_key = "top_{}_{}_{}".format(toptype, day, hour)
-            sc = self.db.zrange(top_key, 0, -1, True, True)
-            data[hour] = sc
-            hour = hour - 1
+
+        try:
+            if days:
+                dates = [d.date() - dt.timedelta(days=i) for i in range(days)]
+                # Today is still written to, even in its last hour
+                tops = self.store.top_days(toptype, [(date.day, range(d.hour + 1) if date == d.date() else range(24),
+                                                      date < d.date()) for date in dates], limit, offset)
+                data = {date.isoformat(): top for date, top in zip(dates, tops)}
+            elif hours:
+                times = [d - dt.timedelta(hours=i) for i in range(hours)]
+                tops = self.store.top(toptype, [(t.day, t.hour) for t in times], limit, offset)
+                data = {t.strftime("%Y-%m-%dT%H"): top for t, top in zip(times, tops)}
+            else:
+                # All hourly tops of today
+                tops = self.store.top(toptype, [(d.day, hour) for hour in range(d.hour, -1, -1)], limit, offset)
+                data = dict(zip(range(d.hour, -1, -1), tops))
+        except StoreError as e:
+            self.circuit.failure(e)
+            return
+        self.circuit.success()
 
         return json.dumps(data).encode()
@@ -0,0 +1,239 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import asyncio
+import logging
+import socket
+import ssl
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from protector.proxy.server import QUEUE_DEPTH, QUEUE_WAIT, REQUESTS_SHED, overload_response
+
+
+class StreamBridge(object):
+    """
+    Socket-like object handed to the request handler in place of a real connection.
+
+    The request (head + body) has already been read by the event loop.
+    Everything the handler writes is passed back to the event loop, which
+    applies backpressure before the handler is allowed to continue.
+    """
+
+    def __init__(self, data, writer, loop, requests_served=0):
+        self.data = data
+        self.writer = writer
+        self.loop = loop
+        self.requests_served = requests_served
+        self.closed = False
+
+    async def _write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def write(self, data):
+        if not data:
+            return 0
+        asyncio.run_coroutine_threadsafe(self._write(bytes(data)), self.loop).result()
+        return len(data)
+
+    def sendall(self, data):
+        self.write(data)
+
+    def flush(self):
+        pass
+
+    def settimeout(self, timeout):
+        # Timeouts on the client side are enforced by the event loop
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class BridgedRequestMixin(object):
+    """
+    Runs a BaseHTTPRequestHandler on top of a StreamBridge.
+    A handler instance serves exactly one request, the event loop owns the connection
+    and enforces the idle timeout between requests.
+    """
+
+    def setup(self):
+        self.connection = self.request
+        self.rfile = BytesIO(self.request.data)
+        self.wfile = self.request
+        # Number of requests already served on this connection
+        self.requests_served = self.request.requests_served
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+
+
+class AsyncHTTPServer(object):
+    """
+    Server that accepts and reads requests on an asyncio event loop
+    and processes them on a bounded pool of worker threads.
+
+    Idle and slow connections only cost a socket and a coroutine,
+    threads are only busy while a request is actually being handled.
+    It exposes the same interface as ThreadingHTTPServer.
+    """
+
+    # Size of the request processing pool
+    max_workers = 64
+    # Requests waiting for a processing thread, beyond that they are rejected with 503
+    max_queue = 256
+    # Retry-After (seconds) sent along with rejected requests
+    retry_after = 1
+
+    # Largest request head (request line + headers) we accept
+    max_head_size = 65536
+
+    request_queue_size = 128
+
+    # Let several worker processes bind the same address (SO_REUSEPORT)
+    reuse_port = False
+
+    def __init__(self, server_address, RequestHandlerClass):
+        self.RequestHandlerClass = type(
+            "Bridged{}".format(RequestHandlerClass.__name__), (BridgedRequestMixin, RequestHandlerClass), {}
+        )
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind(server_address)
+        self.socket.listen(self.request_queue_size)
+        self.server_address = self.socket.getsockname()
+        self.server_name = socket.getfqdn(self.server_address[0])
+        self.server_port = self.server_address[1]
+
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.connections = set()
+        # Requests handed to the processing pool and not finished yet
+        self.pending = 0
+        self._is_shut_down = threading.Event()
+        self._is_shut_down.set()
+
+    def serve_forever(self):
+        self._is_shut_down.clear()
+        asyncio.set_event_loop(self.loop)
+        try:
+            server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle_connection, sock=self.socket, limit=self.max_head_size)
+            )
+            self.loop.run_forever()
+            server.close()
+            for task in self.connections:
+                task.cancel()
+            # Keep the loop running until in-flight requests are done writing their responses
+            self.loop.run_until_complete(self.loop.run_in_executor(None, self.executor.shutdown))
+            self.loop.run_until_complete(asyncio.gather(*self.connections, return_exceptions=True))
+        finally:
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        """
+        Stop the serve_forever loop and wait until it has exited
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._is_shut_down.wait()
+
+    def server_close(self):
+        self.socket.close()
+        self.executor.shutdown(wait=False)
+        if not self.loop.is_running():
+            self.loop.close()
+
+    async def _handle_connection(self, reader, writer):
+        client_address = writer.get_extra_info('peername')
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            close = False
+            requests_served = 0
+            while not close:
+                try:
+                    if requests_served:
+                        timeout = self.RequestHandlerClass.keepalive_timeout
+                    else:
+                        timeout = self.RequestHandlerClass.timeout
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+                    length = self.content_length(head)
+                    body = await asyncio.wait_for(reader.readexactly(length), self.RequestHandlerClass.timeout) if length else b''
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                        ConnectionError, ValueError):
+                    break
+
+                if self.pending >= self.max_workers + self.max_queue:
+                    REQUESTS_SHED.inc()
+                    writer.write(overload_response(self.retry_after))
+                    await writer.drain()
+                    break
+
+                request = StreamBridge(head + body, writer, self.loop, requests_served)
+                self.pending += 1
+                QUEUE_DEPTH.set(max(0, self.pending - self.max_workers))
+                try:
+                    close = await self.loop.run_in_executor(self.executor, self.process_request, request,
+                                                            client_address, time.time())
+                finally:
+                    self.pending -= 1
+                    QUEUE_DEPTH.set(max(0, self.pending - self.max_workers))
+                requests_served += 1
+        except asyncio.CancelledError:
+            # Server shutdown
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    def process_request(self, request, client_address, queued):
+        """
+        Run the request handler, return True if the connection has to be closed afterwards
+        """
+        QUEUE_WAIT.observe(time.time() - queued)
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+            return handler.close_connection
+        except Exception:
+            self.handle_error(request, client_address)
+            return True
+
+    def has_waiting_requests(self):
+        """
+        Idle connections don't hold a thread here, they never need to make room
+        """
+        return False
+
+    def handle_error(self, request, client_address):
+        """
+        Suppress socket/ssl related errors, log everything else
+        :param client_address: Address of client
+        :param request: Request causing an error
+        """
+        cls, e = sys.exc_info()[:2]
+        if issubclass(cls, (socket.error, ssl.SSLError)):
+            pass
+        else:
+            logging.exception("Exception happened during processing of request from %s", client_address)
+
+    @staticmethod
+    def content_length(head):
+        for line in head.split(b'\r\n')[1:]:
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'content-length':
+                return int(value.strip())
+        return 0
@@ -0,0 +1,79 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import threading
+
+from prometheus_client import Counter, Gauge
+
+COALESCE_LEADERS = Counter('query_coalesce_leaders', 'Queries sent to the backend on behalf of identical queries')
+COALESCED = Counter('query_coalesced', 'Queries answered with the backend response of an identical query in flight')
+IN_FLIGHT = Gauge('query_coalesce_in_flight', 'Distinct queries in flight', multiprocess_mode='livesum')
+
+
+class Flight(object):
+    """
+    A call in progress, shared by all callers of the same key
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Coalescer(object):
+    """
+    Single-flight: while a call for a key is in progress, later calls for the same key
+    wait for it and get its result (or its exception) instead of running again.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        """
+        :param key: Identifies identical calls
+        :param fn: Called with args by the first caller only
+        :return: (result of fn, True if this caller ran fn)
+        """
+        result, error, leader = self.call(key, fn, *args)
+        if error is not None:
+            raise error
+        return result, leader
+
+    def call(self, key, fn, *args):
+        """
+        Like do, without raising the exception of fn, so that callers know whether they ran it
+        :return: (result of fn, exception raised by fn or None, True if this caller ran fn)
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                IN_FLIGHT.set(len(self.flights))
+
+        if leader:
+            COALESCE_LEADERS.inc()
+            try:
+                flight.result = fn(*args)
+            except Exception as e:
+                flight.error = e
+            finally:
+                with self.lock:
+                    del self.flights[key]
+                    IN_FLIGHT.set(len(self.flights))
+                flight.done.set()
+        else:
+            COALESCED.inc()
+            flight.done.wait()
+
+        return flight.result, flight.error, leader
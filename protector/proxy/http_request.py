@@ -8,21 +8,185 @@
 #  written permission of Adobe.
 #
 
-from http.client import HTTPSConnection, HTTPConnection, IncompleteRead
+from http.client import HTTPSConnection, HTTPConnection, HTTPMessage, IncompleteRead, BadStatusLine
 from urllib.parse import urlparse, urlsplit
+import collections
 import threading
 import socket
 import logging
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+POOL_HITS = Counter('backend_pool_hits', 'Backend requests served by a reused connection', ['origin'])
+POOL_MISSES = Counter('backend_pool_misses', 'Backend requests that had to open a new connection', ['origin'])
+POOL_WAITS = Counter('backend_pool_waits', 'Backend requests that had to wait for a free connection', ['origin'])
+POOL_WAIT_TIME = Histogram('backend_pool_wait_seconds', 'Time spent waiting for a free backend connection', ['origin'])
+POOL_STALE = Counter('backend_pool_stale', 'Reused backend connections found closed by the backend (request retried)', ['origin'])
+POOL_IDLE = Gauge('backend_pool_idle', 'Idle backend connections', ['origin'])
+POOL_IN_USE = Gauge('backend_pool_in_use', 'Backend connections in use', ['origin'])
+
+
+class PoolTimeout(Exception):
+    """
+    No backend connection became available in time
+    """
+    pass
+
+
+class ConnectionPool(object):
+    """
+    A bounded, thread-safe pool of keep-alive connections to one backend origin
+    """
+
+    def __init__(self, scheme, netloc, max_size, idle_timeout):
+        """
+        :param scheme: http or https
+        :param netloc: host:port
+        :param max_size: Max number of connections (idle + in use), 0 means unlimited
+        :param idle_timeout: Idle connections older than that (seconds) are closed
+        """
+        self.scheme = scheme
+        self.netloc = netloc
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+
+        # (connection, last used) pairs, most recently used last
+        self.idle = collections.deque()
+        self.in_use = 0
+        self.cond = threading.Condition()
+
+    def get(self, timeout=None):
+        """
+        Get a connection from the pool, open a new one if none is idle
+        :param timeout: Max seconds to wait for a free connection
+        :return: (connection, reused)
+        """
+        with self.cond:
+            if self.max_size and not self.idle and self.in_use >= self.max_size:
+                POOL_WAITS.labels(self.netloc).inc()
+                start = time.time()
+                ok = self.cond.wait_for(lambda: self.idle or self.in_use < self.max_size, timeout)
+                POOL_WAIT_TIME.labels(self.netloc).observe(time.time() - start)
+                if not ok:
+                    raise PoolTimeout("No backend connection available within {}s".format(timeout))
+
+            self._evict_idle()
+            self.in_use += 1
+            POOL_IN_USE.labels(self.netloc).set(self.in_use)
+
+            if self.idle:
+                conn, _ = self.idle.pop()
+                POOL_IDLE.labels(self.netloc).set(len(self.idle))
+                POOL_HITS.labels(self.netloc).inc()
+                return conn, True
+
+        POOL_MISSES.labels(self.netloc).inc()
+        return self.create_conn(), False
+
+    def put(self, conn):
+        """
+        Return a connection that is ready for the next request
+        """
+        with self.cond:
+            self.in_use -= 1
+            self.idle.append((conn, time.time()))
+            self._evict_idle()
+            POOL_IN_USE.labels(self.netloc).set(self.in_use)
+            self.cond.notify()
+
+    def discard(self, conn):
+        """
+        Close a connection which can not be reused
+        """
+        conn.close()
+        with self.cond:
+            self.in_use -= 1
+            POOL_IN_USE.labels(self.netloc).set(self.in_use)
+            self.cond.notify()
+
+    def create_conn(self):
+        if self.scheme == 'https':
+            return HTTPSConnection(self.netloc)
+        return HTTPConnection(self.netloc)
+
+    def _evict_idle(self):
+        # Must be called with self.cond held
+        deadline = time.time() - self.idle_timeout
+        while self.idle and self.idle[0][1] < deadline:
+            conn, _ = self.idle.popleft()
+            conn.close()
+        POOL_IDLE.labels(self.netloc).set(len(self.idle))
+
+
+class BufferedResponse(object):
+    """
+    A backend response read into memory.
+    It behaves like the HTTPResponse it was read from, copy() hands out independent readers of the same body.
+    """
+
+    will_close = False
+
+    def __init__(self, status, reason, version, headers, body, duration=0):
+        """
+        :param headers: List of (name, value) pairs
+        :param duration: Seconds the backend took to answer
+        """
+        self.status = status
+        self.reason = reason
+        self.version = version
+        self.headers = headers
+        self.body = body
+        self.duration = duration
+
+        self.msg = HTTPMessage()
+        for name, value in headers:
+            self.msg[name] = value
+        self.offset = 0
+
+    @classmethod
+    def from_response(cls, response, duration=0):
+        """
+        Read a response completely
+        """
+        return cls(response.status, response.reason, response.version, list(response.msg.items()),
+                   response.read(), duration)
+
+    def copy(self):
+        return BufferedResponse(self.status, self.reason, self.version, self.headers, self.body, self.duration)
+
+    def read(self, amt=None):
+        data = self.body[self.offset:self.offset + amt] if amt else self.body[self.offset:]
+        self.offset += len(data)
+        return data
+
+    read1 = read
+
+    def getheader(self, name, default=None):
+        return self.msg.get(name, default)
+
+    def isclosed(self):
+        return self.offset >= len(self.body)
+
+    def close(self):
+        self.offset = len(self.body)
 
 
 class HTTPRequest(object):
     """
     A simple, thread-safe wrapper around HTTP(S)Connection
+
+    Connections are kept in a process-wide pool per backend origin.
+    Responses must be handed back with release() once they have been read.
     """
 
-    def __init__(self):
-        self.tls = threading.local()
-        self.tls.conns = {}
+    # Max connections per backend origin (0 means unlimited)
+    max_pool_size = 64
+    # Idle connections are closed after that many seconds
+    pool_idle_timeout = 30
+
+    pools = {}
+    pools_lock = threading.Lock()
 
     def request(self, url, timeout, body=None, headers=None, max_retries=1, method="GET"):
         if headers is None:
@@ -35,29 +199,69 @@ class HTTPRequest(object):
         if method == "GET":
             uri = parsed.path + "?" + parsed.query
 
+        pool = self.get_pool(origin)
+
         for i in range(max_retries):
+            conn, reused = pool.get(timeout)
             try:
-                conn = self.create_conn(parsed, origin, timeout)
-                conn.request(method, uri, body=body, headers=headers)
-                return conn.getresponse()
+                try:
+                    response = self.send(conn, method, uri, body, headers, timeout)
+                except (BadStatusLine, ConnectionResetError, BrokenPipeError) as e:
+                    if not reused:
+                        raise e
+                    # The backend closed the idle connection, nothing has been processed: retry on a fresh one
+                    logging.debug("HTTPRequest stale connection to %s: %s", parsed.netloc, str(e))
+                    POOL_STALE.labels(pool.netloc).inc()
+                    conn.close()
+                    response = self.send(conn, method, uri, body, headers, timeout)
+                response.pool = pool
+                response.conn = conn
+                return response
             except socket.timeout as e:
+                pool.discard(conn)
                 logging.warning("HTTPRequest socket timeout: %s", str(e))
                 raise e
             except socket.error as e:
+                pool.discard(conn)
                 logging.warning("HTTPRequest socket error: %s", str(e))
                 raise e
             except IncompleteRead as e:
+                pool.discard(conn)
                 return e.partial
             except Exception as e:
-                if origin in self.tls.conns:
-                    del self.tls.conns[origin]
+                pool.discard(conn)
                 if (i + 1) >= max_retries:
                     raise e
 
-    def create_conn(self, parsed, origin, timeout):
-        if origin not in self.tls.conns:
-            if parsed.scheme == 'https':
-                self.tls.conns[origin] = HTTPSConnection(parsed.netloc, timeout=timeout)
-            else:
-                self.tls.conns[origin] = HTTPConnection(parsed.netloc, timeout=timeout)
-        return self.tls.conns[origin]
+    @staticmethod
+    def send(conn, method, uri, body, headers, timeout):
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        conn.request(method, uri, body=body, headers=headers)
+        return conn.getresponse()
+
+    @staticmethod
+    def release(response):
+        """
+        Hand the connection of a response back to the pool.
+        The connection is only reused if the response body has been read completely.
+        """
+        pool = getattr(response, 'pool', None)
+        if pool is None:
+            return
+        conn = response.conn
+        response.pool = response.conn = None
+
+        if response.isclosed() and not response.will_close:
+            pool.put(conn)
+        else:
+            response.close()
+            pool.discard(conn)
+
+    def get_pool(self, origin):
+        with self.pools_lock:
+            if origin not in self.pools:
+                scheme, netloc = origin
+                self.pools[origin] = ConnectionPool(scheme, netloc, self.max_pool_size, self.pool_idle_timeout)
+            return self.pools[origin]
@@ -0,0 +1,113 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import re
+import threading
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+LIMITER_WAIT_TIME = Histogram('backend_limiter_wait_seconds', 'Time queries waited for a backend slot', ['group'])
+LIMITER_REJECTED = Counter('backend_limiter_rejected', 'Queries rejected because no backend slot became free in time',
+                           ['group'])
+LIMITER_IN_USE = Gauge('backend_limiter_in_use', 'Backend slots in use', ['group'], multiprocess_mode='livesum')
+
+GLOBAL = 'global'
+
+
+class LimitExceeded(Exception):
+    """
+    No backend slot became available before the deadline
+    """
+
+    def __init__(self, group, limit, waited):
+        self.group = group
+        self.limit = limit
+        self.waited = waited
+        if group == GLOBAL:
+            what = "queries"
+        else:
+            what = "queries for metrics matching '{}'".format(group)
+        super(LimitExceeded, self).__init__(
+            "Too many concurrent {} (limit: {}), gave up after {:.1f}s".format(what, limit, waited))
+
+
+class Slots(object):
+    """
+    A group of backend slots
+    """
+
+    def __init__(self, name, limit, pattern=None):
+        self.name = name
+        self.limit = limit
+        self.pattern = re.compile(pattern) if pattern is not None else None
+        self.semaphore = threading.BoundedSemaphore(limit)
+
+    def matches(self, metric_names):
+        return self.pattern is None or any(self.pattern.search(m) for m in metric_names)
+
+    def acquire(self, deadline):
+        start = time.time()
+        ok = self.semaphore.acquire(timeout=max(0, deadline - start))
+        waited = time.time() - start
+        LIMITER_WAIT_TIME.labels(self.name).observe(waited)
+        if not ok:
+            LIMITER_REJECTED.labels(self.name).inc()
+            raise LimitExceeded(self.name, self.limit, waited)
+        LIMITER_IN_USE.labels(self.name).inc()
+
+    def release(self):
+        self.semaphore.release()
+        LIMITER_IN_USE.labels(self.name).dec()
+
+
+class ConcurrencyLimiter(object):
+    """
+    Caps the number of queries outstanding against the backend,
+    globally and per metric name pattern.
+
+    A query takes one slot in every group matching one of its metrics (and a global one),
+    it waits at most max_wait seconds for them and raises LimitExceeded otherwise.
+    """
+
+    def __init__(self, global_limit=0, metric_limits=None, max_wait=10):
+        """
+        :param global_limit: Max concurrent queries, 0 means unlimited
+        :param metric_limits: List of {'pattern': <regex>, 'limit': <max concurrent queries>}
+        :param max_wait: Seconds a query may wait for its slots
+        """
+        self.max_wait = max_wait
+        # Pattern groups first: a query blocked on its metric family does not hold a global slot
+        self.groups = [Slots(l['pattern'], l['limit'], l['pattern']) for l in metric_limits or []]
+        if global_limit:
+            self.groups.append(Slots(GLOBAL, global_limit))
+
+    def acquire(self, metric_names):
+        """
+        Wait for the slots of a query
+        :param metric_names: Metrics the query reads
+        :return: The acquired slots, to be handed back to release()
+        """
+        deadline = time.time() + self.max_wait
+        acquired = []
+        try:
+            for slots in self.groups:
+                if slots.matches(metric_names):
+                    slots.acquire(deadline)
+                    acquired.append(slots)
+        except LimitExceeded:
+            self.release(acquired)
+            raise
+        return acquired
+
+    @staticmethod
+    def release(acquired):
+        for slots in reversed(acquired):
+            slots.release()
@@ -0,0 +1,95 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import collections
+import hashlib
+import threading
+import time
+from urllib.parse import urlsplit
+
+from prometheus_client import Counter
+
+from protector.proxy.http_request import BufferedResponse
+
+METADATA_CACHE_HITS = Counter('metadata_cache_hits', 'Metadata requests served from the cache', ['endpoint'])
+METADATA_CACHE_MISSES = Counter('metadata_cache_misses', 'Metadata requests forwarded to the backend', ['endpoint'])
+METADATA_NOT_MODIFIED = Counter('metadata_not_modified', 'Metadata requests answered with 304 Not Modified',
+                                ['endpoint'])
+
+
+class MetadataCache(object):
+    """
+    Cache for idempotent backend GET endpoints (suggest, lookup, aggregators, ...) with a TTL per endpoint.
+    Cached responses carry an ETag so clients can revalidate them with If-None-Match.
+    """
+
+    def __init__(self, endpoints, max_entries=1024):
+        """
+        :param endpoints: List of {'path': <endpoint path>, 'ttl': <seconds>}
+        :param max_entries: Max number of cached responses (LRU)
+        """
+        self.ttls = {e['path']: e['ttl'] for e in endpoints}
+        self.max_entries = max_entries
+
+        # key -> (response, expires)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def endpoint(self, path):
+        """
+        :return: The cached endpoint the request path belongs to, None if it's not cached
+        """
+        endpoint = urlsplit(path).path
+        if endpoint in self.ttls:
+            return endpoint
+        return None
+
+    def get(self, endpoint, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] < time.time():
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is None:
+            METADATA_CACHE_MISSES.labels(endpoint).inc()
+            return None
+        METADATA_CACHE_HITS.labels(endpoint).inc()
+        return entry[0]
+
+    def put(self, endpoint, key, response):
+        """
+        Cache a response
+        :return: The cached response, with an ETag header
+        """
+        etag = '"{}"'.format(hashlib.md5(response.body).hexdigest())
+        headers = [(k, v) for k, v in response.headers if k.lower() != 'etag'] + [('ETag', etag)]
+        response = BufferedResponse(response.status, response.reason, response.version, headers, response.body,
+                                    response.duration)
+
+        with self.lock:
+            self.entries[key] = (response, time.time() + self.ttls[endpoint])
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return response
+
+    @staticmethod
+    def not_modified(response, if_none_match):
+        """
+        :param if_none_match: If-None-Match request header
+        :return: True if the client already has this version of the response
+        """
+        etag = response.getheader('etag')
+        if not etag or not if_none_match:
+            return False
+        tags = [t.strip() for t in if_none_match.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
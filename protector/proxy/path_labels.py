@@ -0,0 +1,84 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import re
+import threading
+from urllib.parse import urlsplit
+
+from prometheus_client import Counter
+
+# Label of the paths beyond the cap
+OVERFLOW = "other"
+
+PATH_LABELS_OVERFLOW = Counter('path_labels_overflow',
+                               'Requests labelled "{}", the path label cap being reached'.format(OVERFLOW))
+
+# OpenTSDB HTTP API and UI paths, and the protector own ones, always labelled
+KNOWN_PATHS = frozenset([
+    '/', '/q', '/logs', '/aggregators', '/suggest', '/version', '/stats', '/dropcaches', '/favicon.ico',
+    '/api/query', '/api/query/last', '/api/query/exp', '/api/query/gexp', '/api/suggest', '/api/put', '/api/version',
+    '/api/aggregators', '/api/config', '/api/config/filters', '/api/annotation', '/api/annotation/bulk', '/api/stats',
+    '/api/stats/jvm', '/api/stats/query', '/api/stats/threads', '/api/stats/region_clients', '/api/dropcaches',
+    '/api/serializers', '/api/histogram', '/api/rollup',
+    '/metrics', '/top/duration', '/top/dps',
+])
+
+# Known paths with variable parts, after the configured routes
+KNOWN_ROUTES = (
+    {'pattern': '^/api/search/', 'label': '/api/search/*'},
+    {'pattern': '^/api/uid/', 'label': '/api/uid/*'},
+    {'pattern': '^/api/tree(/|$)', 'label': '/api/tree/*'},
+    {'pattern': '^/s/', 'label': '/s/*'},
+    {'pattern': '^/stats/', 'label': '/stats/*'},
+)
+
+
+class PathLabels(object):
+    """
+    Path label of the request metrics. The query string is dropped and paths matching a route pattern get its label,
+    e.g. the UI assets /s/<file>. Route labels and KNOWN_PATHS are always given out, other paths only until
+    max_labels of them were (0 for no limit): beyond, they are labelled OVERFLOW so that the number of metric series
+    stays bounded whatever clients request, and scanners can not take the labels of the OpenTSDB endpoints.
+    """
+
+    def __init__(self, routes=(), max_labels=100):
+        """
+        :param routes: [{'pattern': <regular expression>, 'label': <label>}], the first match applies,
+                       before KNOWN_ROUTES
+        """
+        self.routes = [(re.compile(r['pattern']), r['label']) for r in list(routes) + list(KNOWN_ROUTES)]
+        self.max_labels = max_labels
+
+        self.labels = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize(path):
+        """
+        :return: The path without query string, repeated and trailing slashes
+        """
+        # //x would be read as the host x
+        path = re.sub('/+', '/', urlsplit(re.sub('^/+', '/', path or '/')).path)
+        return path.rstrip('/') or '/'
+
+    def label(self, path):
+        path = self.normalize(path)
+        for pattern, label in self.routes:
+            if pattern.search(path):
+                return label
+
+        if path in KNOWN_PATHS or path in self.labels or not self.max_labels:
+            return path
+        with self.lock:
+            if path in self.labels or len(self.labels) < self.max_labels:
+                self.labels.add(path)
+                return path
+        PATH_LABELS_OVERFLOW.inc()
+        return OVERFLOW
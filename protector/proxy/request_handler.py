@@ -19,12 +19,21 @@ import re
 from http.server import BaseHTTPRequestHandler
 from io import BytesIO
 import traceback
+from urllib.parse import urlsplit, parse_qs
 
-from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import CONTENT_TYPE_LATEST
 import datetime as dt
 
-from protector.proxy.http_request import HTTPRequest
-from protector.query.query import OpenTSDBQuery, OpenTSDBResponse
+from protector import metrics
+from protector.proxy.http_request import BufferedResponse, HTTPRequest, PoolTimeout
+from protector.proxy.limiter import LimitExceeded
+from protector.proxy.metadata_cache import METADATA_NOT_MODIFIED
+from protector.proxy.path_labels import PathLabels
+from protector.proxy.response_cache import ResponseCache
+from protector.query.query import OpenTSDBQuery, OpenTSDBResponse, OpenTSDBResponseSummary
+
+# Query string parameters of /top/<type>, integers
+TOP_PARAMETERS = ('limit', 'offset', 'hours', 'days')
 
 
 class ProxyRequestHandler(BaseHTTPRequestHandler):
@@ -32,11 +41,43 @@ class ProxyRequestHandler(BaseHTTPRequestHandler):
     protector = None
     backend_address = None
     timeout = None
-    
+    # ConcurrencyLimiter for queries sent to the backend, None means no limit
+    limiter = None
+    # Coalescer sharing one backend response between identical queries in flight, None disables it
+    coalescer = None
+    # ResponseCache for query results, None disables it
+    response_cache = None
+    # TailCache fetching only the new datapoints of relative queries, None disables it
+    tail_cache = None
+    # SharedCache for query results in Redis, None disables it
+    shared_cache = None
+    # MetadataCache for idempotent GET endpoints, None disables it
+    metadata_cache = None
+    # PathLabels giving the path label of the request metrics
+    path_labels = PathLabels()
+
+    # Persistent client connections: seconds to wait for the next request
+    # and number of requests served before the connection is closed (0 disables keep-alive)
+    keepalive_timeout = 5
+    keepalive_max_requests = 100
+
+    # Size of the pieces backend responses are copied to the client in, when they are streamed
+    stream_chunk_size = 65536
+
+    # Send compressed query results to the client as received from the backend (summary included)
+    # and read the stats from a decompressed copy of the stream
+    compressed_passthrough = False
+    # Compression level (1-9) used when a query result has to be re-encoded
+    compression_level = 6
+    # How much of the decompressed end of a passed through response is kept to find the summary
+    summary_tail_size = 1048576
+
     def __init__(self, *args, **kwargs):
 
         self.http_request = HTTPRequest()
         self.tsdb_query = None
+        self.shared_response = False
+        self.cacheable = False
 
         # Address to time series backend
         backend_host, backend_port = self.backend_address
@@ -47,7 +88,10 @@ class ProxyRequestHandler(BaseHTTPRequestHandler):
         self.connection = None
         self.rfile = None
         self.wfile = None
+        self.headers = {}
         self.close_connection = 0
+        self.requests_served = 0
+        self.response_started = False
 
         try:
             BaseHTTPRequestHandler.__init__(self, *args, **kwargs)
@@ -55,13 +99,53 @@ class ProxyRequestHandler(BaseHTTPRequestHandler):
             pass
 
 
+    def handle_one_request(self):
+        if self.requests_served:
+            if self.server.has_waiting_requests():
+                # Free the thread for a waiting connection instead of idling
+                self.close_connection = True
+                return
+            # Idle persistent connection waiting for the next request
+            self.connection.settimeout(self.keepalive_timeout)
+        BaseHTTPRequestHandler.handle_one_request(self)
+
+    def parse_request(self):
+        self.connection.settimeout(self.timeout)
+        self.requests_served += 1
+        self.tsdb_query = None
+        self.shared_response = False
+        self.cacheable = False
+        self.response_started = False
+
+        if not BaseHTTPRequestHandler.parse_request(self):
+            return False
+
+        if not self.keepalive_timeout or self.requests_served >= self.keepalive_max_requests:
+            self.close_connection = True
+        return True
+
+    def handle_expect_100(self):
+        # Interim response, keep it out of the connection bookkeeping in end_headers
+        self.send_response_only(http.client.CONTINUE)
+        BaseHTTPRequestHandler.end_headers(self)
+        return True
+
+    def end_headers(self):
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        else:
+            self.send_header('Connection', 'keep-alive')
+            self.send_header('Keep-Alive', 'timeout={}, max={}'.format(
+                self.keepalive_timeout, self.keepalive_max_requests - self.requests_served))
+        self.response_started = True
+        BaseHTTPRequestHandler.end_headers(self)
+
     def log_error(self, log_format, *args):
 
         # Suppress "Request timed out: timeout('timed out',)"
-        # if isinstance(args[0], socket.timeout):
-
-        # logging.error("{}".format(traceback.format_exc()))
-        # logging.error(pprint.pprint(args))
+        # for idle persistent connections
+        if self.requests_served and args and isinstance(args[0], socket.timeout):
+            return
 
         self.log_message(log_format, *args)
 
@@ -98,27 +182,54 @@ class ProxyRequestHandler(BaseHTTPRequestHandler):
 
     def do_GET(self):
 
-        top = re.match("^/top/(duration|dps)$", self.path)
+        # Keep the connection in sync if the client sent a body
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+
+        url = urlsplit(self.path)
+        top = re.match("^/top/(duration|dps)$", url.path)
+        query_stats = re.match("^/stats/([^/]+)$", url.path)
 
         if self.path == "/metrics":
 
-            data = generate_latest()
+            data = metrics.generate_latest()
 
             self.send_response(http.client.OK)
             self.send_header("Content-Type", CONTENT_TYPE_LATEST)
             self.send_header("Content-Length", str(len(data)))
-            self.send_header('Connection', 'close')
             self.end_headers()
             self.wfile.write(data)
 
         elif top:
 
-            data = self.protector.get_top(top.group(1))
+            try:
+                params = {k: int(v[-1]) for k, v in parse_qs(url.query).items() if k in TOP_PARAMETERS}
+                data = self.protector.get_top(top.group(1), **params)
+            except ValueError as e:
+                self.send_error(http.client.BAD_REQUEST, str(e))
+                return
+
+            if data is None:
+                self.send_error(http.client.SERVICE_UNAVAILABLE, "Query stats unavailable")
+                return
+
+            self.send_response(http.client.OK)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        elif query_stats:
+
+            data = self.protector.get_stats(query_stats.group(1))
+            if data is None:
+                self.send_error(http.client.SERVICE_UNAVAILABLE, "Query stats unavailable")
+                return
 
             self.send_response(http.client.OK)
             self.send_header("Content-Type", "application/json")
             self.send_header("Content-Length", str(len(data)))
-            self.send_header('Connection', 'close')
             self.end_headers()
             self.wfile.write(data)
 
@@ -127,9 +238,6 @@ class ProxyRequestHandler(BaseHTTPRequestHandler):
             self.filter_headers(self.headers)
             self._handle_request(self.scheme, self.backend_netloc, self.path, self.headers)
 
-        self.finish()
-        self.connection.close()
-
     def do_POST(self):
 
         length = int(self.headers['Content-Length'])
@@ -159,6 +267,8 @@ class ProxyRequestHandler(BaseHTTPRequestHandler):
 
             # Check the payload against the Protector rule set
             result = self.protector.check(self.tsdb_query)
+            # Results of blocked queries (let through in safe mode) are never cached
+            self.cacheable = result.is_ok()
             if not result.is_ok():
                 self.protector.REQUESTS_BLOCKED.labels(self.protector.safe_mode, result.value["rule"]).inc()
 
@@ -172,59 +282,103 @@ class ProxyRequestHandler(BaseHTTPRequestHandler):
         status = self._handle_request(self.scheme, self.backend_netloc, self.path, self.headers, body=post_data, method="POST")
 
         #['method', 'path', 'return_code']
-        self.protector.REQUESTS_COUNT.labels('POST', self.path, status).inc()
-
-        self.finish()
-        self.connection.close()
+        self.protector.REQUESTS_COUNT.labels('POST', self.path_labels.label(self.path), status).inc()
 
-    def send_error(self, code, message=None):
+    def send_error(self, code, message=None, explain=None):
         """
         Send and log plain text error reply.
         :param code:
         :param message:
+        :param explain: Unused, BaseHTTPRequestHandler compatibility
         """
+        if self.response_started:
+            # Part of a response has already been sent, the stream can not be recovered
+            self.log_error("code %d, message: %s (response already started)", code, message)
+            self.close_connection = True
+            return
+
+        if message is None:
+            message = self.responses.get(code, ('',))[0]
         message = message.strip()
         self.log_error("code %d, message: %s", code, message)
         self.send_response(code)
 
-        self.send_header("Content-Type", "application/json")
-        self.send_header('Connection', 'close')
-        self.end_headers()
+        body = b''
         if message:
             # Grafana style
             j = {'message': message, 'error': message}
-            self.wfile.write(json.dumps(j).encode())
+            body = json.dumps(j).encode()
+
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
 
     def _handle_request(self, scheme, netloc, path, headers, body=None, method="GET"):
         """
         Run the actual request
         """
         backend_url = "{}://{}{}".format(scheme, netloc, path)
+        path_label = self.path_labels.label(path)
         startTime = time.time()
+        slots = []
 
         try:
             headers=dict(headers)
             if body is not None:
                 headers['Content-Length'] = str(len(body))
-            response = self.http_request.request(backend_url, self.timeout, method=method, body=body, headers=headers)
-
-            respTime = time.time()
-            duration = respTime - startTime
 
-            self.protector.TSDB_REQUEST_LATENCY.labels(response.status, path, method).observe(duration)
-            self._return_response(response, method, duration)
+            if self.tsdb_query is not None and (self.coalescer is not None or self.response_cache is not None or
+                                                self.shared_cache is not None or self.tail_cache is not None):
+                shared = self._fetch_query(backend_url, path, method, body, headers)
+                response, duration = shared.copy(), shared.duration
+            elif self.metadata_cache is not None and method == "GET" and self.metadata_cache.endpoint(path):
+                shared = self._fetch_metadata(backend_url, path, method, headers)
+                if self.metadata_cache.not_modified(shared, self.headers.get('If-None-Match')):
+                    self._send_not_modified(shared)
+                    return http.client.NOT_MODIFIED
+                response, duration = shared.copy(), shared.duration
+            else:
+                slots = self._acquire_slots()
+                startTime = time.time()
+                response = self.http_request.request(backend_url, self.timeout, method=method, body=body, headers=headers)
+
+                respTime = time.time()
+                duration = respTime - startTime
+
+                self.protector.TSDB_REQUEST_LATENCY.labels(response.status, path_label, method).observe(duration)
+            try:
+                self._return_response(response, method, duration)
+            finally:
+                self.http_request.release(response)
 
             return response.status
 
+        except LimitExceeded as e:
+
+            logging.warning("OpenTSDBQuery rejected: %s. Reason: %s", self.tsdb_query.get_id(), e)
+            self.send_error(http.client.SERVICE_UNAVAILABLE, str(e))
+
+            return http.client.SERVICE_UNAVAILABLE
+
+        except PoolTimeout as e:
+
+            logging.warning("Backend connection pool exhausted: %s", e)
+            self.send_error(http.client.SERVICE_UNAVAILABLE, str(e))
+
+            return http.client.SERVICE_UNAVAILABLE
+
         except socket.timeout as e:
 
             respTime = time.time()
             duration = respTime - startTime
 
-            if method == "POST":
-                self.protector.save_stats(self.tsdb_query, None, duration, True)
+            if not self.shared_response:
+                if method == "POST":
+                    self.protector.save_stats(self.tsdb_query, None, duration, True)
 
-            self.protector.TSDB_REQUEST_LATENCY.labels(http.client.GATEWAY_TIMEOUT, path, method).observe(duration)
+                self.protector.TSDB_REQUEST_LATENCY.labels(http.client.GATEWAY_TIMEOUT, path_label, method).observe(duration)
             self.send_error(http.client.GATEWAY_TIMEOUT, "Query timed out. Configured timeout: {}s".format(self.timeout))
 
             return http.client.GATEWAY_TIMEOUT
@@ -236,11 +390,137 @@ class ProxyRequestHandler(BaseHTTPRequestHandler):
 
             err = "Invalid response from backend: '{}'".format(e)
             logging.debug(err)
-            self.protector.TSDB_REQUEST_LATENCY.labels(http.client.BAD_GATEWAY, path, method).observe(duration)
+            if not self.shared_response:
+                self.protector.TSDB_REQUEST_LATENCY.labels(http.client.BAD_GATEWAY, path_label, method).observe(duration)
             self.send_error(http.client.BAD_GATEWAY, err)
 
             return http.client.BAD_GATEWAY
 
+        finally:
+            # Slots are held until the response has been sent to the client
+            if slots:
+                self.limiter.release(slots)
+
+    def _acquire_slots(self):
+        """
+        Wait for the backend slots of the query, if a limiter is configured
+        """
+        if self.limiter is not None and self.tsdb_query is not None:
+            return self.limiter.acquire(self.tsdb_query.get_metric_names())
+        return []
+
+    def _fetch_query(self, backend_url, path, method, body, headers):
+        """
+        Get a query result from the response cache, from an identical query in flight,
+        from the shared cache or from the backend
+        :return: BufferedResponse
+        """
+        cache_key = None
+        if self.cacheable and (self.response_cache is not None or self.shared_cache is not None):
+            cache_key = ResponseCache.key(self.tsdb_query, self.headers.get('Accept-Encoding', ''))
+
+        if self.response_cache is not None and cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self.shared_response = True
+                return cached
+
+        if self.coalescer is not None:
+            # Identical queries in flight share a single result, compressed and plain results are separate
+            key = "{} {}".format(self.tsdb_query.get_range_key(), self.headers.get('Accept-Encoding', ''))
+            shared, error, leader = self.coalescer.call(key, self._fetch_result,
+                                                        cache_key, backend_url, path, method, body, headers)
+            if not leader:
+                # The leader records the execution, whether it succeeded or not
+                self.shared_response = True
+            if error is not None:
+                raise error
+            if not leader:
+                return shared
+        else:
+            shared = self._fetch_result(cache_key, backend_url, path, method, body, headers)
+
+        if self.response_cache is not None and cache_key is not None and shared.status == http.client.OK:
+            self.response_cache.put(cache_key, shared, self.tsdb_query.get_resolved_range()[1])
+        return shared
+
+    def _fetch_result(self, cache_key, backend_url, path, method, body, headers):
+        """
+        Get a query result from the shared cache or from the backend
+        :return: BufferedResponse
+        """
+        if self.shared_cache is None or cache_key is None:
+            return self._fetch_shared(backend_url, path, method, body, headers)
+
+        shared, fetched = self.shared_cache.get_or_fill(cache_key, self.tsdb_query.get_resolved_range()[1],
+                                                        self._fetch_shared, backend_url, path, method, body, headers)
+        self.shared_response = not fetched
+        return shared
+
+    def _fetch_metadata(self, backend_url, path, method, headers):
+        """
+        Get the response of a metadata endpoint from the cache or from the backend
+        :return: BufferedResponse
+        """
+        endpoint = self.metadata_cache.endpoint(path)
+        # Compressed and plain responses are cached separately
+        key = "{} {}".format(path, self.headers.get('Accept-Encoding', ''))
+
+        cached = self.metadata_cache.get(endpoint, key)
+        if cached is not None:
+            return cached
+
+        shared = self._fetch_shared(backend_url, path, method, None, headers)
+        if shared.status == http.client.OK and self.command == 'GET':
+            shared = self.metadata_cache.put(endpoint, key, shared)
+        return shared
+
+    def _send_not_modified(self, response):
+        """
+        The client already has the response
+        """
+        METADATA_NOT_MODIFIED.labels(self.metadata_cache.endpoint(self.path)).inc()
+        self.send_response(http.client.NOT_MODIFIED)
+        self.send_header('ETag', response.getheader('etag'))
+        self.end_headers()
+
+    def _fetch_shared(self, backend_url, path, method, body, headers):
+        """
+        Run the request on behalf of all identical queries and read the whole response
+        :return: BufferedResponse
+        """
+        tail = None
+        if self.tail_cache is not None and self.cacheable:
+            tail = self.tail_cache.plan(self.tsdb_query)
+            if tail is not None:
+                # Possibly rewritten to the datapoints missing from the cache
+                body = tail.body
+                headers['Content-Length'] = str(len(body))
+
+        slots = self._acquire_slots()
+        try:
+            startTime = time.time()
+            response = self.http_request.request(backend_url, self.timeout, method=method, body=body, headers=headers)
+            try:
+                shared = BufferedResponse.from_response(response)
+            finally:
+                self.http_request.release(response)
+            shared.duration = time.time() - startTime
+
+            self.protector.TSDB_REQUEST_LATENCY.labels(shared.status, self.path_labels.label(path), method).observe(
+                shared.duration)
+        finally:
+            if slots:
+                self.limiter.release(slots)
+
+        if tail is not None and shared.status == http.client.OK:
+            encoding = shared.getheader('content-encoding')
+            data = self.tail_cache.merge(tail, self.decode_content_body(shared.body, encoding))
+            headers = [(k, v) for k, v in shared.headers if k.lower() != 'content-length']
+            shared = BufferedResponse(shared.status, shared.reason, shared.version, headers,
+                                      self.encode_content_body(data, encoding, self.compression_level), shared.duration)
+        return shared
+
     def _process_response(self, payload, encoding, duration):
         """
         :param payload: JSON
@@ -249,14 +529,16 @@ class ProxyRequestHandler(BaseHTTPRequestHandler):
         r = ""
         try:
             resp = OpenTSDBResponse(self.decode_content_body(payload, encoding))
-            r = resp.to_json()
-            self.protector.save_stats(self.tsdb_query, resp, duration)
+            r = resp.to_bytes()
+            if not self.shared_response:
+                # Record backend executions only, not cached or shared results
+                self.protector.save_stats(self.tsdb_query, resp, duration)
         except Exception as e:
             err = "Skip: {}".format(e)
             logging.debug(err)
             logging.error("{}".format(traceback.format_exc()))
 
-        return self.encode_content_body(r, encoding)
+        return self.encode_content_body(r, encoding, self.compression_level)
 
     def _process_bad_request(self, payload, encoding):
         """
@@ -276,13 +558,29 @@ class ProxyRequestHandler(BaseHTTPRequestHandler):
         if msg:
             b['message'] = msg
 
-        return self.encode_content_body(json.dumps(b), encoding)
+        return self.encode_content_body(json.dumps(b), encoding, self.compression_level)
 
     def _return_response(self, response, method, duration):
         """
         :param response: HTTPResponse
         """
         self.filter_headers(response.msg)
+
+        # Only query results and errors of POST requests are inspected,
+        # everything else is passed through as it arrives
+        inspect = method == "POST" and (
+            response.status == http.client.BAD_REQUEST or
+            (response.status == http.client.OK and self.tsdb_query is not None)
+        )
+        if not inspect:
+            self._stream_response(response)
+            return
+
+        encoding = response.getheader('content-encoding')
+        if response.status == http.client.OK and self.compressed_passthrough and encoding in ('gzip', 'x-gzip', 'deflate'):
+            self._passthrough_response(response, encoding, duration)
+            return
+
         #cl = response.msg["content-length"]
         if "content-length" in response.msg:
             del response.msg["content-length"]
@@ -302,11 +600,81 @@ class ProxyRequestHandler(BaseHTTPRequestHandler):
                 body = self._process_bad_request(body, response.getheader('content-encoding'))
 
         self.send_header('Content-Length', str(len(body)))
-        self.send_header('Connection', 'close')
         self.end_headers()
         self.wfile.write(body)
 
 
+    def _passthrough_response(self, response, encoding, duration):
+        """
+        Send a compressed query result to the client unmodified.
+        The stats are read from the end of a decompressed copy of the stream.
+        :param response: HTTPResponse
+        :param encoding: Content Encoding
+        """
+        wbits = zlib.MAX_WBITS | 16 if encoding in ('gzip', 'x-gzip') else zlib.MAX_WBITS
+        decompressor = zlib.decompressobj(wbits)
+        tail = b''
+
+        def tee(data):
+            nonlocal decompressor, tail
+            if decompressor is None:
+                return
+            try:
+                tail = (tail + decompressor.decompress(data))[-self.summary_tail_size:]
+            except zlib.error as e:
+                # Keep serving the client, only the stats are lost
+                logging.error("Could not decompress %s response: %s", encoding, e)
+                decompressor = None
+
+        self._stream_response(response, tee)
+        if self.shared_response:
+            return
+
+        try:
+            self.protector.save_stats(self.tsdb_query, OpenTSDBResponseSummary(tail), duration)
+        except Exception as e:
+            logging.debug("Skip: {}".format(e))
+            logging.error("{}".format(traceback.format_exc()))
+
+    def _stream_response(self, response, tee=None):
+        """
+        Copy the backend response body to the client in chunks, without buffering it.
+        Chunked transfer encoding is used if the backend did not send a Content-Length.
+        :param response: HTTPResponse
+        :param tee: Optional callable receiving every chunk of the body
+        """
+        self.send_response(response.status, response.reason)
+        for header_key, header_value in response.msg.items():
+            self.send_header(header_key, header_value)
+
+        has_body = not (self.command == 'HEAD' or response.status in (http.client.NO_CONTENT, http.client.NOT_MODIFIED)
+                        or 100 <= response.status < 200)
+        chunked = False
+        if has_body and "content-length" not in response.msg:
+            if self.request_version == 'HTTP/1.1':
+                chunked = True
+                self.send_header('Transfer-Encoding', 'chunked')
+            else:
+                # HTTP/1.0 clients read the body until the connection is closed
+                self.close_connection = True
+        self.end_headers()
+
+        while True:
+            data = response.read1(self.stream_chunk_size)
+            if not data:
+                break
+            if not has_body:
+                continue
+            if tee is not None:
+                tee(data)
+            if chunked:
+                self.wfile.write("{:x}\r\n".format(len(data)).encode() + data + b"\r\n")
+            else:
+                self.wfile.write(data)
+
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
     do_HEAD = do_GET
     do_OPTIONS = do_GET
 
@@ -322,18 +690,20 @@ class ProxyRequestHandler(BaseHTTPRequestHandler):
                 del headers[k]
 
     @staticmethod
-    def encode_content_body(text, encoding):
+    def encode_content_body(text, encoding, level=6):
+        if isinstance(text, str):
+            text = text.encode('utf-8')
         if not encoding:
             return text
         if encoding == 'identity':
             return text
         if encoding in ('gzip', 'x-gzip'):
             io = BytesIO()
-            with gzip.GzipFile(fileobj=io, mode='wb') as f:
-                f.write(text.encode('utf-8'))
+            with gzip.GzipFile(fileobj=io, mode='wb', compresslevel=level) as f:
+                f.write(text)
             return io.getvalue()
         if encoding == 'deflate':
-            return zlib.compress(text)
+            return zlib.compress(text, level)
         raise Exception("Unknown Content-Encoding: %s" % encoding)
 
     @staticmethod
@@ -0,0 +1,118 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import collections
+import threading
+import time
+
+from prometheus_client import Counter, Gauge
+
+CACHE_HITS = Counter('response_cache_hits', 'Query results served from the response cache')
+CACHE_MISSES = Counter('response_cache_misses', 'Query results not found in the response cache')
+CACHE_EVICTIONS = Counter('response_cache_evictions', 'Query results evicted from the response cache to make room')
+CACHE_BYTES = Gauge('response_cache_bytes', 'Size of the query results in the response cache', multiprocess_mode='livesum')
+CACHE_ENTRIES = Gauge('response_cache_entries', 'Query results in the response cache', multiprocess_mode='livesum')
+
+
+class FreshnessTTL(object):
+    """
+    Time to live of a query result, depending on how recent the end of its time range is.
+    Ranges ending in the recent window may still receive datapoints and expire quickly.
+    """
+
+    def __init__(self, recent_ttl=10, historical_ttl=3600, recent_window=600):
+        """
+        :param recent_ttl: Seconds to keep results of ranges ending less than recent_window seconds ago
+        :param historical_ttl: Seconds to keep results of older ranges
+        """
+        self.recent_ttl = recent_ttl
+        self.historical_ttl = historical_ttl
+        self.recent_window = recent_window
+
+    def __call__(self, end_timestamp, now=None):
+        if now is None:
+            now = time.time()
+        if now - end_timestamp < self.recent_window:
+            return self.recent_ttl
+        return self.historical_ttl
+
+
+class ResponseCache(object):
+    """
+    In-process LRU cache of query results (BufferedResponse), bounded by the size of the bodies
+    """
+
+    def __init__(self, max_bytes, ttl=None):
+        """
+        :param max_bytes: Memory limit for cached bodies
+        :param ttl: Callable returning the time to live of a result from the end of its range
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl or FreshnessTTL()
+
+        # key -> (response, expires, size), least recently used first
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(query, accept_encoding=''):
+        """
+        Query id, resolved time range and Accept-Encoding of the request,
+        results are cached as the backend encoded them
+        """
+        start, end = query.get_resolved_range()
+        return "{}_{}_{}_{} {}".format(query.get_id(), start, end, query.get_range_options(), accept_encoding)
+
+    def get(self, key):
+        """
+        :return: The cached response or None
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] < time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                CACHE_MISSES.inc()
+                return None
+            self.entries.move_to_end(key)
+        CACHE_HITS.inc()
+        return entry[0]
+
+    def put(self, key, response, end_timestamp):
+        """
+        Cache a response, evicting the least recently used ones if needed
+        :param end_timestamp: End of the time range of the query
+        """
+        size = len(response.body)
+        if size > self.max_bytes:
+            return
+        expires = time.time() + self.ttl(end_timestamp)
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            while self.entries and self.bytes + size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                CACHE_EVICTIONS.inc()
+            self.entries[key] = (response, expires, size)
+            self.bytes += size
+            self._update_gauges()
+
+    def _remove(self, key):
+        # Must be called with self.lock held
+        _, _, size = self.entries.pop(key)
+        self.bytes -= size
+        self._update_gauges()
+
+    def _update_gauges(self):
+        CACHE_BYTES.set(self.bytes)
+        CACHE_ENTRIES.set(len(self.entries))
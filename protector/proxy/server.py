@@ -11,17 +11,121 @@
 import sys
 import ssl
 import socket
+import json
+import queue
+import threading
+import time
 from socketserver import ThreadingMixIn
 from http.server import HTTPServer
 
+from prometheus_client import Counter, Gauge, Histogram
+
+QUEUE_DEPTH = Gauge('server_queue_depth', 'Requests waiting for a handler thread', multiprocess_mode='livesum')
+QUEUE_WAIT = Histogram('server_queue_wait_seconds', 'Time requests spent waiting for a handler thread')
+REQUESTS_SHED = Counter('server_requests_shed', 'Requests rejected with 503 because the admission queue was full')
+
+
+def overload_response(retry_after):
+    """
+    :return: A complete 503 response, Grafana style
+    """
+    message = "Protector overloaded, retry in {}s".format(retry_after)
+    body = json.dumps({'message': message, 'error': message}).encode()
+    head = "HTTP/1.1 503 Service Unavailable\r\n" \
+           "Content-Type: application/json\r\n" \
+           "Content-Length: {}\r\n" \
+           "Retry-After: {}\r\n" \
+           "Connection: close\r\n\r\n".format(len(body), retry_after)
+    return head.encode() + body
+
 
 class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
     """
     Server that handles requests in multiple threads
+
+    By default every connection gets its own thread. With max_threads set, connections are
+    handled by a fixed number of threads and wait in a queue of max_queue connections,
+    anything beyond that is rejected right away with a 503.
     """
     daemon_threads = True
 
+    # Let several worker processes bind the same address (SO_REUSEPORT)
+    reuse_port = False
+
+    # Number of handler threads, 0 starts a thread per connection
+    max_threads = 0
+    # Connections waiting for a handler thread (at least 1)
+    max_queue = 256
+    # Retry-After (seconds) sent along with rejected requests
+    retry_after = 1
+
+    queue = None
+    workers = None
+
+    def process_request(self, request, client_address):
+        if not self.max_threads:
+            return ThreadingMixIn.process_request(self, request, client_address)
+
+        if self.workers is None:
+            self.start_workers()
+
+        try:
+            self.queue.put_nowait((request, client_address, time.time()))
+            QUEUE_DEPTH.set(self.queue.qsize())
+        except queue.Full:
+            self.shed_request(request)
+
+    def start_workers(self):
+        self.queue = queue.Queue(max(self.max_queue, 1))
+        self.workers = []
+        for _ in range(self.max_threads):
+            t = threading.Thread(target=self.process_queue)
+            t.daemon = self.daemon_threads
+            t.start()
+            self.workers.append(t)
+
+    def process_queue(self):
+        while True:
+            request, client_address, queued = self.queue.get()
+            if request is None:
+                break
+            QUEUE_DEPTH.set(self.queue.qsize())
+            QUEUE_WAIT.observe(time.time() - queued)
+            self.process_request_thread(request, client_address)
+
+    def shed_request(self, request):
+        REQUESTS_SHED.inc()
+        try:
+            request.settimeout(1)
+            request.sendall(overload_response(self.retry_after))
+        except socket.error:
+            pass
+        self.shutdown_request(request)
+
+    def has_waiting_requests(self):
+        """
+        Connections are waiting for a handler thread
+        """
+        return self.queue is not None and not self.queue.empty()
+
+    def server_close(self):
+        if self.workers is not None:
+            # Drop waiting connections, then stop the handler threads
+            while True:
+                try:
+                    request, _, _ = self.queue.get_nowait()
+                    self.shutdown_request(request)
+                except queue.Empty:
+                    break
+            QUEUE_DEPTH.set(0)
+            for _ in self.workers:
+                self.queue.put((None, None, None))
+            self.workers = None
+        ThreadingMixIn.server_close(self)
+
     def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         HTTPServer.server_bind(self)
 
     def handle_error(self, request, client_address):
@@ -0,0 +1,169 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import json
+import logging
+import time
+import uuid
+import zlib
+
+from prometheus_client import Counter
+
+from protector.proxy.http_request import BufferedResponse
+from protector.redis_client import CircuitBreaker
+from protector.proxy.response_cache import FreshnessTTL
+
+SHARED_CACHE_HITS = Counter('shared_cache_hits', 'Query results served from the shared cache')
+SHARED_CACHE_MISSES = Counter('shared_cache_misses', 'Query results not found in the shared cache')
+SHARED_CACHE_FILLS = Counter('shared_cache_fills', 'Query results fetched from the backend to fill the shared cache')
+SHARED_CACHE_LOCK_WAITS = Counter('shared_cache_lock_waits', 'Misses that waited for another instance to fill the entry')
+SHARED_CACHE_TOO_LARGE = Counter('shared_cache_too_large', 'Query results not cached because of their compressed size')
+SHARED_CACHE_ERRORS = Counter('shared_cache_errors', 'Shared cache operations failed (Redis errors)')
+
+# Release the fill lock only if we still own it
+RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SharedCache(object):
+    """
+    Query result cache in Redis, shared by all protector instances.
+
+    Entries are zlib compressed and expire according to the freshness of their range.
+    When an entry is missing, only the instance holding its fill lock queries the backend,
+    the other ones wait for the entry to show up. Redis is skipped while the circuit is open.
+    """
+
+    prefix = "protector_cache_"
+
+    def __init__(self, db, max_entry_bytes=1048576, ttl=None, lock_timeout=30, poll_interval=0.1,
+                 compression_level=6, circuit=None):
+        """
+        :param db: Redis client returning bytes (decode_responses=False)
+        :param max_entry_bytes: Larger compressed results are not cached
+        :param ttl: Callable returning the time to live of a result from the end of its range
+        :param lock_timeout: Seconds a fill lock is held at most, and waited for
+        :param circuit: CircuitBreaker of the Redis calls
+        """
+        self.db = db
+        self.circuit = circuit or CircuitBreaker()
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl or FreshnessTTL()
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self.compression_level = compression_level
+
+    def get_or_fill(self, key, end_timestamp, fn, *args):
+        """
+        :param key: Query id and resolved range
+        :param end_timestamp: End of the time range of the query
+        :param fn: Called with args to fetch the result from the backend (BufferedResponse)
+        :return: (response, True if fn was called)
+        """
+        if not self.circuit.allow():
+            return fn(*args), True
+        cached = self.get(key)
+        if cached is not None:
+            return cached, False
+
+        token = uuid.uuid4().hex
+        try:
+            locked = self.db.set(self.prefix + key + "_lock", token, nx=True, ex=self.lock_timeout)
+        except Exception as e:
+            self.error("lock", e)
+            return fn(*args), True
+        self.circuit.success()
+
+        if not locked:
+            SHARED_CACHE_LOCK_WAITS.inc()
+            cached = self.wait(key)
+            if cached is not None:
+                return cached, False
+            # The other instance did not make it in time
+            return fn(*args), True
+
+        try:
+            response = fn(*args)
+            SHARED_CACHE_FILLS.inc()
+            if response.status == 200:
+                self.put(key, response, end_timestamp)
+            return response, True
+        finally:
+            try:
+                self.db.eval(RELEASE_LOCK, 1, self.prefix + key + "_lock", token)
+                self.circuit.success()
+            except Exception as e:
+                self.error("unlock", e)
+
+    def get(self, key):
+        try:
+            data = self.db.get(self.prefix + key)
+        except Exception as e:
+            self.error("get", e)
+            return None
+        self.circuit.success()
+        if data is None:
+            SHARED_CACHE_MISSES.inc()
+            return None
+        SHARED_CACHE_HITS.inc()
+        return self.decode(data)
+
+    def wait(self, key):
+        """
+        Wait for another instance to fill an entry
+        """
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(self.poll_interval)
+            try:
+                data = self.db.get(self.prefix + key)
+                if data is not None:
+                    SHARED_CACHE_HITS.inc()
+                    return self.decode(data)
+                if not self.db.exists(self.prefix + key + "_lock"):
+                    # Filled without result (e.g. backend error)
+                    return None
+                self.circuit.success()
+            except Exception as e:
+                self.error("wait", e)
+                return None
+        return None
+
+    def put(self, key, response, end_timestamp):
+        data = self.encode(response)
+        if len(data) > self.max_entry_bytes:
+            SHARED_CACHE_TOO_LARGE.inc()
+            return
+        try:
+            self.db.set(self.prefix + key, data, ex=max(1, int(self.ttl(end_timestamp))))
+            self.circuit.success()
+        except Exception as e:
+            self.error("set", e)
+
+    def encode(self, response):
+        meta = {'status': response.status, 'reason': response.reason, 'version': response.version,
+                'headers': response.headers, 'duration': response.duration}
+        return zlib.compress(json.dumps(meta).encode('utf-8') + b'\n' + response.body, self.compression_level)
+
+    @staticmethod
+    def decode(data):
+        meta, _, body = zlib.decompress(data).partition(b'\n')
+        meta = json.loads(meta)
+        return BufferedResponse(meta['status'], meta['reason'], meta['version'], [tuple(h) for h in meta['headers']],
+                                body, meta['duration'])
+
+    def error(self, operation, e):
+        SHARED_CACHE_ERRORS.inc()
+        logging.error("Shared cache %s failed: %s", operation, e)
+        self.circuit.failure(e)
@@ -0,0 +1,182 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import collections
+import json
+import re
+import threading
+import time
+
+from prometheus_client import Counter, Gauge
+
+from protector.query.query import OpenTSDBResponse
+
+TAIL_HITS = Counter('tail_cache_hits', 'Relative queries answered by fetching only the tail of their range')
+TAIL_MISSES = Counter('tail_cache_misses', 'Relative queries fetched over their whole range')
+TAIL_ENTRIES = Gauge('tail_cache_entries', 'Queries with cached historical datapoints', multiprocess_mode='livesum')
+
+# Fixed size downsampling intervals, e.g. 1m-avg (calendar and 'all' intervals are not supported)
+DOWNSAMPLE = re.compile(r'^(\d+)(s|m|h|d|w)-')
+UNIT_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+class TailEntry(object):
+    """
+    Historical datapoints of a query, final up to (excluding) until
+    """
+
+    def __init__(self, start, until, series):
+        """
+        :param series: Series key -> series (OpenTSDB response format)
+        """
+        self.start = start
+        self.until = until
+        self.series = series
+
+
+class TailFetch(object):
+    """
+    What has to be fetched from the backend to answer a query
+    """
+
+    def __init__(self, key, start, boundary, interval, entry=None, body=None):
+        """
+        :param start: Start of the query range, aligned to the downsampling interval
+        :param boundary: Datapoints before that timestamp are final
+        :param entry: Cached TailEntry if only the tail has to be fetched
+        :param body: Request body sent to the backend
+        """
+        self.key = key
+        self.start = start
+        self.boundary = boundary
+        self.interval = interval
+        self.entry = entry
+        self.body = body
+
+
+class TailCache(object):
+    """
+    Caches the final part of the datapoints of relative queries (e.g. start: 24h-ago) per query,
+    so that a refresh only asks the backend for the datapoints since the last cached one
+    and merges them with the cached series.
+
+    Only queries with a fixed downsampling interval on every sub query are supported:
+    the cached part ends on an interval boundary and the backend is asked
+    for one extra interval before it, which keeps rates and edges identical.
+    """
+
+    def __init__(self, max_entries=1024, settle=120):
+        """
+        :param max_entries: Max number of queries to cache (LRU)
+        :param settle: Datapoints older than that (seconds) are considered final
+        """
+        self.max_entries = max_entries
+        self.settle = settle
+
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_interval(query):
+        """
+        :return: Largest downsampling interval of the query in seconds, None if the query is not supported
+        """
+        if query.get_end() is not None or not str(query.get_start_raw()).endswith('-ago'):
+            return None
+        if query.q.get('msResolution') or query.q.get('ms') or query.q.get('delete'):
+            return None
+
+        interval = 0
+        for q in query.get_queries():
+            m = DOWNSAMPLE.match(str(q.get('downsample', '')))
+            if not m or not int(m.group(1)):
+                return None
+            interval = max(interval, int(m.group(1)) * UNIT_SECONDS[m.group(2)])
+        return interval
+
+    @staticmethod
+    def series_key(series):
+        return json.dumps([series.get('metric'), series.get('tags'), sorted(series.get('aggregateTags', [])),
+                           (series.get('query') or {}).get('index')], sort_keys=True)
+
+    def plan(self, query, now=None):
+        """
+        :return: TailFetch, None if the query is not supported
+        """
+        interval = self.get_interval(query)
+        if not interval:
+            return None
+
+        if now is None:
+            now = time.time()
+        start = int(query.get_start_timestamp()) // interval * interval
+        boundary = int(now - self.settle) // interval * interval
+        key = query.get_range_key()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+
+        if entry is None or entry.start > start or entry.until <= start:
+            TAIL_MISSES.inc()
+            return TailFetch(key, start, boundary, interval, body=query.to_json())
+
+        TAIL_HITS.inc()
+        q = dict(query.q)
+        q['start'] = entry.until - interval
+        return TailFetch(key, start, boundary, interval, entry, json.dumps(q))
+
+    def merge(self, fetch, data):
+        """
+        Merge the datapoints returned by the backend with the cached ones and cache the final part
+        :param fetch: TailFetch
+        :param data: Decoded backend response
+        :return: Response body with the merged series and the summary of the backend response
+        """
+        response = OpenTSDBResponse(data)
+        fetched = response.get_series()
+        if not isinstance(fetched, list):
+            return data
+
+        cached = fetch.entry.series if fetch.entry is not None else {}
+        until = fetch.entry.until if fetch.entry is not None else fetch.start
+
+        merged = collections.OrderedDict()
+        for key, series in cached.items():
+            dps = collections.OrderedDict(
+                (ts, v) for ts, v in series['dps'].items() if fetch.start <= int(ts) < until
+            )
+            if dps:
+                merged[key] = dict(series, dps=dps)
+        for series in fetched:
+            key = self.series_key(series)
+            dps = merged[key]['dps'] if key in merged else collections.OrderedDict()
+            dps.update((ts, v) for ts, v in series.get('dps', {}).items() if int(ts) >= until)
+            merged[key] = dict(series, dps=dps)
+
+        final = collections.OrderedDict()
+        for key, series in merged.items():
+            dps = collections.OrderedDict((ts, v) for ts, v in series['dps'].items() if int(ts) < fetch.boundary)
+            final[key] = dict(series, dps=dps)
+        self.update(fetch.key, TailEntry(fetch.start, fetch.boundary, final))
+
+        body = list(merged.values())
+        if response.get_stats():
+            body.append({"statsSummary": response.get_stats()})
+        return json.dumps(body).encode('utf-8')
+
+    def update(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            TAIL_ENTRIES.set(len(self.entries))
@@ -111,6 +111,30 @@ class OpenTSDBQuery(object):
     def get_id(self):
         return self.id
 
+    def get_range_key(self):
+        """
+        Identifies the query and its time range. Relative ranges are kept as sent,
+        absolute timestamps are normalized to seconds.
+        """
+        start, end = self.get_start_raw(), self.get_end()
+        if str(start).isdigit():
+            start = int(self.get_start_timestamp())
+        if end is not None and str(end).isdigit():
+            end = int(self.get_end_timestamp())
+        return "{}_{}_{}_{}".format(self.id, start, end, self.get_range_options())
+
+    def get_resolved_range(self):
+        """
+        :return: (start, end) timestamps in seconds
+        """
+        return int(self.get_start_timestamp()), int(self.get_end_timestamp())
+
+    def get_range_options(self):
+        """
+        Keys left out of the id which still change the result
+        """
+        return json.dumps({k: self.q[k] for k in ('timezone', 'options', 'padding') if k in self.q}, sort_keys=True)
+
     def _show_stats(self):
         self.q.update({"showSummary": True})
 
@@ -139,13 +163,34 @@ class OpenTSDBQuery(object):
 class OpenTSDBResponse(object):
     """
     Common methods for working with OpenTSDB responses
+
+    The trailing statsSummary element is located by scanning the raw body,
+    so only the summary object is parsed and the series bytes are forwarded unchanged.
     """
-    r = []
+    r = None
     stats = []
 
     def __init__(self, data):
 
         self.stats = {}
+        self.r = None
+        self.body = None
+
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        split = self.split_summary(data)
+        if split:
+            self.body, summary = split
+            self.stats = self.filter_summary(summary)
+        elif b'"statsSummary"' not in data and data.lstrip().startswith(b'['):
+            # Nothing to drop
+            self.body = data
+        else:
+            self._parse(data)
+
+    def _parse(self, data):
+
         self.r = []
 
         rlist = json.loads(data)
@@ -159,17 +204,82 @@ class OpenTSDBResponse(object):
                 self.r.append(item)
                 continue
 
-            filtered = {}
-            for key in summary:
-                if key.startswith('queryIdx_'):
-                    continue
-                filtered[key] = summary[key]
-
-            self.stats = filtered
+            self.stats = self.filter_summary(summary)
 
+    @staticmethod
+    def filter_summary(summary):
+        filtered = {}
+        for key in summary:
+            if key.startswith('queryIdx_'):
+                continue
+            filtered[key] = summary[key]
+        return filtered
+
+    @staticmethod
+    def split_summary(data):
+        """
+        Split a response body into the series (as a JSON array) and the summary,
+        provided the summary is the last element of the array.
+        :param data: Response body (bytes)
+        :return: (series bytes, summary dict) or None if no trailing summary was found
+        """
+        key_pos = data.rfind(b'"statsSummary"')
+        if key_pos < 0:
+            return None
+
+        start = data.rfind(b'{', 0, key_pos)
+        end = data.rfind(b']')
+        if start < 0 or end < key_pos or data[start + 1:key_pos].strip() or data[end + 1:].strip():
+            return None
+
+        try:
+            item = json.loads(data[start:end])
+        except ValueError:
+            return None
+        if not isinstance(item, dict) or not isinstance(item.get("statsSummary"), dict):
+            return None
+
+        head = data[:start].rstrip()
+        if head.endswith(b','):
+            return head[:-1] + b']', item["statsSummary"]
+        if head.endswith(b'[') and not head[:-1].strip():
+            return head + b']', item["statsSummary"]
+        return None
 
     def get_stats(self):
         return self.stats
 
+    def get_series(self):
+        if self.r is None:
+            self.r = json.loads(self.body)
+        return self.r
+
     def to_json(self, sort_keys=False):
-        return json.dumps(self.r, sort_keys=sort_keys)
+        return json.dumps(self.get_series(), sort_keys=sort_keys)
+
+    def to_bytes(self):
+        """
+        :return: The response without the summary, as sent by the backend if possible
+        """
+        if self.body is not None:
+            return self.body
+        return self.to_json().encode('utf-8')
+
+
+class OpenTSDBResponseSummary(object):
+    """
+    Summary stats of a response which is passed through unmodified,
+    read from the (decompressed) end of the response body
+    """
+    stats = {}
+
+    def __init__(self, tail):
+
+        self.stats = {}
+
+        split = OpenTSDBResponse.split_summary(tail)
+        if split:
+            self.stats = OpenTSDBResponse.filter_summary(split[1])
+
+    def get_stats(self):
+        return self.stats
@@ -0,0 +1,94 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import logging
+import threading
+import time
+
+import redis
+from prometheus_client import Counter, Gauge
+
+REDIS_CIRCUIT_OPEN = Gauge('redis_circuit_open', 'Redis calls are skipped after repeated failures (1) or not (0)',
+                           multiprocess_mode='max')
+REDIS_FAILURES = Counter('redis_failures', 'Failed Redis calls')
+REDIS_SKIPPED = Counter('redis_skipped', 'Redis calls skipped while the circuit is open')
+
+
+def connect(redis_config, decode_responses=False):
+    """
+    :param redis_config: The db.redis config section, host, port and password or unix_socket_path,
+                         plus the optional max_connections, socket_timeout and socket_connect_timeout
+    :return: Redis client
+    """
+    options = {
+        'password': redis_config.get('password') or None,
+        'socket_timeout': redis_config.get('socket_timeout', 1),
+        'decode_responses': decode_responses
+    }
+    if redis_config.get('unix_socket_path'):
+        options['connection_class'] = redis.UnixDomainSocketConnection
+        options['path'] = redis_config['unix_socket_path']
+    else:
+        options['host'] = redis_config['host']
+        options['port'] = redis_config['port']
+        options['socket_connect_timeout'] = redis_config.get('socket_connect_timeout', 1)
+
+    max_connections = redis_config.get('max_connections')
+    if max_connections:
+        # Callers wait up to socket_timeout for a free connection, a busy pool is not a Redis failure
+        pool = redis.BlockingConnectionPool(max_connections=max_connections, timeout=options['socket_timeout'],
+                                            **options)
+    else:
+        pool = redis.ConnectionPool(**options)
+    return redis.Redis(connection_pool=pool)
+
+
+class CircuitBreaker(object):
+    """
+    Skips Redis for backoff seconds after max_failures consecutive failures, so that a Redis server
+    which is down or slow doesn't delay every request by its timeouts.
+    Once the backoff is over, calls go through again and a single failure opens the circuit again.
+    """
+
+    def __init__(self, max_failures=3, backoff=10):
+        self.max_failures = max_failures
+        self.backoff = backoff
+
+        self.failures = 0
+        self.open_until = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        :return: False if Redis should not be called
+        """
+        if time.time() < self.open_until:
+            REDIS_SKIPPED.inc()
+            return False
+        return True
+
+    def success(self):
+        if self.failures:
+            with self.lock:
+                if self.failures >= self.max_failures:
+                    logging.info("Redis is back, circuit closed")
+                self.failures = 0
+                REDIS_CIRCUIT_OPEN.set(0)
+
+    def failure(self, error):
+        REDIS_FAILURES.inc()
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.max_failures:
+                self.open_until = time.time() + self.backoff
+                REDIS_CIRCUIT_OPEN.set(1)
+                logging.error("Redis server connection issue: {}, skipping Redis for {}s".format(error, self.backoff))
+            else:
+                logging.error("Redis server connection issue: {}".format(error))
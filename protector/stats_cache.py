@@ -0,0 +1,130 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import collections
+import logging
+import threading
+import time
+
+from prometheus_client import Counter
+
+STATS_CACHE_HITS = Counter('stats_cache_hits', 'Query stats served from the local cache')
+STATS_CACHE_MISSES = Counter('stats_cache_misses', 'Query stats read from Redis')
+STATS_CACHE_INVALIDATIONS = Counter('stats_cache_invalidations', 'Cached query stats refreshed after a change notification')
+
+
+class StatsCache(object):
+    """
+    Local copy of the per interval query stats hashes (<query_id>_<interval>), so that repeated queries
+    are checked without a Redis round trip.
+
+    Entries hold the hash as Redis returns it (string values), or None when there is no hash.
+    They are updated by the local writes and expire after a short TTL, which bounds how long
+    writes of other instances go unnoticed unless keyspace notifications are enabled (listen).
+    """
+
+    def __init__(self, ttl=5, max_entries=10000):
+        """
+        :param ttl: Seconds an entry is used before Redis is read again
+        :param max_entries: Max number of cached hashes (LRU)
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # key -> (stats or None, expires)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.listener = None
+
+    def get(self, key):
+        """
+        :return: (found, stats) stats is None if the key is known not to exist
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] < time.time():
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is None:
+            STATS_CACHE_MISSES.inc()
+            return False, None
+        STATS_CACHE_HITS.inc()
+        return True, entry[0] and dict(entry[0])
+
+    def put(self, key, stats):
+        """
+        :param stats: The hash as read from Redis, None or empty if it does not exist
+        """
+        with self.lock:
+            self._store(key, dict(stats) if stats else None)
+
+    def update(self, key, fields, increments, created):
+        """
+        Apply a write (HMSET fields, then HINCRBY increments) to the cached copy of a hash
+        :param created: True if the write created the hash
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] < time.time():
+                entry = None
+
+            if created:
+                stats = {}
+            elif entry is not None and entry[0] is not None:
+                stats = dict(entry[0])
+            else:
+                # The rest of the hash is unknown locally
+                self.entries.pop(key, None)
+                return
+
+            stats.update({k: str(v) for k, v in fields.items()})
+            for k, v in increments.items():
+                stats[k] = str(int(stats.get(k, 0)) + v)
+            self._store(key, stats)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def _store(self, key, stats):
+        self.entries[key] = (stats, time.time() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def listen(self, db):
+        """
+        Refresh cached hashes when they change in Redis, written by any protector instance.
+        Requires keyspace notifications for hash and generic commands (notify-keyspace-events Khg).
+        The refresh happens on a background thread, never on the request path.
+        :param db: Redis client (decode_responses=True)
+        """
+        index = db.connection_pool.connection_kwargs.get('db', 0)
+        prefix = "__keyspace@{}__:".format(index)
+
+        def on_event(message):
+            key = message['channel'][len(prefix):]
+            with self.lock:
+                if key not in self.entries:
+                    return
+            STATS_CACHE_INVALIDATIONS.inc()
+            try:
+                self.put(key, db.hgetall(key))
+            except Exception as e:
+                logging.error("Stats cache refresh failed: {}".format(e))
+                self.invalidate(key)
+
+        pubsub = db.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(**{prefix + '*': on_event})
+        self.listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+        logging.info("Stats cache listening to keyspace notifications")
+        return self.listener
@@ -0,0 +1,79 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import logging
+import threading
+import time
+
+from prometheus_client import Counter, Histogram
+
+STATS_COMPACTION_DURATION = Histogram('stats_compaction_duration_seconds', 'Duration of the query stats compactions',
+                                      buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300))
+STATS_COMPACTED_EXECUTIONS = Counter('stats_compaction_executions_dropped',
+                                     'Executions dropped from the query histories, past the retention')
+STATS_COMPACTED_HOURS = Counter('stats_compaction_hours_dropped', 'Hourly aggregates of queries dropped')
+STATS_COMPACTION_FAILED = Counter('stats_compaction_failed', 'Failed query stats compactions')
+
+
+class StatsCompactor(object):
+    """
+    Compacts the query stats every interval seconds, on a background thread: executions older than retention
+    seconds are dropped from the histories, they remain in the hourly aggregates, and hourly aggregates older
+    than hourly_retention seconds are dropped (0 keeps them). See StatsStore.compact.
+    """
+
+    def __init__(self, store, interval=3600, retention=86400, hourly_retention=0, batch_size=100):
+        self.store = store
+        self.interval = interval
+        self.retention = retention
+        self.hourly_retention = hourly_retention
+        self.batch_size = batch_size
+
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="stats-compactor", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.compact()
+
+    def compact(self):
+        """
+        :return: (executions, hourly aggregates) dropped, None if the compaction failed
+        """
+        start = time.time()
+        try:
+            dropped = self.store.compact(self.retention, self.hourly_retention, self.batch_size)
+        except Exception as e:
+            # Unexpected errors too (e.g. an undecodable history), the thread goes on
+            STATS_COMPACTION_FAILED.inc()
+            logging.error("Query stats compaction failed: {}".format(e))
+            return None
+        duration = time.time() - start
+        STATS_COMPACTION_DURATION.observe(duration)
+
+        executions, hours = dropped
+        STATS_COMPACTED_EXECUTIONS.inc(executions)
+        STATS_COMPACTED_HOURS.inc(hours)
+        logging.info("Query stats compacted in {:.1f}s: {} executions and {} hourly aggregates dropped".format(
+            duration, executions, hours))
+        return dropped
+
+    def stop(self, timeout=5):
+        """
+        Returns once the compaction in progress is over, or after timeout seconds
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
@@ -0,0 +1,122 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import logging
+import queue
+import threading
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+STATS_QUEUE_LENGTH = Gauge('stats_writer_queue_length', 'Query stats records waiting to be written',
+                           multiprocess_mode='livesum')
+STATS_DROPPED = Counter('stats_writer_dropped', 'Query stats records dropped, the queue being full')
+STATS_WRITE_FAILED = Counter('stats_writer_failed', 'Query stats records lost to a failed write')
+STATS_BATCH_SIZE = Histogram('stats_writer_batch_size', 'Query stats records written per round trip',
+                             buckets=(1, 5, 10, 25, 50, 100, 250, 500))
+
+
+class StatsWriter(object):
+    """
+    Writes query stats records on a background thread, in batches, so that requests don't wait for Redis.
+
+    Records are queued (bounded) and written when batch_size of them are waiting or every flush_interval
+    seconds. When the queue is full, put waits up to block seconds for room and drops the record afterwards.
+    """
+
+    def __init__(self, write, max_queue=10000, batch_size=100, flush_interval=1.0, block=0):
+        """
+        :param write: Function writing a list of records, returns False if they could not be written
+        """
+        self.write = write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block = block
+
+        self.queue = queue.Queue(max(max_queue, 1))
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="stats-writer", daemon=True)
+        self.thread.start()
+
+    def put(self, record):
+        """
+        :return: False if the record was dropped
+        """
+        try:
+            if self.block > 0:
+                self.queue.put(record, timeout=self.block)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            STATS_DROPPED.inc()
+            logging.warning("Stats writer queue full, dropping the stats of query {}".format(record.get('id')))
+            return False
+        STATS_QUEUE_LENGTH.set(self.queue.qsize())
+        return True
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.flush(self.flush_interval)
+        # Drain what is left
+        while not self.queue.empty():
+            self.flush(0)
+
+    def flush(self, wait):
+        """
+        Write up to batch_size records, waiting up to wait seconds for them
+        """
+        batch = []
+        deadline = time.time() + wait
+        while len(batch) < self.batch_size:
+            try:
+                remaining = deadline - time.time()
+                if remaining > 0:
+                    record = self.queue.get(timeout=remaining)
+                else:
+                    record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is None:
+                # Woken up by stop
+                break
+            batch.append(record)
+        STATS_QUEUE_LENGTH.set(self.queue.qsize())
+        if not batch:
+            return
+
+        STATS_BATCH_SIZE.observe(len(batch))
+        try:
+            written = self.write(batch)
+        except Exception as e:
+            logging.error("Stats writer failed: {}".format(e))
+            written = False
+        if not written:
+            STATS_WRITE_FAILED.inc(len(batch))
+
+    def stop(self, timeout=5):
+        """
+        Write the queued records and stop the thread, waiting up to timeout seconds
+        """
+        if self.thread is None:
+            return
+        self.stopping.set()
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            # Busy writing anyway
+            pass
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logging.error("Stats writer did not finish, {} records lost".format(self.queue.qsize()))
+        self.thread = None
@@ -0,0 +1,152 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+from protector.store import history as history_encoding
+
+
+class StoreError(Exception):
+    """
+    The stats store could not be reached or failed
+    """
+    pass
+
+
+def query_key(query_id):
+    return "{}_query".format(query_id)
+
+
+def history_key(query_id):
+    return "{}_stats".format(query_id)
+
+
+def hourly_key(query_id):
+    return "{}_hourly".format(query_id)
+
+
+def hourly_max_key(query_id):
+    return "{}_hourly_max".format(query_id)
+
+
+def sketch_key(query_id):
+    return "{}_sketch".format(query_id)
+
+
+def top_key(toptype, day, hour):
+    return "top_{}_{}_{}".format(toptype, day, hour)
+
+
+def day_top_key(toptype, day):
+    return "top_{}_{}".format(toptype, day)
+
+
+def ranked(scores, limit=0, offset=0):
+    """
+    :param scores: (member, score) pairs
+    :return: The pairs by decreasing score (then member, like ZREVRANGE), limit of them from offset (0: all)
+    """
+    ranking = sorted(scores, key=lambda item: (item[1], item[0]), reverse=True)
+    return ranking[offset:offset + limit if limit else None]
+
+
+class StatsStore(object):
+    """
+    Where the query stats are kept. All stores use the same keys:
+
+    - <query_id>_query: the query (JSON)
+    - <query_id>_stats: its history_size most recent executions (see history)
+    - <query_id>_hourly: its executions, aggregated by hour (see history)
+    - <query_id>_hourly_max: max duration and datapoints of its executions by hour (see history)
+    - <query_id>_sketch: quantile sketches of its durations and datapoints, by interval (see sketch)
+    - <query_id>_<interval>: hash of the last execution stats and counters for a query range, in minutes
+    - top_duration_<day>_<hour>, top_dps_<day>_<hour>: max duration and datapoints of the queries
+      run that hour, by <query_id>_<interval>
+    - top_duration_<day>, top_dps_<day>: the max of the hourly tops of a past day, kept by stores that precompute them
+
+    Keys expire ttl seconds after they are created (0 keeps them). Hash values are strings, as Redis returns them.
+    Failures are raised as StoreError.
+    """
+
+    def __init__(self, ttl=0, history_size=100):
+        self.ttl = ttl
+        self.history_size = history_size
+
+    def write(self, records):
+        """
+        Write query execution records (see Protector.stats_record)
+        :return: For each record, True if it created the hash of its interval
+        """
+        raise NotImplementedError()
+
+    def load(self, key):
+        """
+        :param key: <query_id>_<interval>
+        :return: The hash, empty if there is none
+        """
+        raise NotImplementedError()
+
+    def history(self, query_id):
+        """
+        :return: The recent executions of a query, oldest first
+        """
+        raise NotImplementedError()
+
+    def aggregates(self, query_id):
+        """
+        :return: {hour timestamp: {'count', 'timeouts', 'duration', 'dps', 'max_duration', 'max_dps'}}
+                 executions of a query by hour
+        """
+        raise NotImplementedError()
+
+    def compact(self, retention, hourly_retention=0, count=100):
+        """
+        Drop the executions older than retention seconds from the query histories, they only count in the
+        hourly aggregates from then on, and the hourly aggregates older than hourly_retention seconds (0 keeps them).
+        Safe to run while protectors write.
+        :param count: Keys handled per round trip
+        :return: (executions, hourly aggregates) dropped
+        """
+        raise NotImplementedError()
+
+    def sketches(self, query_id):
+        """
+        :return: {interval: {'duration': Sketch, 'dps': Sketch}} of a query
+        """
+        raise NotImplementedError()
+
+    def top(self, toptype, buckets, limit=0, offset=0):
+        """
+        :param toptype: duration or dps
+        :param buckets: (day, hour) of the hourly tops to read
+        :param limit: Max entries per bucket from offset, 0 returns them all
+        :return: For each bucket, [(<query_id>_<interval>, max value), ...] by decreasing value
+        """
+        raise NotImplementedError()
+
+    def top_days(self, toptype, days, limit=0, offset=0):
+        """
+        Day leaderboards, each query ranked by its max value over the hours of the day
+        :param days: (day, hours, complete) of the days to read, complete once the day is over
+        :return: For each day, [(<query_id>_<interval>, max value), ...] by decreasing value
+        """
+        data = []
+        for day, hours, complete in days:
+            scores = {}
+            for bucket in self.top(toptype, [(day, hour) for hour in hours]):
+                for member, score in bucket:
+                    scores[member] = max(score, scores.get(member, score))
+            data.append(ranked(scores.items(), limit, offset))
+        return data
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def decode_history(entries):
+        return [history_encoding.decode(e) for e in entries]
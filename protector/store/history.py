@@ -0,0 +1,138 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+"""
+Encoding of the query executions history.
+
+An execution is a JSON array of its fields, in the order below, followed by a few summary figures:
+[timestamp, start, end, duration, timeout, emittedDPs, dpsPreFilter, rowsPreFilter, processingPreWriteTime, maxHBaseTime]
+Entries written before were JSON objects with the complete summary, they are decoded as they are.
+
+Besides the recent executions, the executions of each hour are counted in <query_id>_hourly fields
+<hour timestamp>:<n (executions)|t (timeouts)|d (total duration)|p (total datapoints)>
+and their max duration and datapoints are kept in <query_id>_hourly_max, a sorted set of <hour timestamp>:<d|p>.
+Executions older than the compaction retention are dropped from the history, they live on in the hourly aggregates.
+"""
+
+import json
+
+FIELDS = ('timestamp', 'start', 'end', 'duration', 'timeout')
+SUMMARY_FIELDS = ('emittedDPs', 'dpsPreFilter', 'rowsPreFilter', 'processingPreWriteTime', 'maxHBaseTime')
+
+# Hourly aggregate fields
+AGGREGATES = {'n': 'count', 't': 'timeouts', 'd': 'duration', 'p': 'dps'}
+# Hourly max members
+MAXIMA = {'d': 'max_duration', 'p': 'max_dps'}
+
+
+def encode(stats):
+    """
+    :param stats: Execution stats, with a summary
+    :return: Compact history entry
+    """
+    summary = stats.get('summary') or {}
+    values = [stats.get(f) for f in FIELDS] + [summary.get(f) for f in SUMMARY_FIELDS]
+    values[FIELDS.index('timeout')] = int(bool(values[FIELDS.index('timeout')]))
+    return json.dumps(values, separators=(',', ':'))
+
+
+def decode(entry):
+    """
+    :return: Execution stats, as encoded or as written by former versions
+    """
+    values = json.loads(entry)
+    if isinstance(values, dict):
+        return values
+    stats = dict(zip(FIELDS, values))
+    stats['timeout'] = bool(stats['timeout'])
+    stats['summary'] = {f: v for f, v in zip(SUMMARY_FIELDS, values[len(FIELDS):]) if v is not None}
+    return stats
+
+
+def is_legacy(entry):
+    return entry.lstrip().startswith('{')
+
+
+def hour_of(timestamp):
+    return int(timestamp) // 3600 * 3600
+
+
+def increments(stats):
+    """
+    :return: Hourly aggregate fields and increments of an execution
+    """
+    hour = hour_of(stats['timestamp'])
+    values = {'n': 1, 'd': float(stats['duration'])}
+    if stats.get('timeout'):
+        values['t'] = 1
+    dps = (stats.get('summary') or {}).get('emittedDPs')
+    if dps:
+        values['p'] = int(dps)
+    return {"{}:{}".format(hour, k): v for k, v in values.items()}
+
+
+def hourly_max(stats):
+    """
+    :return: Hourly max members and values of an execution
+    """
+    hour = hour_of(stats['timestamp'])
+    values = {'d': float(stats['duration'])}
+    dps = (stats.get('summary') or {}).get('emittedDPs')
+    if dps:
+        values['p'] = int(dps)
+    return {"{}:{}".format(hour, k): v for k, v in values.items()}
+
+
+def timestamp_of(entry):
+    """
+    :return: Execution timestamp of a history entry, encoded or legacy
+    """
+    values = json.loads(entry)
+    return values['timestamp'] if isinstance(values, dict) else values[0]
+
+
+def expired(entries, before):
+    """
+    :param entries: History, oldest first
+    :return: Number of leading entries of executions before the given timestamp
+    """
+    for i, entry in enumerate(entries):
+        if timestamp_of(entry) >= before:
+            return i
+    return len(entries)
+
+
+def field_hour(field):
+    """
+    :return: Hour timestamp of a <query_id>_hourly field or <query_id>_hourly_max member
+    """
+    return int(field.split(':')[0])
+
+
+def decode_aggregates(fields, maxima=()):
+    """
+    :param fields: The <query_id>_hourly hash
+    :param maxima: The (member, score) of <query_id>_hourly_max
+    :return: {hour timestamp: {'count', 'timeouts', 'duration', 'dps', 'max_duration', 'max_dps'}}
+             of the hours with executions
+    """
+    hours = {}
+    empty = dict({v: 0 for v in AGGREGATES.values()}, **{v: 0 for v in MAXIMA.values()})
+    for field, value in fields.items():
+        hour, name = field.split(':')
+        hours.setdefault(int(hour), dict(empty))[AGGREGATES[name]] = float(value)
+    for member, value in maxima:
+        hour, name = member.split(':')
+        if int(hour) in hours:
+            hours[int(hour)][MAXIMA[name]] = float(value)
+    for aggregate in hours.values():
+        for name in ('count', 'timeouts', 'dps', 'max_dps'):
+            aggregate[name] = int(aggregate[name])
+    return hours
@@ -0,0 +1,37 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+from protector import redis_client
+from protector.store.memory_store import MemoryStore
+from protector.store.redis_store import RedisStore
+from protector.store.sqlite_store import SqliteStore
+
+STORE_TYPES = ('redis', 'memory', 'sqlite')
+
+
+def load_store(db_config):
+    """
+    :param db_config: The db config section, type (redis, memory or sqlite), expire, history_size
+                      and the type's own section
+    :return: StatsStore
+    """
+    db_type = db_config.get('type', 'redis')
+    ttl = max(db_config.get('expire', 0), 0)
+
+    history_size = db_config.get('history_size', 100)
+
+    if db_type == 'redis':
+        return RedisStore(redis_client.connect(db_config['redis'], decode_responses=True), ttl, history_size)
+    if db_type == 'memory':
+        return MemoryStore(ttl, db_config.get('memory', {}).get('max_keys', 100000), history_size)
+    if db_type == 'sqlite':
+        return SqliteStore(db_config.get('sqlite', {}).get('path', '/var/lib/protector/stats.db'), ttl,
+                           history_size=history_size)
+    raise Exception("Unknown db type: {}. Supported: {}".format(db_type, ", ".join(STORE_TYPES)))
@@ -0,0 +1,167 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import collections
+import threading
+import time
+
+from protector.store import history as history_encoding
+from protector.store import sketch
+from protector.store.base import (StatsStore, query_key, history_key, hourly_key, hourly_max_key,
+                                  sketch_key, top_key, ranked)
+
+
+class MemoryStore(StatsStore):
+    """
+    Stats kept in the protector process, lost on restart and not shared between worker processes.
+    Holds up to max_keys keys, the least recently used ones are evicted.
+    """
+
+    def __init__(self, ttl=0, max_keys=100000, history_size=100):
+        super(MemoryStore, self).__init__(ttl, history_size)
+        self.max_keys = max_keys
+
+        # key -> [value, expires or None]
+        self.keys = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def _get(self, key, now):
+        entry = self.keys.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self.keys[key]
+            return None
+        self.keys.move_to_end(key)
+        return entry[0]
+
+    def _peek(self, key, now):
+        """
+        Like _get, without making the key recently used
+        """
+        entry = self.keys.get(key)
+        if entry is None or (entry[1] is not None and entry[1] <= now):
+            return None
+        return entry[0]
+
+    def _create(self, key, value, now):
+        """
+        Like a Redis write to a missing key followed by EXPIRE NX
+        """
+        self.keys[key] = [value, now + self.ttl if self.ttl else None]
+        self.keys.move_to_end(key)
+        return value
+
+    def _zadd_gt(self, key, member, score, now):
+        zset = self._get(key, now)
+        if zset is None:
+            zset = self._create(key, {}, now)
+        if member not in zset or score > zset[member]:
+            zset[member] = float(score)
+
+    def write(self, records):
+        created = []
+        now = time.time()
+        with self.lock:
+            for record in records:
+                interval_key = record['interval_key']
+
+                if self._get(query_key(record['id']), now) is None:
+                    self._create(query_key(record['id']), record['query'], now)
+
+                history = self._get(history_key(record['id']), now)
+                if history is None:
+                    history = self._create(history_key(record['id']), [], now)
+                history.append(record['stats'])
+                del history[:-self.history_size]
+
+                hourly = self._get(hourly_key(record['id']), now)
+                if hourly is None:
+                    hourly = self._create(hourly_key(record['id']), {}, now)
+                for field, value in record['hourly'].items():
+                    hourly[field] = str(type(value)(hourly.get(field, 0)) + value)
+                for member, value in record['hourly_max'].items():
+                    self._zadd_gt(hourly_max_key(record['id']), member, value, now)
+
+                sketches = self._get(sketch_key(record['id']), now)
+                if sketches is None:
+                    sketches = self._create(sketch_key(record['id']), {}, now)
+                for field, value in record['sketch'].items():
+                    sketches[field] = str(int(sketches.get(field, 0)) + value)
+
+                stats = self._get(interval_key, now)
+                if stats is None:
+                    stats = self._create(interval_key, {}, now)
+                created.append('first_occurrence' not in stats)
+                stats.setdefault('first_occurrence', str(record['timestamp']))
+                stats.update({k: str(v) for k, v in record['global_stats'].items()})
+                stats['total_counter'] = str(int(stats.get('total_counter', 0)) + 1)
+                if record['timeout']:
+                    stats['timeout_counter'] = str(int(stats.get('timeout_counter', 0)) + 1)
+                else:
+                    self._zadd_gt(top_key('dps', record['day'], record['hour']), interval_key, record['sum_dp'], now)
+                self._zadd_gt(top_key('duration', record['day'], record['hour']), interval_key, record['duration'], now)
+
+            while len(self.keys) > self.max_keys:
+                self.keys.popitem(last=False)
+        return created
+
+    def load(self, key):
+        with self.lock:
+            return dict(self._get(key, time.time()) or {})
+
+    def history(self, query_id):
+        with self.lock:
+            return self.decode_history(self._get(history_key(query_id), time.time()) or [])
+
+    def aggregates(self, query_id):
+        now = time.time()
+        with self.lock:
+            hourly = dict(self._get(hourly_key(query_id), now) or {})
+            maxima = list((self._get(hourly_max_key(query_id), now) or {}).items())
+        return history_encoding.decode_aggregates(hourly, maxima)
+
+    def compact(self, retention, hourly_retention=0, count=100):
+        now = time.time()
+        oldest_hour = history_encoding.hour_of(now - hourly_retention)
+        executions = hours = 0
+        with self.lock:
+            keys = [k for k in self.keys if k.endswith(('_stats', '_hourly', '_hourly_max'))]
+
+        # The lock is released every count keys, for the writes
+        for i in range(0, len(keys), count):
+            with self.lock:
+                for key in keys[i:i + count]:
+                    value = self._peek(key, now)
+                    if value is None:
+                        continue
+                    if key.endswith('_stats'):
+                        old = history_encoding.expired(value, now - retention)
+                        del value[:old]
+                        executions += old
+                    elif hourly_retention:
+                        old = [f for f in value if history_encoding.field_hour(f) < oldest_hour]
+                        if key.endswith('_hourly'):
+                            hours += len({history_encoding.field_hour(f) for f in old})
+                        for field in old:
+                            del value[field]
+                    if not value:
+                        del self.keys[key]
+        return executions, hours
+
+    def sketches(self, query_id):
+        with self.lock:
+            return sketch.decode(self._get(sketch_key(query_id), time.time()) or {})
+
+    def top(self, toptype, buckets, limit=0, offset=0):
+        now = time.time()
+        with self.lock:
+            zsets = [dict(self._get(top_key(toptype, day, hour), now) or {}) for day, hour in buckets]
+        return [ranked(zset.items(), limit, offset) for zset in zsets]
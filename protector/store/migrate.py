@@ -0,0 +1,41 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+"""
+Convert the query histories written by former versions in Redis to the capped, compact format.
+Protectors can keep running meanwhile.
+
+Usage:
+python -m protector.store.migrate --configfile config.yaml
+"""
+
+import argparse
+import logging
+
+from protector.config.loader import parse_configfile
+from protector.store.loader import load_store
+from protector.store.redis_store import RedisStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--configfile', required=True)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    store = load_store(parse_configfile(args.configfile)['db'])
+    if not isinstance(store, RedisStore):
+        logging.info("Nothing to migrate, only Redis holds histories of former versions")
+        return
+    store.migrate_history()
+
+
+if __name__ == '__main__':
+    main()
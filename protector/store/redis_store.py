@@ -0,0 +1,311 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import itertools
+import logging
+import time
+
+import redis
+
+from protector.store import history as history_encoding
+from protector.store import sketch
+from protector.store.base import (StatsStore, StoreError, query_key, history_key, hourly_key, hourly_max_key,
+                                  sketch_key, top_key, day_top_key)
+
+# Seconds a past day leaderboard is kept once computed
+DAY_TOP_TTL = 86400
+
+# ZADD GT (Redis 6.2): members get the score if it is greater than theirs, ARGV are score, member pairs
+ZADD_MAX = """
+local added = 0
+for i = 1, #ARGV, 2 do
+    local score = redis.call('zscore', KEYS[1], ARGV[i + 1])
+    if not score or tonumber(ARGV[i]) > tonumber(score) then
+        added = added + redis.call('zadd', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+return added
+"""
+
+# PEXPIRE NX (Redis 7.0): the keys without TTL expire in ARGV[1] milliseconds
+PEXPIRE_NEW = """
+local set = 0
+for _, key in ipairs(KEYS) do
+    if redis.call('pttl', key) == -1 then
+        set = set + redis.call('pexpire', key, ARGV[1])
+    end
+end
+return set
+"""
+
+
+class RedisStore(StatsStore):
+    """
+    Stats kept in Redis (>= 5.0, 6.0 for the compaction and the migration), shared by all protector instances
+    """
+
+    def __init__(self, db, ttl=0, history_size=100):
+        """
+        :param db: Redis client (decode_responses=True)
+        """
+        super(RedisStore, self).__init__(ttl, history_size)
+        self.db = db
+
+    def write(self, records):
+        """
+        All the writes are sent in a single MULTI/EXEC round trip, keys get their TTL once,
+        when they are created, and the tops keep the max value. Both are Lua scripts (EXPIRE NX and ZADD GT
+        need Redis 7.0 and 6.2).
+        """
+        pipe = self.db.pipeline()
+        # Position of the HSETNX first_occurrence result of each record
+        created_at = []
+
+        for record in records:
+            stats_key = history_key(record['id'])
+            stats_hourly_key = hourly_key(record['id'])
+            stats_hourly_max_key = hourly_max_key(record['id'])
+            stats_sketch_key = sketch_key(record['id'])
+            interval_key = record['interval_key']
+            top_duration_key = top_key('duration', record['day'], record['hour'])
+            top_dps_key = top_key('dps', record['day'], record['hour'])
+
+            # store query
+            pipe.set(query_key(record['id']), record['query'], ex=(self.ttl or None), nx=True)
+
+            # Push the execution, keep the most recent ones
+            pipe.rpush(stats_key, record['stats'])
+            pipe.ltrim(stats_key, -self.history_size, -1)
+            for field, value in record['hourly'].items():
+                if isinstance(value, float):
+                    pipe.hincrbyfloat(stats_hourly_key, field, value)
+                else:
+                    pipe.hincrby(stats_hourly_key, field, value)
+            self._zadd_max(pipe, stats_hourly_max_key, record['hourly_max'])
+            for field, value in record['sketch'].items():
+                pipe.hincrby(stats_sketch_key, field, value)
+
+            created_at.append(len(pipe))
+            pipe.hsetnx(interval_key, 'first_occurrence', record['timestamp'])
+            pipe.hset(interval_key, mapping=record['global_stats'])
+
+            # Total counter, for convenience
+            pipe.hincrby(interval_key, "total_counter", 1)
+            if record['timeout']:
+                pipe.hincrby(interval_key, "timeout_counter", 1)
+            else:
+                # Save dps stats
+                self._zadd_max(pipe, top_dps_key, {interval_key: record['sum_dp']})
+
+            # Save duration stats
+            self._zadd_max(pipe, top_duration_key, {interval_key: record['duration']})
+
+            # Set TTL if supplied
+            if self.ttl:
+                self._pexpire_new(pipe, self.ttl * 1000, stats_key, stats_hourly_key, stats_hourly_max_key,
+                                  stats_sketch_key, interval_key, top_duration_key, top_dps_key)
+
+        try:
+            results = pipe.execute()
+        except redis.RedisError as e:
+            raise StoreError(e)
+        return [bool(results[i]) for i in created_at]
+
+    @staticmethod
+    def _zadd_max(pipe, key, mapping):
+        args = [v for member, score in mapping.items() for v in (score, member)]
+        if args:
+            pipe.eval(ZADD_MAX, 1, key, *args)
+
+    @staticmethod
+    def _pexpire_new(pipe, ttl, *keys):
+        """
+        :param ttl: Milliseconds
+        """
+        pipe.eval(PEXPIRE_NEW, len(keys), *(keys + (ttl,)))
+
+    def load(self, key):
+        try:
+            return self.db.hgetall(key)
+        except redis.RedisError as e:
+            raise StoreError(e)
+
+    def history(self, query_id):
+        try:
+            return self.decode_history(self.db.lrange(history_key(query_id), 0, -1))
+        except redis.RedisError as e:
+            raise StoreError(e)
+
+    def aggregates(self, query_id):
+        pipe = self.db.pipeline(transaction=False)
+        pipe.hgetall(hourly_key(query_id))
+        pipe.zrange(hourly_max_key(query_id), 0, -1, withscores=True)
+        try:
+            return history_encoding.decode_aggregates(*pipe.execute())
+        except redis.RedisError as e:
+            raise StoreError(e)
+
+    def compact(self, retention, hourly_retention=0, count=100):
+        """
+        Keys are found with SCAN, count at a time, and each batch is read and trimmed in two pipelined round trips.
+        Executions written while a history is trimmed can make it drop as many more old executions.
+        """
+        now = time.time()
+        oldest_hour = history_encoding.hour_of(now - hourly_retention)
+        executions = hours = 0
+        try:
+            for keys in self._scan(match="*_stats", count=count, _type="list"):
+                pipe = self.db.pipeline(transaction=False)
+                for key in keys:
+                    pipe.lrange(key, 0, -1)
+                trim = self.db.pipeline(transaction=False)
+                for key, entries in zip(keys, pipe.execute()):
+                    old = history_encoding.expired(entries, now - retention)
+                    if old:
+                        trim.ltrim(key, old, -1)
+                        executions += old
+                trim.execute()
+
+            if hourly_retention:
+                for keys in self._scan(match="*_hourly", count=count, _type="hash"):
+                    pipe = self.db.pipeline(transaction=False)
+                    for key in keys:
+                        pipe.hkeys(key)
+                        pipe.zrange(hourly_max_key(key[:-len("_hourly")]), 0, -1)
+                    results = pipe.execute()
+                    trim = self.db.pipeline(transaction=False)
+                    for key, fields, members in zip(keys, results[::2], results[1::2]):
+                        old_fields = [f for f in fields if history_encoding.field_hour(f) < oldest_hour]
+                        old_members = [m for m in members if history_encoding.field_hour(m) < oldest_hour]
+                        if old_fields:
+                            trim.hdel(key, *old_fields)
+                            hours += len({history_encoding.field_hour(f) for f in old_fields})
+                        if old_members:
+                            trim.zrem(hourly_max_key(key[:-len("_hourly")]), *old_members)
+                    trim.execute()
+        except redis.RedisError as e:
+            raise StoreError(e)
+        return executions, hours
+
+    def _scan(self, match, count, _type):
+        """
+        :return: Iterator of lists of up to count keys
+        """
+        keys = self.db.scan_iter(match=match, count=count, _type=_type)
+        while True:
+            batch = list(itertools.islice(keys, count))
+            if not batch:
+                return
+            yield batch
+
+    def sketches(self, query_id):
+        try:
+            return sketch.decode(self.db.hgetall(sketch_key(query_id)))
+        except redis.RedisError as e:
+            raise StoreError(e)
+
+    def top(self, toptype, buckets, limit=0, offset=0):
+        """
+        A single round trip, only the requested ranks of each hour are read
+        """
+        pipe = self.db.pipeline(transaction=False)
+        for day, hour in buckets:
+            pipe.zrevrange(top_key(toptype, day, hour), offset, offset + limit - 1 if limit else -1, withscores=True)
+        try:
+            return pipe.execute()
+        except redis.RedisError as e:
+            raise StoreError(e)
+
+    def top_days(self, toptype, days, limit=0, offset=0):
+        """
+        The hourly tops of a day are merged by Redis (ZUNIONSTORE AGGREGATE MAX). Complete days don't change anymore,
+        their leaderboard is kept DAY_TOP_TTL seconds in top_<type>_<day>, the current day is merged on every call.
+        Two round trips.
+        """
+        days = [(day, list(hours), complete) for day, hours, complete in days]
+        end = offset + limit - 1 if limit else -1
+        try:
+            pipe = self.db.pipeline(transaction=False)
+            for day, hours, complete in days:
+                pipe.exists(day_top_key(toptype, day))
+            computed = pipe.execute()
+
+            pipe = self.db.pipeline(transaction=False)
+            # Position of the ZREVRANGE result of each day
+            ranges_at = []
+            for (day, hours, complete), exists in zip(days, computed):
+                key = day_top_key(toptype, day)
+                if not complete:
+                    key = "{}_current".format(key)
+                if not (complete and exists):
+                    pipe.zunionstore(key, [top_key(toptype, day, hour) for hour in hours], aggregate='MAX')
+                    pipe.expire(key, DAY_TOP_TTL if complete else 60)
+                ranges_at.append(len(pipe))
+                pipe.zrevrange(key, offset, end, withscores=True)
+            results = pipe.execute()
+        except redis.RedisError as e:
+            raise StoreError(e)
+        return [results[i] for i in ranges_at]
+
+    def close(self):
+        self.db.close()
+
+    def migrate_history(self, count=100):
+        """
+        Convert the histories written by former versions: their executions are counted in the hourly
+        aggregates and maxima, and the most recent ones are kept, encoded. Safe to run while protectors write.
+        :param count: Keys scanned per round trip
+        :return: Number of converted histories
+        """
+        migrated = 0
+        for key in self.db.scan_iter(match="*_stats", count=count, _type="list"):
+            query_id = key[:-len("_stats")]
+            if self.db.transaction(lambda pipe: self._migrate(pipe, query_id), key, value_from_callable=True):
+                migrated += 1
+        logging.info("Migrated {} query histories".format(migrated))
+        return migrated
+
+    def _migrate(self, pipe, query_id):
+        """
+        Convert a history, pipe watches it
+        :return: True if it was converted
+        """
+        key = history_key(query_id)
+        entries = pipe.lrange(key, 0, -1)
+        legacy = [e for e in entries if history_encoding.is_legacy(e)]
+        if not legacy:
+            return False
+        ttl = pipe.pttl(key)
+
+        hourly = {}
+        maxima = {}
+        for entry in legacy:
+            stats = history_encoding.decode(entry)
+            for field, value in history_encoding.increments(stats).items():
+                hourly[field] = hourly.get(field, 0) + value
+            for member, value in history_encoding.hourly_max(stats).items():
+                maxima[member] = max(value, maxima.get(member, value))
+        recent = [e if not history_encoding.is_legacy(e) else history_encoding.encode(history_encoding.decode(e))
+                  for e in entries[-self.history_size:]]
+
+        pipe.multi()
+        pipe.delete(key)
+        pipe.rpush(key, *recent)
+        if ttl > 0:
+            pipe.pexpire(key, ttl)
+        for field, value in hourly.items():
+            if isinstance(value, float):
+                pipe.hincrbyfloat(hourly_key(query_id), field, value)
+            else:
+                pipe.hincrby(hourly_key(query_id), field, value)
+        self._zadd_max(pipe, hourly_max_key(query_id), maxima)
+        if ttl > 0:
+            self._pexpire_new(pipe, ttl, hourly_key(query_id), hourly_max_key(query_id))
+        return True
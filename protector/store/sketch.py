@@ -0,0 +1,137 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+"""
+Quantile sketches of the query durations and datapoints, DDSketch style.
+
+Values are counted in logarithmic buckets: bucket i holds the values in (GAMMA^(i-1), GAMMA^i], so any quantile is
+known within RELATIVE_ACCURACY of its value. Values below MIN_VALUE are counted as 0.
+The sketches of a query are kept in <query_id>_sketch fields <interval>:<d (duration)|p (datapoints)>:<bucket>
+and updated with increments, so that stores merge the executions of all protector instances as they are written.
+A few dozen buckets cover the spread of a query execution times. A sketch keeps at most MAX_BUCKETS of them (and ZERO):
+beyond, the lowest buckets are collapsed into the lowest one kept, so the low quantiles are overestimated but the high
+ones keep their accuracy. The stored hashes are collapsed as they are read, their fields are bounded by the range of
+the values, log(max / MIN_VALUE) / log(GAMMA): about 320 buckets from 1ms to 5min.
+"""
+
+import math
+
+RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+MIN_VALUE = 1e-3
+MAX_BUCKETS = 128
+
+# Sketch fields
+SKETCHES = {'d': 'duration', 'p': 'dps'}
+ZERO = 'z'
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def bucket(value):
+    """
+    :return: Bucket of a value, ZERO for the values too small to be told apart from 0
+    """
+    if value < MIN_VALUE:
+        return ZERO
+    return int(math.ceil(math.log(value, GAMMA)))
+
+
+class Sketch(object):
+    """
+    Counts of the values of a distribution by bucket
+    """
+
+    def __init__(self, counts=None):
+        # bucket -> count
+        self.counts = dict(counts or {})
+
+    @property
+    def count(self):
+        return sum(self.counts.values())
+
+    def add(self, value, count=1):
+        b = bucket(value)
+        if b in self.counts:
+            self.counts[b] += count
+        else:
+            self.counts[b] = count
+            self.collapse()
+
+    def merge(self, other):
+        for b, count in other.counts.items():
+            self.counts[b] = self.counts.get(b, 0) + count
+        return self.collapse()
+
+    def collapse(self):
+        """
+        Keep the MAX_BUCKETS highest buckets, the lower ones are counted in the lowest of them
+        """
+        buckets = sorted(b for b in self.counts if b != ZERO)
+        if len(buckets) > MAX_BUCKETS:
+            lowest = buckets[-MAX_BUCKETS]
+            for b in buckets[:-MAX_BUCKETS]:
+                self.counts[lowest] += self.counts.pop(b)
+        return self
+
+    def quantile(self, q):
+        """
+        :param q: 0 to 1
+        :return: Value of the quantile, within RELATIVE_ACCURACY, None if the sketch is empty
+        """
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = self.counts.get(ZERO, 0)
+        if rank < seen:
+            return 0.0
+        for b in sorted(b for b in self.counts if b != ZERO):
+            seen += self.counts[b]
+            if rank < seen:
+                # Value at the same relative distance from both bucket bounds
+                return 2 * GAMMA ** b / (GAMMA + 1)
+        return None
+
+    def summary(self):
+        """
+        :return: {'count', 'p50', 'p90', 'p99'}
+        """
+        summary = {'count': self.count}
+        for q in QUANTILES:
+            summary['p{}'.format(int(q * 100))] = self.quantile(q)
+        return summary
+
+
+def increments(interval, duration, dps=None):
+    """
+    :param dps: Datapoints of the execution, None if unknown (timeouts)
+    :return: Sketch fields and increments of an execution
+    """
+    values = {'d': duration}
+    if dps is not None:
+        values['p'] = dps
+    return {"{}:{}:{}".format(interval, name, bucket(value)): 1 for name, value in values.items()}
+
+
+def decode(fields):
+    """
+    :param fields: The <query_id>_sketch hash
+    :return: {interval: {'duration': Sketch, 'dps': Sketch}}
+    """
+    intervals = {}
+    for field, count in fields.items():
+        interval, name, b = field.split(':')
+        sketches = intervals.setdefault(int(interval), {v: Sketch() for v in SKETCHES.values()})
+        sketches[SKETCHES[name]].counts[b if b == ZERO else int(b)] = int(count)
+    for sketches in intervals.values():
+        for values in sketches.values():
+            values.collapse()
+    return intervals
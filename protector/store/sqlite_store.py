@@ -0,0 +1,238 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import os
+import sqlite3
+import threading
+import time
+
+from protector.store import history as history_encoding
+from protector.store import sketch
+from protector.store.base import (StatsStore, StoreError, query_key, history_key, hourly_key, hourly_max_key,
+                                  sketch_key, top_key)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS strings (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS lists (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, value TEXT);
+CREATE INDEX IF NOT EXISTS lists_key ON lists (key);
+CREATE TABLE IF NOT EXISTS hashes (key TEXT, field TEXT, value TEXT, PRIMARY KEY (key, field));
+CREATE TABLE IF NOT EXISTS zsets (key TEXT, member TEXT, score REAL, PRIMARY KEY (key, member));
+CREATE TABLE IF NOT EXISTS expiry (key TEXT PRIMARY KEY, expires REAL);
+CREATE INDEX IF NOT EXISTS expiry_expires ON expiry (expires);
+"""
+
+TABLES = ('strings', 'lists', 'hashes', 'zsets')
+
+# Compaction: executions before a timestamp, hourly aggregates before an hour
+COMPACT_HISTORIES = r"""
+DELETE FROM lists WHERE key LIKE '%\_stats' ESCAPE '\'
+AND COALESCE(json_extract(value, '$[0]'), json_extract(value, '$.timestamp')) < ?
+"""
+FIELD_HOUR = "CAST(substr({0}, 1, instr({0}, ':') - 1) AS INTEGER)"
+COUNT_OLD_HOURS = r"""
+SELECT COUNT(DISTINCT key || ' ' || {0}) FROM hashes WHERE key LIKE '%\_hourly' ESCAPE '\' AND {0} < ?
+""".format(FIELD_HOUR.format('field'))
+COMPACT_HOURLY = r"""
+DELETE FROM hashes WHERE key LIKE '%\_hourly' ESCAPE '\' AND {} < ?
+""".format(FIELD_HOUR.format('field'))
+COMPACT_HOURLY_MAX = r"""
+DELETE FROM zsets WHERE key LIKE '%\_hourly\_max' ESCAPE '\' AND {} < ?
+""".format(FIELD_HOUR.format('member'))
+
+
+class SqliteStore(StatsStore):
+    """
+    Stats kept in an SQLite database file, shared by the worker processes of a single host.
+    Expired keys are deleted when they are read and every purge_interval seconds.
+    """
+
+    def __init__(self, path, ttl=0, purge_interval=60, history_size=100):
+        super(SqliteStore, self).__init__(ttl, history_size)
+        self.path = path
+        self.purge_interval = purge_interval
+
+        self.lock = threading.Lock()
+        self.conn = None
+        self.pid = None
+        self.last_purge = 0
+
+    def connect(self):
+        """
+        :return: The connection of the current process, connections don't survive a fork
+        """
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+            self.pid = os.getpid()
+        return self.conn
+
+    @staticmethod
+    def _delete(cur, keys):
+        for table in TABLES + ('expiry',):
+            cur.executemany("DELETE FROM {} WHERE key = ?".format(table), [(k,) for k in keys])
+
+    def _live(self, cur, key, now):
+        """
+        Delete the key if it has expired
+        """
+        row = cur.execute("SELECT expires FROM expiry WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[0] <= now:
+            self._delete(cur, [key])
+
+    def _expire_nx(self, cur, key, now):
+        if self.ttl:
+            cur.execute("INSERT OR IGNORE INTO expiry VALUES (?, ?)", (key, now + self.ttl))
+
+    def _zadd_gt(self, cur, key, member, score, now):
+        self._live(cur, key, now)
+        cur.execute("INSERT INTO zsets VALUES (?, ?, ?) ON CONFLICT (key, member) "
+                    "DO UPDATE SET score = excluded.score WHERE excluded.score > score", (key, member, score))
+        self._expire_nx(cur, key, now)
+
+    def _increment(self, cur, key, field, value=1):
+        cast = 'REAL' if isinstance(value, float) else 'INTEGER'
+        cur.execute("INSERT INTO hashes VALUES (?, ?, ?) ON CONFLICT (key, field) "
+                    "DO UPDATE SET value = CAST(value AS {}) + ?".format(cast), (key, field, str(value), value))
+
+    def _purge(self, cur, now):
+        for table in TABLES:
+            cur.execute("DELETE FROM {} WHERE key IN (SELECT key FROM expiry WHERE expires <= ?)".format(table),
+                        (now,))
+        cur.execute("DELETE FROM expiry WHERE expires <= ?", (now,))
+        self.last_purge = now
+
+    def write(self, records):
+        created = []
+        now = time.time()
+        with self.lock:
+            try:
+                cur = self.connect().cursor()
+                cur.execute("BEGIN IMMEDIATE")
+                try:
+                    if now - self.last_purge > self.purge_interval:
+                        self._purge(cur, now)
+
+                    for record in records:
+                        interval_key = record['interval_key']
+                        stats_key = history_key(record['id'])
+                        stats_hourly_key = hourly_key(record['id'])
+                        stats_hourly_max_key = hourly_max_key(record['id'])
+                        stats_sketch_key = sketch_key(record['id'])
+                        for key in (query_key(record['id']), stats_key, stats_hourly_key, stats_hourly_max_key,
+                                    stats_sketch_key, interval_key):
+                            self._live(cur, key, now)
+
+                        cur.execute("INSERT OR IGNORE INTO strings VALUES (?, ?)",
+                                    (query_key(record['id']), record['query']))
+                        if cur.rowcount == 1:
+                            self._expire_nx(cur, query_key(record['id']), now)
+
+                        # Push the execution, keep the most recent ones
+                        cur.execute("INSERT INTO lists (key, value) VALUES (?, ?)", (stats_key, record['stats']))
+                        cur.execute("DELETE FROM lists WHERE key = ? AND id <= (SELECT id FROM lists WHERE key = ? "
+                                    "ORDER BY id DESC LIMIT 1 OFFSET ?)", (stats_key, stats_key, self.history_size))
+                        self._expire_nx(cur, stats_key, now)
+                        for field, value in record['hourly'].items():
+                            self._increment(cur, stats_hourly_key, field, value)
+                        self._expire_nx(cur, stats_hourly_key, now)
+                        for member, value in record['hourly_max'].items():
+                            self._zadd_gt(cur, stats_hourly_max_key, member, value, now)
+                        for field, value in record['sketch'].items():
+                            self._increment(cur, stats_sketch_key, field, value)
+                        self._expire_nx(cur, stats_sketch_key, now)
+
+                        cur.execute("INSERT OR IGNORE INTO hashes VALUES (?, 'first_occurrence', ?)",
+                                    (interval_key, str(record['timestamp'])))
+                        created.append(cur.rowcount == 1)
+                        cur.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?)",
+                                        [(interval_key, k, str(v)) for k, v in record['global_stats'].items()])
+                        self._increment(cur, interval_key, 'total_counter')
+                        self._expire_nx(cur, interval_key, now)
+
+                        if record['timeout']:
+                            self._increment(cur, interval_key, 'timeout_counter')
+                        else:
+                            self._zadd_gt(cur, top_key('dps', record['day'], record['hour']), interval_key,
+                                          record['sum_dp'], now)
+                        self._zadd_gt(cur, top_key('duration', record['day'], record['hour']), interval_key,
+                                      record['duration'], now)
+                    cur.execute("COMMIT")
+                except BaseException:
+                    cur.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error as e:
+                raise StoreError(e)
+        return created
+
+    def _read(self, key, sql, *params):
+        now = time.time()
+        with self.lock:
+            try:
+                cur = self.connect().cursor()
+                row = cur.execute("SELECT expires FROM expiry WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[0] <= now:
+                    return []
+                return cur.execute(sql, (key,) + params).fetchall()
+            except sqlite3.Error as e:
+                raise StoreError(e)
+
+    def load(self, key):
+        return dict(self._read(key, "SELECT field, value FROM hashes WHERE key = ?"))
+
+    def history(self, query_id):
+        rows = self._read(history_key(query_id), "SELECT value FROM lists WHERE key = ? ORDER BY id")
+        return self.decode_history(r[0] for r in rows)
+
+    def aggregates(self, query_id):
+        return history_encoding.decode_aggregates(
+            dict(self._read(hourly_key(query_id), "SELECT field, value FROM hashes WHERE key = ?")),
+            self._read(hourly_max_key(query_id), "SELECT member, score FROM zsets WHERE key = ?"))
+
+    def compact(self, retention, hourly_retention=0, count=100):
+        """
+        A few statements, the count of keys per round trip doesn't apply
+        """
+        now = time.time()
+        hours = 0
+        with self.lock:
+            try:
+                cur = self.connect().cursor()
+                cur.execute("BEGIN IMMEDIATE")
+                try:
+                    cur.execute(COMPACT_HISTORIES, (now - retention,))
+                    executions = cur.rowcount
+                    if hourly_retention:
+                        oldest_hour = history_encoding.hour_of(now - hourly_retention)
+                        hours = cur.execute(COUNT_OLD_HOURS, (oldest_hour,)).fetchone()[0]
+                        cur.execute(COMPACT_HOURLY, (oldest_hour,))
+                        cur.execute(COMPACT_HOURLY_MAX, (oldest_hour,))
+                    cur.execute("COMMIT")
+                except BaseException:
+                    cur.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error as e:
+                raise StoreError(e)
+        return executions, hours
+
+    def sketches(self, query_id):
+        return sketch.decode(dict(self._read(sketch_key(query_id), "SELECT field, value FROM hashes WHERE key = ?")))
+
+    def top(self, toptype, buckets, limit=0, offset=0):
+        return [self._read(top_key(toptype, day, hour), "SELECT member, score FROM zsets WHERE key = ? "
+                           "ORDER BY score DESC, member DESC LIMIT ? OFFSET ?", limit or -1, offset)
+                for day, hour in buckets]
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
@@ -38,6 +38,8 @@ class TestDaemon(threading.Thread):
                                   "port": 12340,
                                   "backend_host": "backend_host",
                                   "backend_port": "backend_port",
+                                  "server_mode": "threading",
+                                  "workers": 1,
                                   "rules": []})
 
     def run(self):
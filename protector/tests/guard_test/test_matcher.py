@@ -0,0 +1,61 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import re
+import unittest
+
+from protector.guard.matcher import MetricMatcher, literal_prefix
+
+
+class TestMatcher(unittest.TestCase):
+
+    patterns = [
+        "^releases$", "^mymetric\\.", ".*java.*boot.*version.*", "^sys\\.cpu\\.(user|nice)", "sys\\.mem",
+        "^a|b", "^ab*c", "^abc?d", "^x+y", "^\\d+\\.", "(?i)^case", "^os\\.disk\\.[a-z]+$", "^exact$", "^prefix",
+    ]
+
+    names = [
+        "releases", "releases2", "mymetric.received", "mymetricx", "my.java.spring.boot.version",
+        "sys.cpu.user", "sys.cpu.idle", "sys.mem.free", "sys.memory", "ac", "abbbc", "bcd", "abd", "abcd",
+        "xxy", "y", "123.metric", "CASE", "os.disk.sda", "os.disk.sda1", "exact", "exactly", "prefix.anything", "",
+    ]
+
+    def test_literal_prefix(self):
+        self.assertEqual(literal_prefix("^sys\\.cpu\\..*user"), ("sys.cpu.", ".*user"))
+        self.assertEqual(literal_prefix("^releases$"), ("releases", "$"))
+        self.assertEqual(literal_prefix("^prefix"), ("prefix", ""))
+        self.assertEqual(literal_prefix("^ab*c"), ("a", "b*c"))
+        self.assertEqual(literal_prefix("^\\d+"), ("", "\\d+"))
+        self.assertEqual(literal_prefix("^a|b"), ("", "^a|b"))
+        self.assertEqual(literal_prefix("^sys\\.cpu\\.(user|nice)"), ("sys.cpu.", "(user|nice)"))
+        self.assertEqual(literal_prefix("^a[|]b"), ("a", "[|]b"))
+        self.assertEqual(literal_prefix(".*java"), ("", ".*java"))
+
+    def test_same_decisions_as_re_match(self):
+        for i, pattern in enumerate(self.patterns):
+            matcher = MetricMatcher([pattern], self.patterns[i:i + 2])
+            for name in self.names:
+                blocked, allowed = matcher.decide(name)
+                self.assertEqual(blocked, bool(re.match(pattern, name)), (pattern, name))
+                expected = all(re.match(p, name) for p in self.patterns[i:i + 2])
+                self.assertEqual(allowed, expected, (self.patterns[i:i + 2], name))
+
+    def test_empty_lists(self):
+        matcher = MetricMatcher()
+        self.assertEqual(matcher.decide("anything"), (False, False))
+
+    def test_decision_cache_bounded(self):
+        matcher = MetricMatcher(self.patterns, cache_size=4)
+        for name in self.names:
+            matcher.decide(name)
+        matcher.decide(self.names[-1])
+        info = matcher.decide.cache_info()
+        self.assertEqual(info.currsize, 4)
+        self.assertEqual(info.hits, 1)
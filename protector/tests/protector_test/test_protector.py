@@ -10,9 +10,13 @@
 
 import unittest
 import json
+import datetime
 
 from protector.protector_main import Protector
 from protector.query.query import OpenTSDBQuery
+from protector.store import history
+from protector.store.memory_store import MemoryStore
+from protector.store.redis_store import RedisStore, ZADD_MAX, PEXPIRE_NEW
 from mock import mock
 
 p = None
@@ -20,6 +24,28 @@ stats = {}
 meta = {}
 q = {}
 
+class MockPipeline(object):
+    """
+    Runs the commands against the mock when executed
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((getattr(self.db, name), args, kwargs))
+            return self
+        return queue
+
+    def __len__(self):
+        return len(self.commands)
+
+    def execute(self):
+        return [command(*args, **kwargs) for command, args, kwargs in self.commands]
+
+
 class MockRedis(object):
     def exists(self, key):
         return False
@@ -27,25 +53,52 @@ class MockRedis(object):
     def ping(self):
         return True
 
-    def set(self, key, value, ex):
+    def pipeline(self):
+        return MockPipeline(self)
+
+    def set(self, key, value, ex, nx=False):
+        if nx and key in q:
+            return None
         q[key] = value
+        return True
 
     def rpush(self, key, value):
         stats[key] = value
 
+    def ltrim(self, key, start, end):
+        return True
+
     def hexists(self, hash, key):
         return False
 
-    def hmset(self, key, data):
-        meta[key] = data
+    def hgetall(self, key):
+        return {}
+
+    def hsetnx(self, key, hkey, value):
+        if hkey in meta.get(key, {}):
+            return 0
+        meta.setdefault(key, {})[hkey] = value
+        return 1
+
+    def hset(self, key, mapping):
+        meta.setdefault(key, {}).update(mapping)
 
     def hincrby(self, key, hkey, value):
-        meta[key][hkey] = value
+        meta.setdefault(key, {})[hkey] = value
+
+    def hincrbyfloat(self, key, hkey, value):
+        meta.setdefault(key, {})[hkey] = value
+
+    def expire(self, key, ttl, nx=False):
+        return 1
 
     def zscore(self, z, key):
         return 1
 
-    def zadd(self, z, value):
+    def zadd(self, z, value, gt=False):
+        return 1
+
+    def eval(self, script, numkeys, *keys_and_args):
         return 1
 
 @mock.patch("redis.Redis", mock.MagicMock(return_value=MockRedis()))
@@ -246,7 +299,7 @@ class TestProtector(unittest.TestCase):
         p.save_stats(q3, None, 20, True)
 
         j = stats["{}_{}".format(q3.get_id(), 'stats')]
-        oj = json.loads(j)
+        oj = history.decode(j)
 
         # _stats
         self.assertTrue(oj['timeout'])
@@ -267,3 +320,133 @@ class TestProtector(unittest.TestCase):
         self.assertEqual(ki['total_counter'], 1)
         self.assertEqual(t, ki['timeout_last'])
         self.assertEqual(t, ki['first_occurrence'])
+
+    def test_save_stats_single_round_trip(self):
+
+        q1 = OpenTSDBQuery(self.payload1)
+        interval_key = "{}_{}".format(q1.get_id(), int((q1.get_end_timestamp() - q1.get_start_timestamp()) / 60))
+        db = mock.MagicMock()
+
+        with mock.patch.object(p, 'store', RedisStore(db, 60)):
+            p.save_stats(q1, None, 1.5)
+
+        self.assertEqual(db.method_calls, [mock.call.pipeline()])
+        pipe = db.pipeline.return_value
+        pipe.execute.assert_called_once_with()
+        pipe.hsetnx.assert_called_once_with(interval_key, 'first_occurrence', mock.ANY)
+        # Max scores and TTL on creation are Lua scripts, for Redis < 7.0
+        pipe.eval.assert_any_call(ZADD_MAX, 1, mock.ANY, 1.5, interval_key)
+        pipe.eval.assert_any_call(PEXPIRE_NEW, 7, *([mock.ANY] * 7 + [60000]))
+        pipe.zadd.assert_not_called()
+        pipe.expire.assert_not_called()
+
+    def test_get_top(self):
+
+        q1 = OpenTSDBQuery(self.payload1)
+
+        with mock.patch.object(p, 'store', MemoryStore()):
+            p.save_stats(q1, None, 1.5)
+            record = p.stats_record(q1, None, 2.5)
+
+            now = datetime.datetime.now()
+            top = json.loads(p.get_top("duration"))
+            self.assertEqual(sorted(top, key=int), [str(h) for h in range(now.hour + 1)])
+            self.assertEqual(top[str(now.hour)], [[record['interval_key'], 1.5]])
+
+            top = json.loads(p.get_top("duration", hours=3))
+            self.assertEqual(len(top), 3)
+            self.assertEqual(top[now.strftime("%Y-%m-%dT%H")], [[record['interval_key'], 1.5]])
+
+            top = json.loads(p.get_top("duration", days=2))
+            self.assertEqual(top[now.date().isoformat()], [[record['interval_key'], 1.5]])
+            self.assertEqual(len(top), 2)
+
+            self.assertEqual(json.loads(p.get_top("duration", offset=1))[str(now.hour)], [])
+
+    def test_get_top_order(self):
+
+        q1 = OpenTSDBQuery(self.payload1)
+        q2 = OpenTSDBQuery(self.payload2)
+
+        # Highest first, as the former ZRANGE ... desc of the Redis top keys
+        with mock.patch.object(p, 'store', MemoryStore()):
+            p.save_stats(q1, None, 1.5)
+            p.save_stats(q2, None, 3.5)
+            p.save_stats(q1, None, 2.5)
+            keys = [p.stats_record(q, None, 1)['interval_key'] for q in (q2, q1)]
+
+            now = datetime.datetime.now()
+            top = json.loads(p.get_top("duration"))[str(now.hour)]
+            self.assertEqual(top, [[keys[0], 3.5], [keys[1], 2.5]])
+            top = json.loads(p.get_top("duration", days=1))[now.date().isoformat()]
+            self.assertEqual(top, [[keys[0], 3.5], [keys[1], 2.5]])
+
+        db = mock.MagicMock()
+        RedisStore(db).top("duration", [(16, 10)], limit=3)
+        db.pipeline.return_value.zrevrange.assert_called_once_with("top_duration_16_10", 0, 2, withscores=True)
+        db.pipeline.return_value.zrange.assert_not_called()
+
+    def test_get_stats(self):
+
+        q1 = OpenTSDBQuery(self.payload1)
+        interval = int((q1.get_end_timestamp() - q1.get_start_timestamp()) / 60)
+
+        with mock.patch.object(p, 'store', MemoryStore()):
+            for duration in (1, 2, 3, 4, 10):
+                p.save_stats(q1, None, duration)
+            p.save_stats(q1, None, 20, True)
+
+            stats = json.loads(p.get_stats(q1.get_id()))
+            self.assertEqual(list(stats['intervals']), [str(interval)])
+            duration = stats['intervals'][str(interval)]['duration']
+            self.assertEqual(duration['count'], 6)
+            self.assertAlmostEqual(duration['p50'], 3, delta=0.1)
+            self.assertAlmostEqual(duration['p99'], 10, delta=0.2)
+            # No datapoints without a response
+            self.assertEqual(stats['all']['dps'], {'count': 5, 'p50': 0.0, 'p90': 0.0, 'p99': 0.0})
+            self.assertEqual(stats['all']['duration'], duration)
+
+            self.assertEqual(json.loads(p.get_stats("unknown"))['intervals'], {})
+
+    def test_get_top_invalid(self):
+
+        for params in ({'limit': 0}, {'limit': p.top_max_limit + 1}, {'offset': -1}, {'hours': 0},
+                       {'hours': 24 * 7 + 1}, {'days': 29}):
+            with self.assertRaises(ValueError):
+                p.get_top("duration", **params)
+        self.assertIsNone(p.get_top("latency"))
+
+    def test_get_top_days_complete(self):
+
+        store = mock.MagicMock()
+        store.top_days.return_value = [[], []]
+        now = datetime.datetime(2021, 6, 17, 23, 30)
+
+        with mock.patch.object(p, 'store', store), mock.patch('protector.protector_main.dt') as dt_mock:
+            dt_mock.datetime.now.return_value = now
+            dt_mock.timedelta = datetime.timedelta
+            top = json.loads(p.get_top("duration", days=2))
+
+        self.assertEqual(list(top), ["2021-06-17", "2021-06-16"])
+        days = [(day, list(hours), complete) for day, hours, complete in store.top_days.call_args[0][1]]
+        # Today has all its hours at 23:xx, it is not complete until midnight
+        self.assertEqual(days, [(17, list(range(24)), False), (16, list(range(24)), True)])
+
+    def test_top_days_redis(self):
+
+        commands = mock.MagicMock()
+        commands.exists.side_effect = [1, 0]
+        commands.zrevrange.side_effect = [[('q1_60', 2.0)], [('q2_60', 1.0)]]
+        db = mock.MagicMock()
+        db.pipeline.side_effect = lambda transaction=True: MockPipeline(commands)
+
+        top = RedisStore(db).top_days("duration", [(16, range(24), True), (17, range(10), False)], limit=5)
+
+        self.assertEqual(top, [[('q1_60', 2.0)], [('q2_60', 1.0)]])
+        self.assertEqual(db.pipeline.call_count, 2)
+        # The past day is merged already, the current one is merged again
+        commands.zunionstore.assert_called_once_with('top_duration_17_current',
+                                                     ['top_duration_17_{}'.format(h) for h in range(10)],
+                                                     aggregate='MAX')
+        commands.zrevrange.assert_has_calls([mock.call('top_duration_16', 0, 4, withscores=True),
+                                             mock.call('top_duration_17_current', 0, 4, withscores=True)])
@@ -0,0 +1,112 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import time
+import unittest
+
+import redis
+from mock import mock
+
+from protector import redis_client
+from protector.query.query import OpenTSDBQuery
+from protector.redis_client import CircuitBreaker
+from protector.tests.protector_test import test_protector
+from protector.tests.protector_test.test_protector import MockPipeline
+from protector.store.redis_store import RedisStore
+
+
+class BrokenRedis(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            self.calls += 1
+            raise redis.ConnectionError("Connection refused")
+        return fail
+
+    def pipeline(self):
+        return MockPipeline(self)
+
+
+class TestRedisClient(unittest.TestCase):
+
+    def test_connect(self):
+        db = redis_client.connect({'host': 'redis', 'port': 6379, 'password': '', 'max_connections': 16,
+                                   'socket_timeout': 0.2})
+        pool = db.connection_pool
+        self.assertIsInstance(pool, redis.BlockingConnectionPool)
+        self.assertEqual((pool.max_connections, pool.timeout), (16, 0.2))
+        expected = {'host': 'redis', 'port': 6379, 'password': None, 'socket_timeout': 0.2,
+                    'socket_connect_timeout': 1, 'decode_responses': False}
+        self.assertEqual({k: pool.connection_kwargs[k] for k in expected}, expected)
+
+    def test_connect_unlimited(self):
+        db = redis_client.connect({'host': 'redis', 'port': 6379})
+        self.assertNotIsInstance(db.connection_pool, redis.BlockingConnectionPool)
+
+    def test_connect_unix_socket(self):
+        db = redis_client.connect({'host': 'redis', 'port': 6379, 'unix_socket_path': '/run/redis.sock'}, True)
+        pool = db.connection_pool
+        self.assertIs(pool.connection_class, redis.UnixDomainSocketConnection)
+        self.assertEqual(pool.connection_kwargs['path'], '/run/redis.sock')
+        self.assertNotIn('host', pool.connection_kwargs)
+        self.assertTrue(pool.connection_kwargs['decode_responses'])
+
+    def test_pool_exhausted(self):
+        pool = redis_client.connect({'host': 'redis', 'port': 6379, 'max_connections': 1,
+                                     'socket_timeout': 0.1}).connection_pool
+        pool.make_connection = mock.MagicMock(return_value=mock.MagicMock(**{'can_read.return_value': False}))
+        connection = pool.get_connection('PING')
+        # Waits for the busy connection, then fails
+        start = time.time()
+        with self.assertRaises(redis.ConnectionError):
+            pool.get_connection('PING')
+        self.assertGreaterEqual(time.time() - start, 0.1)
+        pool.release(connection)
+
+    def test_circuit_breaker(self):
+        circuit = CircuitBreaker(max_failures=2, backoff=0.1)
+        error = redis.ConnectionError("Connection refused")
+
+        circuit.failure(error)
+        self.assertTrue(circuit.allow())
+        circuit.success()
+        circuit.failure(error)
+        self.assertTrue(circuit.allow())
+        circuit.failure(error)
+        self.assertFalse(circuit.allow())
+
+        time.sleep(0.15)
+        self.assertTrue(circuit.allow())
+        # Still failing
+        circuit.failure(error)
+        self.assertFalse(circuit.allow())
+
+        time.sleep(0.15)
+        circuit.success()
+        circuit.failure(error)
+        self.assertTrue(circuit.allow())
+
+    def test_protector_skips_redis(self):
+        if not test_protector.p:
+            test_protector.get_protector()
+        p = test_protector.p
+        db = BrokenRedis()
+        query = OpenTSDBQuery('{"start": "3m-ago", "queries": [{"metric": "m", "aggregator": "sum"}]}')
+
+        with mock.patch.object(p, 'store', RedisStore(db)), mock.patch.object(p, 'circuit', CircuitBreaker(2, 60)):
+            for _ in range(5):
+                p.load_stats(query)
+                p.save_stats(query, None, 1.5)
+                self.assertIsNone(p.get_top())
+            self.assertEqual(db.calls, 2)
+            self.assertEqual(query.get_stats(), {})
@@ -0,0 +1,151 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import time
+import unittest
+
+from mock import mock
+
+from protector.query.query import OpenTSDBQuery
+from protector.stats_cache import StatsCache
+from protector.tests.protector_test import test_protector
+from protector.tests.protector_test.test_protector import MockPipeline
+from protector.store.redis_store import RedisStore
+
+
+class MockRedis(object):
+    """
+    Hashes only, counts the commands it receives
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.calls = 0
+        self.handlers = {}
+        self.connection_pool = mock.Mock(connection_kwargs={'db': 2})
+
+    def __getattr__(self, name):
+        # Commands the stats cache does not care about
+        def command(*args, **kwargs):
+            self.calls += 1
+            return 1
+        return command
+
+    def ping(self):
+        self.calls += 1
+        return True
+
+    def exists(self, key):
+        self.calls += 1
+        return key in self.hashes
+
+    def hgetall(self, key):
+        self.calls += 1
+        return dict(self.hashes.get(key, {}))
+
+    def pipeline(self):
+        self.calls += 1
+        return MockPipeline(self)
+
+    def hsetnx(self, key, field, value):
+        if field in self.hashes.get(key, {}):
+            return 0
+        self.hashes.setdefault(key, {})[field] = str(value)
+        return 1
+
+    def hset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update({k: str(v) for k, v in mapping.items()})
+
+    def hincrby(self, key, field, value):
+        h = self.hashes.setdefault(key, {})
+        h[field] = str(int(h.get(field, 0)) + value)
+
+    def pubsub(self, **kwargs):
+        return mock.Mock(psubscribe=self.handlers.update)
+
+
+class TestStatsCache(unittest.TestCase):
+
+    payload = '{"start": "3m-ago", "queries": [{"metric": "mymetric", "aggregator": "sum", "filters": []}]}'
+
+    def setUp(self):
+        if not test_protector.p:
+            test_protector.get_protector()
+        self.p = test_protector.p
+        self.db = MockRedis()
+        for attr, value in (('store', RedisStore(self.db)), ('stats_cache', StatsCache(ttl=60))):
+            patcher = mock.patch.object(self.p, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def key(self, query):
+        return "{}_{}".format(query.get_id(), int((query.get_end_timestamp() - query.get_start_timestamp()) / 60))
+
+    def test_no_stats_cached(self):
+        self.p.load_stats(OpenTSDBQuery(self.payload))
+        calls = self.db.calls
+
+        query = OpenTSDBQuery(self.payload)
+        self.p.load_stats(query)
+        self.assertEqual(self.db.calls, calls)
+        self.assertEqual(query.get_stats(), {})
+
+    def test_write_through(self):
+        query = OpenTSDBQuery(self.payload)
+        self.p.load_stats(query)
+        self.p.save_stats(query, None, 1.5)
+        self.p.save_stats(query, None, 21.0, True)
+        calls = self.db.calls
+
+        query = OpenTSDBQuery(self.payload)
+        self.p.load_stats(query)
+        self.assertEqual(self.db.calls, calls)
+        self.assertEqual(query.get_stats(), self.db.hashes[self.key(query)])
+        self.assertEqual(query.get_stats()['total_counter'], '2')
+        self.assertEqual(query.get_stats()['duration'], '21.0')
+
+    def test_unknown_hash_not_cached_on_write(self):
+        query = OpenTSDBQuery(self.payload)
+        self.db.hashes[self.key(query)] = {'first_occurrence': '1', 'total_counter': '7'}
+        self.p.save_stats(query, None, 1.5)
+
+        self.assertEqual(self.p.stats_cache.get(self.key(query)), (False, None))
+        self.p.load_stats(query)
+        self.assertEqual(query.get_stats()['total_counter'], '8')
+
+    def test_ttl_and_size(self):
+        cache = StatsCache(ttl=0.05, max_entries=2)
+        cache.put("a", {'duration': '1'})
+        cache.put("b", None)
+        cache.put("c", {'duration': '3'})
+        self.assertEqual(cache.get("a"), (False, None))
+        self.assertEqual(cache.get("b"), (True, None))
+        self.assertEqual(cache.get("c"), (True, {'duration': '3'}))
+        time.sleep(0.1)
+        self.assertEqual(cache.get("c"), (False, None))
+
+    def test_notifications(self):
+        cache = StatsCache(ttl=60)
+        cache.listen(self.db)
+        handler = self.db.handlers["__keyspace@2__:*"]
+
+        cache.put("k", {'duration': '1'})
+        self.db.hashes["k"] = {'duration': '2'}
+        handler({'channel': "__keyspace@2__:k", 'data': 'hset'})
+        self.assertEqual(cache.get("k"), (True, {'duration': '2'}))
+
+        del self.db.hashes["k"]
+        handler({'channel': "__keyspace@2__:k", 'data': 'del'})
+        self.assertEqual(cache.get("k"), (True, None))
+
+        # Keys not cached are ignored
+        calls = self.db.calls
+        handler({'channel': "__keyspace@2__:other", 'data': 'hset'})
+        self.assertEqual(self.db.calls, calls)
@@ -0,0 +1,62 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import time
+import unittest
+
+from mock import mock
+
+from protector.stats_compactor import StatsCompactor, STATS_COMPACTION_FAILED
+from protector.store.base import StoreError
+from protector.store.memory_store import MemoryStore
+from protector.tests.store_test.test_store import make_record
+
+
+class TestStatsCompactor(unittest.TestCase):
+
+    def test_periodic(self):
+        store = mock.MagicMock()
+        store.compact.return_value = (3, 1)
+        compactor = StatsCompactor(store, interval=0.05, retention=60, hourly_retention=3600, batch_size=10)
+        compactor.start()
+        time.sleep(0.2)
+        compactor.stop()
+
+        self.assertGreaterEqual(store.compact.call_count, 2)
+        store.compact.assert_called_with(60, 3600, 10)
+        calls = store.compact.call_count
+        time.sleep(0.1)
+        self.assertEqual(store.compact.call_count, calls)
+
+    def test_compact(self):
+        store = MemoryStore()
+        now = int(time.time())
+        store.write([make_record(timestamp=now - 7200), make_record(timestamp=now)])
+
+        self.assertEqual(StatsCompactor(store, retention=3600).compact(), (1, 0))
+        self.assertEqual(len(store.history("q1")), 1)
+
+    def test_failure(self):
+        store = mock.MagicMock()
+        store.compact.side_effect = StoreError("down")
+        self.assertIsNone(StatsCompactor(store).compact())
+
+    def test_unexpected_failure(self):
+        store = mock.MagicMock()
+        store.compact.side_effect = ValueError("Expecting value: line 1 column 1 (char 0)")
+        failed = STATS_COMPACTION_FAILED._value.get()
+        compactor = StatsCompactor(store, interval=0.05)
+        compactor.start()
+        time.sleep(0.2)
+        compactor.stop()
+
+        # The thread survives the errors
+        self.assertGreaterEqual(store.compact.call_count, 2)
+        self.assertEqual(STATS_COMPACTION_FAILED._value.get() - failed, store.compact.call_count)
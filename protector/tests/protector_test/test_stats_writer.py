@@ -0,0 +1,97 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import threading
+import time
+import unittest
+
+from mock import mock
+
+from protector.query.query import OpenTSDBQuery
+from protector.stats_writer import StatsWriter
+from protector.tests.protector_test import test_protector
+from protector.tests.protector_test.test_stats_cache import MockRedis
+from protector.store.redis_store import RedisStore
+
+
+class TestStatsWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    def write(self, records):
+        self.batches.append(list(records))
+        return True
+
+    def test_batches(self):
+        writer = StatsWriter(self.write, batch_size=3, flush_interval=0.05)
+        for i in range(7):
+            writer.put({'id': i})
+        writer.start()
+        time.sleep(0.2)
+        writer.stop()
+
+        self.assertEqual([len(b) for b in self.batches], [3, 3, 1])
+        self.assertEqual([r['id'] for b in self.batches for r in b], list(range(7)))
+
+    def test_drop_when_full(self):
+        writer = StatsWriter(self.write, max_queue=2)
+        self.assertTrue(writer.put({'id': 1}))
+        self.assertTrue(writer.put({'id': 2}))
+        self.assertFalse(writer.put({'id': 3}))
+
+    def test_backpressure(self):
+        writer = StatsWriter(self.write, max_queue=1, flush_interval=0.01, block=5)
+        writer.put({'id': 1})
+
+        threading.Timer(0.1, writer.start).start()
+        start = time.time()
+        self.assertTrue(writer.put({'id': 2}))
+        self.assertGreater(time.time() - start, 0.05)
+        writer.stop()
+        self.assertEqual([r['id'] for b in self.batches for r in b], [1, 2])
+
+    def test_flush_on_stop(self):
+        writer = StatsWriter(self.write, flush_interval=60)
+        writer.start()
+        writer.put({'id': 1})
+        writer.stop()
+        self.assertEqual(self.batches, [[{'id': 1}]])
+
+    def test_failed_write(self):
+        writer = StatsWriter(mock.Mock(side_effect=Exception("Connection refused")), flush_interval=0.01)
+        writer.put({'id': 1})
+        writer.start()
+        writer.stop()
+        self.assertTrue(writer.queue.empty())
+
+    def test_protector_writes_in_background(self):
+        if not test_protector.p:
+            test_protector.get_protector()
+        p = test_protector.p
+        db = MockRedis()
+        writer = StatsWriter(p.write_stats, flush_interval=60)
+
+        with mock.patch.object(p, 'store', RedisStore(db)), mock.patch.object(p, 'stats_writer', writer), \
+                mock.patch.object(db, 'pipeline', wraps=db.pipeline) as pipeline:
+            query = OpenTSDBQuery('{"start": "3m-ago", "queries": [{"metric": "m", "aggregator": "sum"}]}')
+            p.save_stats(query, None, 1.5)
+            p.save_stats(query, None, 2.5, True)
+            self.assertEqual(db.calls, 0)
+
+            writer.start()
+            writer.stop()
+
+        # One round trip for both
+        self.assertEqual(pipeline.call_count, 1)
+        interval_key = "{}_{}".format(query.get_id(), 3)
+        self.assertEqual(db.hashes[interval_key]['total_counter'], '2')
+        self.assertEqual(db.hashes[interval_key]['timeout_counter'], '1')
+        self.assertEqual(db.hashes[interval_key]['duration'], '2.5')
@@ -0,0 +1,79 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import threading
+import time
+import unittest
+
+from protector.proxy.coalescer import Coalescer
+
+
+class TestCoalescer(unittest.TestCase):
+
+    def run_concurrently(self, coalescer, key, fn, count):
+        results = []
+
+        def call():
+            try:
+                results.append(coalescer.do(key, fn))
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_single_flight(self):
+        calls = []
+
+        def fn():
+            calls.append(1)
+            time.sleep(0.2)
+            return "result"
+
+        results = self.run_concurrently(Coalescer(), "key", fn, 5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [("result", False)] * 4 + [("result", True)])
+
+    def test_error_shared(self):
+
+        def fn():
+            time.sleep(0.2)
+            raise ValueError("backend down")
+
+        results = self.run_concurrently(Coalescer(), "key", fn, 3)
+        self.assertEqual([str(e) for e in results], ["backend down"] * 3)
+
+    def test_error_leader(self):
+
+        def fn():
+            time.sleep(0.2)
+            raise ValueError("backend down")
+
+        coalescer = Coalescer()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(coalescer.call("key", fn))) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(sorted(leader for _, _, leader in results), [False, False, True])
+        self.assertEqual(set(str(error) for _, error, _ in results), {"backend down"})
+
+    def test_sequential_calls_not_coalesced(self):
+        coalescer = Coalescer()
+        self.assertEqual(coalescer.do("key", lambda: 1), (1, True))
+        self.assertEqual(coalescer.do("key", lambda: 2), (2, True))
+        self.assertEqual(coalescer.flights, {})
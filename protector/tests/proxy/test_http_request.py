@@ -0,0 +1,99 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import unittest
+import threading
+from http.server import BaseHTTPRequestHandler
+
+from protector.proxy import server
+from protector.proxy.http_request import HTTPRequest, PoolTimeout
+
+
+class BackendHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Close the connection after each response without telling the client
+    drop_connections = False
+
+    def do_GET(self):
+        body = str(self.client_address[1]).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.drop_connections:
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHTTPRequest(unittest.TestCase):
+
+    def setUp(self):
+        BackendHandler.drop_connections = False
+        HTTPRequest.max_pool_size = 2
+        HTTPRequest.pool_idle_timeout = 30
+
+        self.backend = server.ThreadingHTTPServer(("127.0.0.1", 0), BackendHandler)
+        self.backend_thread = threading.Thread(target=self.backend.serve_forever)
+        self.backend_thread.start()
+        self.url = "http://127.0.0.1:{}/api/version".format(self.backend.server_address[1])
+
+    def tearDown(self):
+        self.backend.shutdown()
+        self.backend.server_close()
+        HTTPRequest.max_pool_size = 64
+
+    def fetch(self):
+        """
+        :return: Client port seen by the backend
+        """
+        http_request = HTTPRequest()
+        response = http_request.request(self.url, 5)
+        body = response.read().decode()
+        http_request.release(response)
+        return body
+
+    def test_connection_reuse(self):
+        first = self.fetch()
+        # A new HTTPRequest still gets the pooled connection
+        self.assertEqual(first, self.fetch())
+        self.assertEqual(first, self.fetch())
+
+    def test_idle_eviction(self):
+        HTTPRequest.pool_idle_timeout = -1
+        self.assertNotEqual(self.fetch(), self.fetch())
+
+    def test_stale_connection_retry(self):
+        BackendHandler.drop_connections = True
+        self.fetch()
+        # The pooled connection has been closed by the backend in the meantime
+        self.assertTrue(self.fetch())
+
+    def test_max_size(self):
+        http_request = HTTPRequest()
+        responses = [http_request.request(self.url, 5) for _ in range(2)]
+
+        with self.assertRaises(PoolTimeout):
+            http_request.request(self.url, 0.1)
+
+        # Releasing a connection unblocks waiting requests
+        for response in responses:
+            response.read()
+            http_request.release(response)
+        self.assertTrue(self.fetch())
+
+    def test_unread_response_not_reused(self):
+        http_request = HTTPRequest()
+        response = http_request.request(self.url, 5)
+        http_request.release(response)
+        pool = http_request.get_pool(("http", "127.0.0.1:{}".format(self.backend.server_address[1])))
+        self.assertEqual(len(pool.idle), 0)
+        self.assertEqual(pool.in_use, 0)
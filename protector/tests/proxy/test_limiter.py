@@ -0,0 +1,58 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import threading
+import time
+import unittest
+
+from protector.proxy.limiter import ConcurrencyLimiter, LimitExceeded, LIMITER_REJECTED
+
+
+class TestConcurrencyLimiter(unittest.TestCase):
+
+    def test_unlimited(self):
+        limiter = ConcurrencyLimiter()
+        self.assertEqual(limiter.acquire(['sys.cpu.user']), [])
+
+    def test_global_limit(self):
+        limiter = ConcurrencyLimiter(global_limit=1, max_wait=0.1)
+        slots = limiter.acquire(['a'])
+
+        rejected = LIMITER_REJECTED.labels('global')._value.get()
+        with self.assertRaises(LimitExceeded) as e:
+            limiter.acquire(['b'])
+        self.assertIn("Too many concurrent queries (limit: 1)", str(e.exception))
+        self.assertEqual(LIMITER_REJECTED.labels('global')._value.get(), rejected + 1)
+
+        limiter.release(slots)
+        limiter.release(limiter.acquire(['b']))
+
+    def test_metric_limit(self):
+        limiter = ConcurrencyLimiter(global_limit=2, metric_limits=[{'pattern': r'^sys\.', 'limit': 1}], max_wait=0.1)
+        slots = limiter.acquire(['sys.cpu.user'])
+
+        # Same metric family is capped
+        with self.assertRaises(LimitExceeded) as e:
+            limiter.acquire(['os.mem', 'sys.cpu.nice'])
+        self.assertEqual(e.exception.group, r'^sys\.')
+
+        # Other metrics are not, the rejected query did not keep its global slot
+        other = limiter.acquire(['os.mem'])
+        limiter.release(other)
+        limiter.release(slots)
+
+    def test_queue_until_released(self):
+        limiter = ConcurrencyLimiter(global_limit=1, max_wait=2)
+        slots = limiter.acquire(['a'])
+        threading.Timer(0.2, limiter.release, [slots]).start()
+
+        start = time.time()
+        limiter.release(limiter.acquire(['a']))
+        self.assertGreaterEqual(time.time() - start, 0.15)
@@ -0,0 +1,51 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import unittest
+
+from protector.proxy.http_request import BufferedResponse
+from protector.proxy.metadata_cache import MetadataCache
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = MetadataCache([{'path': '/api/suggest', 'ttl': 60}, {'path': '/api/config', 'ttl': -1}],
+                                   max_entries=2)
+
+    def put(self, endpoint, key, body=b"[]"):
+        return self.cache.put(endpoint, key, BufferedResponse(200, "OK", 11, [], body))
+
+    def test_endpoint(self):
+        self.assertEqual(self.cache.endpoint("/api/suggest?q=a"), "/api/suggest")
+        self.assertIsNone(self.cache.endpoint("/api/suggestions"))
+        self.assertIsNone(self.cache.endpoint("/api/query"))
+
+    def test_expiry_and_lru(self):
+        self.put("/api/config", "config")
+        self.assertIsNone(self.cache.get("/api/config", "config"))
+
+        for key in ("a", "b", "c"):
+            self.put("/api/suggest", key)
+        self.assertIsNone(self.cache.get("/api/suggest", "a"))
+        self.assertIsNotNone(self.cache.get("/api/suggest", "c"))
+
+    def test_etag(self):
+        response = self.put("/api/suggest", "a", b'["m"]')
+        etag = response.getheader("etag")
+        self.assertTrue(etag.startswith('"'))
+        self.assertEqual(self.put("/api/suggest", "b", b'["m"]').getheader("etag"), etag)
+        self.assertNotEqual(self.put("/api/suggest", "c", b'["n"]').getheader("etag"), etag)
+
+        self.assertTrue(MetadataCache.not_modified(response, etag))
+        self.assertTrue(MetadataCache.not_modified(response, '"other", W/' + etag))
+        self.assertTrue(MetadataCache.not_modified(response, '*'))
+        self.assertFalse(MetadataCache.not_modified(response, '"other"'))
+        self.assertFalse(MetadataCache.not_modified(response, None))
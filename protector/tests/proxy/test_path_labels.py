@@ -0,0 +1,53 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import unittest
+
+from protector.proxy.path_labels import PathLabels, OVERFLOW, PATH_LABELS_OVERFLOW
+
+
+class TestPathLabels(unittest.TestCase):
+
+    def test_normalize(self):
+        labels = PathLabels()
+        self.assertEqual(labels.label("/api/suggest?type=metrics&q=sys"), "/api/suggest")
+        self.assertEqual(labels.label("/api/search/lookup?m=sys.cpu{host=*}"), "/api/search/*")
+        self.assertEqual(labels.label("//api/query/"), "/api/query")
+        self.assertEqual(labels.label("/?start=1h-ago"), "/")
+        self.assertEqual(labels.label(""), "/")
+
+    def test_routes(self):
+        labels = PathLabels([{'pattern': '^/s/', 'label': '/s/*'}, {'pattern': '^/api/uid/', 'label': '/api/uid'}])
+        self.assertEqual(labels.label("/s/queryui.nocache.js"), "/s/*")
+        self.assertEqual(labels.label("/s/gwt/opentsdb/images/x.png?v=1"), "/s/*")
+        self.assertEqual(labels.label("/api/uid/assign"), "/api/uid")
+        self.assertEqual(labels.label("/api/query"), "/api/query")
+        # Known routes apply after the configured ones
+        self.assertEqual(labels.label("/api/tree/branch?branch=0001"), "/api/tree/*")
+        self.assertEqual(labels.label("/stats/1b2c3d"), "/stats/*")
+
+    def test_cap(self):
+        labels = PathLabels(max_labels=2)
+        overflow = PATH_LABELS_OVERFLOW._value.get()
+        self.assertEqual(labels.label("/wp-admin"), "/wp-admin")
+        self.assertEqual(labels.label("/.env?x=1"), "/.env")
+        self.assertEqual(labels.label("/phpmyadmin"), OVERFLOW)
+        self.assertEqual(labels.label("/.env"), "/.env")
+        self.assertEqual(PATH_LABELS_OVERFLOW._value.get() - overflow, 1)
+
+        # Scanners don't take the labels of the known paths
+        self.assertEqual(labels.label("/api/query"), "/api/query")
+        self.assertEqual(labels.label("/api/suggest?q=a"), "/api/suggest")
+        self.assertEqual(labels.label("/api/search/lookup"), "/api/search/*")
+        self.assertEqual(labels.label("/s/queryui.nocache.js"), "/s/*")
+        self.assertEqual(labels.label("/"), "/")
+
+        unlimited = PathLabels(max_labels=0)
+        self.assertEqual([unlimited.label("/p{}".format(i)) for i in range(200)][-1], "/p199")
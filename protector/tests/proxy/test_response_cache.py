@@ -0,0 +1,64 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import time
+import unittest
+
+from protector.proxy.http_request import BufferedResponse
+from protector.proxy.response_cache import ResponseCache, FreshnessTTL, CACHE_EVICTIONS
+
+
+def make_response(body):
+    return BufferedResponse(200, "OK", 11, [("Content-Type", "application/json")], body)
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_hit_and_miss(self):
+        cache = ResponseCache(100)
+        self.assertIsNone(cache.get("a"))
+
+        response = make_response(b"[]")
+        cache.put("a", response, time.time())
+        self.assertIs(cache.get("a"), response)
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(10)
+        evictions = CACHE_EVICTIONS._value.get()
+        cache.put("a", make_response(b"aaaa"), time.time())
+        cache.put("b", make_response(b"bbbb"), time.time())
+        # a is now the most recently used one
+        cache.get("a")
+        cache.put("c", make_response(b"cccc"), time.time())
+
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertEqual(cache.bytes, 8)
+        self.assertEqual(CACHE_EVICTIONS._value.get(), evictions + 1)
+
+    def test_too_large(self):
+        cache = ResponseCache(10)
+        cache.put("a", make_response(b"a" * 11), time.time())
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.bytes, 0)
+
+    def test_expired(self):
+        cache = ResponseCache(100, ttl=lambda end: -1)
+        cache.put("a", make_response(b"[]"), time.time())
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.bytes, 0)
+
+    def test_freshness_ttl(self):
+        ttl = FreshnessTTL(recent_ttl=10, historical_ttl=3600, recent_window=600)
+        now = time.time()
+        self.assertEqual(ttl(now, now), 10)
+        self.assertEqual(ttl(now - 599, now), 10)
+        self.assertEqual(ttl(now - 3600, now), 3600)
@@ -9,15 +9,26 @@
 #
 
 import unittest
+import gzip
 import json
+import socket
+import http.client
 from mock import MagicMock, patch
-from result import Ok
+from result import Ok, Err
 import time
 import threading
 import urllib.request, urllib.error, urllib.parse
 
 from protector.proxy import request_handler
 from protector.proxy import server
+from protector.proxy import async_server
+from protector.proxy import limiter
+from protector.proxy import coalescer
+from protector.proxy import response_cache
+from protector.proxy import tail_cache
+from protector.proxy import metadata_cache
+from protector.proxy import shared_cache
+from protector.tests.proxy.test_shared_cache import MockRedis
 
 
 class MockHTTPResponse(object):
@@ -33,17 +44,26 @@ class MockHTTPResponse(object):
         self.body = body
         self.version = version
         self.delay = delay
+        self.offset = 0
 
-    def read(self):
+    def read(self, amt=None):
         if self.delay:
             time.sleep(self.delay)
-        return self.body
+        body = self.body.encode() if isinstance(self.body, str) else self.body
+        data = body[self.offset:self.offset + amt] if amt else body[self.offset:]
+        self.offset += len(data)
+        return data
+
+    read1 = read
 
     def getheader(self, header):
-        return 'identity'
+        return self.msg.get(header, 'identity')
 
 
 class TestRequests(unittest.TestCase):
+
+    server_class = server.ThreadingHTTPServer
+
     def setUp(self):
         self.host = "127.0.0.1"
         self.port = 8888
@@ -55,7 +75,7 @@ class TestRequests(unittest.TestCase):
         request_handler.ProxyRequestHandler.protector = self.create_protector()
         request_handler.ProxyRequestHandler.backend_address = (self.backend_host, self.backend_port)
 
-        self.test_server = server.ThreadingHTTPServer(
+        self.test_server = self.server_class(
             (self.host, self.port), request_handler.ProxyRequestHandler
         )
         self.server_thread = threading.Thread(target=self.test_server.serve_forever)
@@ -65,6 +85,15 @@ class TestRequests(unittest.TestCase):
     def tearDown(self):
         self.test_server.shutdown()
         self.test_server.server_close()
+        request_handler.ProxyRequestHandler.keepalive_max_requests = 100
+        request_handler.ProxyRequestHandler.compressed_passthrough = False
+
+    def limit_server(self, threads, queue):
+        # Same limits whatever the engine, restored after the test
+        for attr, value in (('max_threads', threads), ('max_workers', threads), ('max_queue', queue)):
+            patcher = patch.object(self.server_class, attr, value, create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
 
     def create_protector(self, return_value=Ok(True)):
         protector = MagicMock()
@@ -213,3 +242,569 @@ class TestRequests(unittest.TestCase):
         self.assertEqual(response.code, 200)
         self.assertEqual(response.msg, "OK")
         self.assertEqual(response.read().decode(), "[]")
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_keep_alive(self, mock_http_request):
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.side_effect = lambda *args, **kwargs: MockHTTPResponse(
+            200, "OK", {"content-length": "2"}, "{}")
+
+        self.start_server()
+
+        conn = http.client.HTTPConnection(self.host, self.port)
+        conn.request("GET", "/api/suggest?q=a")
+        response = conn.getresponse()
+        self.assertEqual(response.read().decode(), "{}")
+        self.assertEqual(response.getheader('Connection'), "keep-alive")
+        sock = conn.sock
+
+        # Blocked requests keep the connection usable
+        conn.request("POST", "/api/put", body=b'[]')
+        response = conn.getresponse()
+        self.assertEqual(response.status, 403)
+        self.assertEqual(json.loads(response.read().decode())['error'], "/api/put not allowed")
+
+        conn.request("GET", "/api/suggest?q=b")
+        response = conn.getresponse()
+        self.assertEqual(response.read().decode(), "{}")
+
+        # Same TCP connection for all requests
+        self.assertIs(sock, conn.sock)
+        self.assertEqual(mock_http_request_class.request.call_count, 2)
+        conn.close()
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_keep_alive_max_requests(self, mock_http_request):
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.side_effect = lambda *args, **kwargs: MockHTTPResponse(
+            200, "OK", {"content-length": "2"}, "{}")
+        request_handler.ProxyRequestHandler.keepalive_max_requests = 2
+
+        self.start_server()
+
+        conn = http.client.HTTPConnection(self.host, self.port)
+        conn.request("GET", "/api/aggregators")
+        response = conn.getresponse()
+        response.read()
+        self.assertEqual(response.getheader('Connection'), "keep-alive")
+
+        conn.request("GET", "/api/aggregators")
+        response = conn.getresponse()
+        response.read()
+        self.assertEqual(response.getheader('Connection'), "close")
+        conn.close()
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_pipelining(self, mock_http_request):
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.side_effect = lambda *args, **kwargs: MockHTTPResponse(
+            200, "OK", {"content-length": "2"}, "{}")
+
+        self.start_server()
+
+        request = "GET /api/config HTTP/1.1\r\nHost: {}\r\n\r\n".format(self.host).encode()
+        last = "GET /api/config HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n\r\n".format(self.host).encode()
+
+        sock = socket.create_connection((self.host, self.port))
+        sock.sendall(request + request + last)
+
+        data = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        sock.close()
+
+        self.assertEqual(data.count(b'HTTP/1.1 200 OK'), 3)
+        self.assertTrue(data.endswith(b'\r\n\r\n{}'))
+        self.assertEqual(mock_http_request_class.request.call_count, 3)
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_stream_unknown_length(self, mock_http_request):
+        body = json.dumps(["metric.{}".format(i) for i in range(50000)])
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.side_effect = lambda *args, **kwargs: MockHTTPResponse(200, "OK", {}, body)
+
+        self.start_server()
+
+        # HTTP/1.1: chunked transfer encoding, the connection stays usable
+        conn = http.client.HTTPConnection(self.host, self.port)
+        for _ in range(2):
+            conn.request("GET", "/api/suggest?type=metrics&q=metric")
+            response = conn.getresponse()
+            self.assertEqual(response.getheader('Transfer-Encoding'), "chunked")
+            self.assertEqual(response.read().decode(), body)
+        conn.close()
+
+        # HTTP/1.0: the body ends when the connection is closed
+        sock = socket.create_connection((self.host, self.port))
+        sock.sendall("GET /api/suggest?q=metric HTTP/1.0\r\nHost: {}\r\n\r\n".format(self.host).encode())
+        data = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        sock.close()
+        self.assertTrue(data.endswith(b'\r\n\r\n' + body.encode()))
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_stream_known_length(self, mock_http_request):
+        body = "x" * 200000
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.return_value = MockHTTPResponse(
+            200, "OK", {"content-length": str(len(body)), "content-type": "text/html"}, body)
+
+        self.start_server()
+
+        response = urllib.request.urlopen("http://{}:{}/static/index.html".format(self.host, self.port))
+        self.assertEqual(response.getheader('Content-Length'), str(len(body)))
+        self.assertIsNone(response.getheader('Transfer-Encoding'))
+        self.assertEqual(response.read().decode(), body)
+
+    def post_gzip_query(self):
+        q = {"start": "3m-ago", "queries": [{"metric": "mymetric", "aggregator": "max", "filters": []}]}
+        req = urllib.request.Request("http://{}:{}/api/query".format(self.host, self.port), json.dumps(q).encode(),
+                                     {'Content-Type': 'application/json', 'Accept-Encoding': 'gzip'})
+        return urllib.request.urlopen(req)
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_gzip_reencoded(self, mock_http_request):
+        series = [{"metric": "mymetric", "tags": {}, "dps": {"1623619500": 1}}]
+        body = gzip.compress(json.dumps(series + [{"statsSummary": {"emittedDPs": 1}}]).encode())
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.return_value = MockHTTPResponse(
+            200, "OK", {"content-encoding": "gzip", "content-length": str(len(body))}, body)
+
+        self.start_server()
+
+        response = self.post_gzip_query()
+        self.assertEqual(response.getheader('Content-Encoding'), "gzip")
+        self.assertEqual(json.loads(gzip.decompress(response.read())), series)
+
+        args, _ = request_handler.ProxyRequestHandler.protector.save_stats.call_args
+        self.assertEqual(args[1].get_stats(), {"emittedDPs": 1})
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_gzip_passthrough(self, mock_http_request):
+        series = [{"metric": "mymetric", "tags": {}, "dps": {"1623619500": 1}}]
+        body = gzip.compress(json.dumps(series + [{"statsSummary": {"emittedDPs": 1, "queryIdx_00": {}}}]).encode())
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.return_value = MockHTTPResponse(
+            200, "OK", {"content-encoding": "gzip", "content-length": str(len(body))}, body)
+        request_handler.ProxyRequestHandler.compressed_passthrough = True
+
+        self.start_server()
+
+        # Compressed bytes are forwarded untouched
+        response = self.post_gzip_query()
+        self.assertEqual(response.read(), body)
+
+        # Stats are saved once the response has been sent
+        save_stats = request_handler.ProxyRequestHandler.protector.save_stats
+        for _ in range(100):
+            if save_stats.called:
+                break
+            time.sleep(0.01)
+        args, _ = request_handler.ProxyRequestHandler.protector.save_stats.call_args
+        self.assertEqual(args[1].get_stats(), {"emittedDPs": 1})
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_load_shedding(self, mock_http_request):
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.side_effect = lambda *args, **kwargs: MockHTTPResponse(
+            200, "OK", {"content-length": "2"}, "{}", delay=0.5)
+        self.limit_server(threads=1, queue=1)
+
+        self.start_server()
+
+        url = "http://{}:{}/api/version".format(self.host, self.port)
+        results = []
+
+        def fetch():
+            try:
+                results.append(urllib.request.urlopen(url).getcode())
+            except urllib.error.HTTPError as e:
+                results.append((e.code, e.headers.get('Retry-After')))
+
+        shed = server.REQUESTS_SHED._value.get()
+        clients = [threading.Thread(target=fetch) for _ in range(3)]
+        for client in clients:
+            client.start()
+            time.sleep(0.1)
+        for client in clients:
+            client.join()
+
+        # One request is processed, one waits in the queue, the last one is rejected right away
+        self.assertEqual(sorted(results, key=str), [(503, "1"), 200, 200])
+        self.assertEqual(server.REQUESTS_SHED._value.get(), shed + 1)
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_backend_limit(self, mock_http_request):
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.return_value = MockHTTPResponse(200, "OK", {}, "[]")
+        query_limiter = limiter.ConcurrencyLimiter(metric_limits=[{'pattern': '^mymetric$', 'limit': 1}], max_wait=0.1)
+        patcher = patch.object(request_handler.ProxyRequestHandler, 'limiter', query_limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.start_server()
+
+        url = "http://{}:{}/api/query".format(self.host, self.port)
+        data = json.dumps({"start": "3m-ago", "queries": [{"metric": "mymetric", "aggregator": "max"}]}).encode()
+
+        # The only slot for mymetric is taken
+        slots = query_limiter.acquire(["mymetric"])
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(urllib.request.Request(url, data, {'Content-Type': 'application/json'}))
+        self.assertEqual(e.exception.code, 503)
+        self.assertIn("mymetric", json.loads(e.exception.read())["message"])
+        self.assertFalse(mock_http_request_class.request.called)
+
+        query_limiter.release(slots)
+        response = urllib.request.urlopen(urllib.request.Request(url, data, {'Content-Type': 'application/json'}))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(query_limiter.acquire(["mymetric"]), query_limiter.groups)
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_coalescing(self, mock_http_request):
+        series = [{"metric": "mymetric", "tags": {}, "dps": {"1623619500": 1}}]
+        body = json.dumps(series + [{"statsSummary": {"emittedDPs": 1, "queryIdx_00": {}}}])
+
+        def slow_backend(*args, **kwargs):
+            time.sleep(0.3)
+            return MockHTTPResponse(200, "OK", {"content-length": str(len(body))}, body)
+
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.side_effect = slow_backend
+        patcher = patch.object(request_handler.ProxyRequestHandler, 'coalescer', coalescer.Coalescer())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.start_server()
+
+        url = "http://{}:{}/api/query".format(self.host, self.port)
+        data = json.dumps({"start": "3m-ago", "queries": [{"metric": "mymetric", "aggregator": "max"}]}).encode()
+        results = []
+
+        def fetch():
+            response = urllib.request.urlopen(urllib.request.Request(url, data, {'Content-Type': 'application/json'}))
+            results.append((response.code, json.loads(response.read())))
+
+        clients = [threading.Thread(target=fetch) for _ in range(4)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        # One backend execution, recorded once, every client got the result
+        self.assertEqual(mock_http_request_class.request.call_count, 1)
+        self.assertEqual(request_handler.ProxyRequestHandler.protector.save_stats.call_count, 1)
+        self.assertEqual(results, [(200, series)] * 4)
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_coalesced_timeout(self, mock_http_request):
+
+        def timing_out_backend(*args, **kwargs):
+            time.sleep(0.3)
+            raise socket.timeout("timed out")
+
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.side_effect = timing_out_backend
+        patcher = patch.object(request_handler.ProxyRequestHandler, 'coalescer', coalescer.Coalescer())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.start_server()
+        protector = request_handler.ProxyRequestHandler.protector
+
+        url = "http://{}:{}/api/query".format(self.host, self.port)
+        data = json.dumps({"start": "3m-ago", "queries": [{"metric": "mymetric", "aggregator": "max"}]}).encode()
+        codes = []
+
+        def fetch():
+            try:
+                urllib.request.urlopen(urllib.request.Request(url, data, {'Content-Type': 'application/json'}))
+            except urllib.error.HTTPError as e:
+                codes.append(e.code)
+
+        # A leader and two followers
+        clients = [threading.Thread(target=fetch) for _ in range(3)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        self.assertEqual(codes, [504] * 3)
+        self.assertEqual(mock_http_request_class.request.call_count, 1)
+        # The timeout is recorded once
+        self.assertEqual(protector.save_stats.call_count, 1)
+        self.assertTrue(protector.save_stats.call_args[0][3])
+        self.assertEqual(protector.TSDB_REQUEST_LATENCY.labels.call_count, 1)
+
+    @staticmethod
+    def encoding_backend(series, delay=0):
+        """
+        :return: Backend compressing the result when the request accepts gzip
+        """
+        body = json.dumps(series + [{"statsSummary": {"emittedDPs": 1, "queryIdx_00": {}}}]).encode()
+
+        def backend(*args, **kwargs):
+            time.sleep(delay)
+            if 'gzip' in kwargs['headers'].get('Accept-Encoding', ''):
+                data = gzip.compress(body)
+                return MockHTTPResponse(200, "OK", {"content-encoding": "gzip", "content-length": str(len(data))}, data)
+            return MockHTTPResponse(200, "OK", {"content-length": str(len(body))}, body)
+        return backend
+
+    def post_encoded_query(self, encoding, results=None):
+        """
+        :param encoding: Accept-Encoding of the request
+        :return: The series of the response, checked to be encoded as accepted
+        """
+        url = "http://{}:{}/api/query".format(self.host, self.port)
+        data = json.dumps({"start": 1623619500, "end": 1623623100,
+                           "queries": [{"metric": "mymetric", "aggregator": "max"}]}).encode()
+        response = urllib.request.urlopen(urllib.request.Request(
+            url, data, {'Content-Type': 'application/json', 'Accept-Encoding': encoding}))
+        body = response.read()
+        if response.getheader('Content-Encoding') == 'gzip':
+            self.assertIn('gzip', encoding)
+            body = gzip.decompress(body)
+        series = json.loads(body)
+        if results is not None:
+            results.append(series)
+        return series
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_coalescing_encodings(self, mock_http_request):
+        series = [{"metric": "mymetric", "tags": {}, "dps": {"1623619500": 1}}]
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.side_effect = self.encoding_backend(series, delay=0.3)
+        patcher = patch.object(request_handler.ProxyRequestHandler, 'coalescer', coalescer.Coalescer())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.start_server()
+
+        results = []
+        clients = [threading.Thread(target=self.post_encoded_query, args=(encoding, results))
+                   for encoding in ('gzip', 'identity', 'gzip', 'identity')]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        # One backend execution per encoding
+        self.assertEqual(results, [series] * 4)
+        self.assertEqual(mock_http_request_class.request.call_count, 2)
+
+    def post_cached_query(self, protector, count):
+        request_handler.ProxyRequestHandler.protector = protector
+        url = "http://{}:{}/api/query".format(self.host, self.port)
+        data = json.dumps({"start": 1623619500, "end": 1623623100,
+                           "queries": [{"metric": "mymetric", "aggregator": "max"}]}).encode()
+        for _ in range(count):
+            response = urllib.request.urlopen(urllib.request.Request(url, data, {'Content-Type': 'application/json'}))
+            self.assertEqual(json.loads(response.read()), [])
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_response_cache(self, mock_http_request):
+        body = '[{"statsSummary": {"emittedDPs": 0, "queryIdx_00": {}}}]'
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.side_effect = lambda *args, **kwargs: MockHTTPResponse(200, "OK", {}, body)
+        patcher = patch.object(request_handler.ProxyRequestHandler, 'response_cache', response_cache.ResponseCache(1024))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.start_server()
+
+        # Only the first request reaches the backend and is recorded
+        protector = self.create_protector()
+        self.post_cached_query(protector, 3)
+        self.assertEqual(mock_http_request_class.request.call_count, 1)
+        self.assertEqual(protector.save_stats.call_count, 1)
+
+        # Blocked queries let through in safe mode don't populate the cache
+        request_handler.ProxyRequestHandler.response_cache = response_cache.ResponseCache(1024)
+        protector = self.create_protector(Err({"rule": "rule", "msg": "blocked"}))
+        self.post_cached_query(protector, 2)
+        self.assertEqual(mock_http_request_class.request.call_count, 3)
+        self.assertEqual(protector.save_stats.call_count, 2)
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_response_cache_encodings(self, mock_http_request):
+        series = [{"metric": "mymetric", "tags": {}, "dps": {"1623619500": 1}}]
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.side_effect = self.encoding_backend(series)
+        patcher = patch.object(request_handler.ProxyRequestHandler, 'response_cache', response_cache.ResponseCache(4096))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.start_server()
+
+        for encoding in ('gzip', 'identity', 'gzip', 'identity'):
+            self.assertEqual(self.post_encoded_query(encoding), series)
+        self.assertEqual(mock_http_request_class.request.call_count, 2)
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_shared_cache_encodings(self, mock_http_request):
+        series = [{"metric": "mymetric", "tags": {}, "dps": {"1623619500": 1}}]
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.side_effect = self.encoding_backend(series)
+        db = MockRedis()
+        patcher = patch.object(request_handler.ProxyRequestHandler, 'shared_cache', shared_cache.SharedCache(db))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.start_server()
+
+        # A gzip client and a plain one, then the same clients on another protector instance
+        for encoding in ('gzip', 'identity', 'gzip', 'identity'):
+            self.assertEqual(self.post_encoded_query(encoding), series)
+        self.assertEqual(mock_http_request_class.request.call_count, 2)
+        self.assertEqual(len([k for k in db.data if not k.endswith("_lock")]), 2)
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_tail_cache(self, mock_http_request):
+        starts = []
+
+        def backend(*args, **kwargs):
+            start = json.loads(kwargs['body'])['start']
+            starts.append(start)
+            now = int(time.time())
+            if not isinstance(start, int):
+                start = now - 3600
+            dps = {str(ts): 1 for ts in range(start // 60 * 60, now, 60)}
+            body = json.dumps([{"metric": "mymetric", "tags": {}, "aggregateTags": [], "dps": dps}])
+            return MockHTTPResponse(200, "OK", {"content-length": str(len(body))}, body)
+
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.side_effect = backend
+        patcher = patch.object(request_handler.ProxyRequestHandler, 'tail_cache', tail_cache.TailCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.start_server()
+
+        url = "http://{}:{}/api/query".format(self.host, self.port)
+        data = json.dumps({"start": "1h-ago", "queries": [
+            {"metric": "mymetric", "aggregator": "sum", "downsample": "1m-avg"}
+        ]}).encode()
+        results = []
+        for _ in range(2):
+            response = urllib.request.urlopen(urllib.request.Request(url, data, {'Content-Type': 'application/json'}))
+            results.append(json.loads(response.read()))
+
+        # The refresh only asked for the last minutes and got the whole hour
+        self.assertEqual(starts[0], "1h-ago")
+        self.assertGreater(starts[1], time.time() - 600)
+        self.assertEqual(len(results[1][0]["dps"]), len(results[0][0]["dps"]))
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_metadata_cache(self, mock_http_request):
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.side_effect = lambda *args, **kwargs: MockHTTPResponse(
+            200, "OK", {"content-type": "application/json"}, '["mymetric"]')
+        cache = metadata_cache.MetadataCache([{'path': '/api/suggest', 'ttl': 60}])
+        patcher = patch.object(request_handler.ProxyRequestHandler, 'metadata_cache', cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.start_server()
+
+        url = "http://{}:{}/api/suggest?type=metrics&q=my".format(self.host, self.port)
+        first = urllib.request.urlopen(url)
+        etag = first.headers['ETag']
+        self.assertEqual(first.read(), b'["mymetric"]')
+        second = urllib.request.urlopen(url)
+        self.assertEqual(second.read(), b'["mymetric"]')
+        self.assertEqual(second.headers['ETag'], etag)
+        self.assertEqual(mock_http_request_class.request.call_count, 1)
+
+        # Revalidation
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(urllib.request.Request(url, headers={'If-None-Match': etag}))
+        self.assertEqual(e.exception.code, 304)
+        self.assertEqual(mock_http_request_class.request.call_count, 1)
+
+        # Other parameters and endpoints are separate
+        urllib.request.urlopen(url + "m").read()
+        urllib.request.urlopen("http://{}:{}/api/version".format(self.host, self.port)).read()
+        urllib.request.urlopen("http://{}:{}/api/version".format(self.host, self.port)).read()
+        self.assertEqual(mock_http_request_class.request.call_count, 4)
+
+    @patch('protector.proxy.request_handler.HTTPRequest')
+    def test_path_label(self, mock_http_request):
+        mock_http_request_class = mock_http_request.return_value
+        mock_http_request_class.request.return_value = MockHTTPResponse(200, "OK", {}, "[]")
+
+        self.start_server()
+        protector = request_handler.ProxyRequestHandler.protector
+
+        urllib.request.urlopen("http://{}:{}/api/suggest?type=metrics&q=my".format(self.host, self.port)).read()
+        protector.TSDB_REQUEST_LATENCY.labels.assert_called_once_with(200, "/api/suggest", "GET")
+
+    def test_top(self):
+        self.start_server()
+        protector = request_handler.ProxyRequestHandler.protector
+        protector.get_top.return_value = b'{"9": [["q1_60", 1.5]]}'
+
+        url = "http://{}:{}/top/duration".format(self.host, self.port)
+        response = urllib.request.urlopen(url + "?limit=10&offset=20&hours=3&days=2&other=1")
+        self.assertEqual(json.loads(response.read()), {"9": [["q1_60", 1.5]]})
+        protector.get_top.assert_called_once_with("duration", limit=10, offset=20, hours=3, days=2)
+
+        protector.get_top.side_effect = ValueError("limit must be between 1 and 1000")
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(url + "?limit=0")
+        self.assertEqual(e.exception.code, 400)
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(url + "?limit=many")
+        self.assertEqual(e.exception.code, 400)
+
+        protector.get_top.side_effect = None
+        protector.get_top.return_value = None
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(url)
+        self.assertEqual(e.exception.code, 503)
+
+    def test_query_stats(self):
+        self.start_server()
+        protector = request_handler.ProxyRequestHandler.protector
+        protector.get_stats.return_value = b'{"intervals": {}}'
+
+        url = "http://{}:{}/stats/abc123".format(self.host, self.port)
+        self.assertEqual(json.loads(urllib.request.urlopen(url).read()), {"intervals": {}})
+        protector.get_stats.assert_called_once_with("abc123")
+
+        protector.get_stats.return_value = None
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(url)
+        self.assertEqual(e.exception.code, 503)
+
+
+class TestAsyncRequests(TestRequests):
+    """
+    Same request semantics, served by the asyncio engine
+    """
+
+    server_class = async_server.AsyncHTTPServer
+
+
+class TestReusePort(unittest.TestCase):
+
+    def test_workers_share_port(self):
+        servers = []
+        for server_class in (server.ThreadingHTTPServer, async_server.AsyncHTTPServer):
+            server_class.reuse_port = True
+            try:
+                first = server_class(("127.0.0.1", 0), request_handler.ProxyRequestHandler)
+                second = server_class(first.server_address, request_handler.ProxyRequestHandler)
+                servers.extend([first, second])
+                self.assertEqual(first.server_address, second.server_address)
+            finally:
+                server_class.reuse_port = False
+        for s in servers:
+            s.server_close()
@@ -0,0 +1,149 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import threading
+import time
+import unittest
+
+import redis
+from mock import mock
+
+from protector.proxy.http_request import BufferedResponse
+from protector.proxy.shared_cache import SharedCache
+from protector.redis_client import CircuitBreaker
+
+
+class MockRedis(object):
+    """
+    The few commands used by the shared cache, thread-safe
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def exists(self, key):
+        return key in self.data
+
+    def set(self, key, value, nx=False, ex=None):
+        with self.lock:
+            if nx and key in self.data:
+                return None
+            self.data[key] = value
+            self.ttls[key] = ex
+            return True
+
+    def eval(self, script, numkeys, key, token):
+        with self.lock:
+            if self.data.get(key) == token:
+                del self.data[key]
+                return 1
+            return 0
+
+
+class BrokenRedis(object):
+
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise redis.ConnectionError("Connection refused")
+        return fail
+
+
+def make_response(body=b"[]", status=200):
+    return BufferedResponse(status, "OK", 11, [("Content-Type", "application/json")], body, 0.5)
+
+
+class TestSharedCache(unittest.TestCase):
+
+    def test_fill_and_hit(self):
+        db = MockRedis()
+        cache = SharedCache(db)
+
+        response, fetched = cache.get_or_fill("key", time.time(), make_response, b"[1]")
+        self.assertTrue(fetched)
+        self.assertEqual(db.ttls["protector_cache_key"], 10)
+        # Lock released
+        self.assertNotIn("protector_cache_key_lock", db.data)
+
+        response, fetched = cache.get_or_fill("key", time.time(), self.backend_not_called)
+        self.assertFalse(fetched)
+        self.assertEqual(response.body, b"[1]")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.duration, 0.5)
+        self.assertEqual(response.getheader("content-type"), "application/json")
+
+    def test_errors_not_cached(self):
+        db = MockRedis()
+        cache = SharedCache(db)
+        cache.get_or_fill("key", time.time(), make_response, b"{}", 500)
+        self.assertNotIn("protector_cache_key", db.data)
+
+    def test_entry_too_large(self):
+        db = MockRedis()
+        cache = SharedCache(db, max_entry_bytes=10)
+        cache.get_or_fill("key", time.time(), make_response, b"[1]")
+        self.assertNotIn("protector_cache_key", db.data)
+
+    def test_stampede(self):
+        db = MockRedis()
+        cache = SharedCache(db, poll_interval=0.01)
+        calls = []
+
+        def slow_backend():
+            calls.append(1)
+            time.sleep(0.2)
+            return make_response(b"[2]")
+
+        results = []
+
+        def client():
+            results.append(cache.get_or_fill("key", time.time(), slow_backend)[0].body)
+
+        threads = [threading.Thread(target=client) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [b"[2]"] * 5)
+
+    def test_redis_down(self):
+        cache = SharedCache(BrokenRedis())
+        response, fetched = cache.get_or_fill("key", time.time(), make_response, b"[3]")
+        self.assertTrue(fetched)
+        self.assertEqual(response.body, b"[3]")
+
+    def test_circuit(self):
+        db = BrokenRedis()
+        db.get = mock.MagicMock(side_effect=redis.ConnectionError("Connection refused"))
+        cache = SharedCache(db, circuit=CircuitBreaker(max_failures=2, backoff=0.1))
+
+        cache.get_or_fill("key", time.time(), make_response, b"[3]")
+        self.assertEqual(db.get.call_count, 1)
+        # Redis is skipped once the circuit is open, the backend is queried directly
+        response, fetched = cache.get_or_fill("key", time.time(), make_response, b"[3]")
+        self.assertTrue(fetched)
+        self.assertEqual(response.body, b"[3]")
+        self.assertEqual(db.get.call_count, 1)
+
+        time.sleep(0.1)
+        db = MockRedis()
+        cache.db = db
+        cache.get_or_fill("key", time.time(), make_response, b"[3]")
+        self.assertIn("protector_cache_key", db.data)
+        self.assertEqual(cache.circuit.failures, 0)
+
+    def backend_not_called(self):
+        self.fail("Backend should not be called")
@@ -0,0 +1,80 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import json
+import time
+import unittest
+
+from protector.proxy.tail_cache import TailCache
+from protector.query.query import OpenTSDBQuery
+
+
+def backend(body, now):
+    """
+    Answer a query like OpenTSDB would, 1m-avg datapoints valued with their timestamp
+    """
+    q = json.loads(body)
+    start = q['start'] if isinstance(q['start'], int) else int(OpenTSDBQuery(body).get_start_timestamp())
+    series = []
+    for host in ("a", "b"):
+        dps = {str(ts): ts for ts in range(start // 60 * 60, int(now), 60)}
+        series.append({"metric": "m", "tags": {"host": host}, "aggregateTags": [], "dps": dps,
+                       "query": {"index": 0, "start": q['start']}})
+    return json.dumps(series + [{"statsSummary": {"emittedDPs": len(dps) * 2, "queryIdx_00": {}}}])
+
+
+class TestTailCache(unittest.TestCase):
+
+    def setUp(self):
+        self.query = json.dumps({"start": "1h-ago", "queries": [
+            {"metric": "m", "aggregator": "sum", "downsample": "1m-avg", "tags": {"host": "*"}}
+        ]})
+
+    def test_unsupported(self):
+        cache = TailCache()
+        for q in ({"start": 1623619500, "queries": [{"metric": "m", "downsample": "1m-avg"}]},
+                  {"start": "1h-ago", "end": "10m-ago", "queries": [{"metric": "m", "downsample": "1m-avg"}]},
+                  {"start": "1h-ago", "queries": [{"metric": "m"}]},
+                  {"start": "1h-ago", "queries": [{"metric": "m", "downsample": "0all-sum"}]},
+                  {"start": "1h-ago", "queries": [{"metric": "m", "downsample": "1dc-sum"}]}):
+            self.assertIsNone(cache.plan(OpenTSDBQuery(json.dumps(q))))
+
+    def test_tail_only(self):
+        cache = TailCache(settle=120)
+        now = time.time()
+
+        # Full range the first time
+        fetch = cache.plan(OpenTSDBQuery(self.query), now)
+        self.assertIsNone(fetch.entry)
+        first = json.loads(cache.merge(fetch, backend(fetch.body, now)))
+        self.assertEqual(first[:-1], json.loads(backend(self.query, now))[:-1])
+
+        # Then only the tail: from one interval before the final datapoints
+        later = now + 30
+        fetch = cache.plan(OpenTSDBQuery(self.query), later)
+        self.assertIsNotNone(fetch.entry)
+        tail_start = json.loads(fetch.body)['start']
+        self.assertEqual(tail_start, int(now - 120) // 60 * 60 - 60)
+
+        merged = json.loads(cache.merge(fetch, backend(fetch.body, later)))
+        expected = json.loads(backend(self.query, later))
+        self.assertEqual([s['dps'] for s in merged[:-1]], [s['dps'] for s in expected[:-1]])
+        # Stats of the tail query are kept
+        self.assertEqual(merged[-1]["statsSummary"]["emittedDPs"], len(range(tail_start, int(later), 60)) * 2)
+
+    def test_lru(self):
+        cache = TailCache(max_entries=1)
+        now = time.time()
+        for start in ("1h-ago", "2h-ago"):
+            query = self.query.replace("1h-ago", start)
+            fetch = cache.plan(OpenTSDBQuery(query), now)
+            cache.merge(fetch, backend(fetch.body, now))
+        self.assertEqual(len(cache.entries), 1)
+        self.assertIsNone(cache.plan(OpenTSDBQuery(self.query), now).entry)
@@ -220,4 +220,40 @@ class TestQuery(unittest.TestCase):
 
         r = OpenTSDBResponse(self.response3)
         # no error is raised, just logged
-        self.assertTrue(not r.get_stats())
\ No newline at end of file
+        self.assertTrue(not r.get_stats())
+
+    def test_series_bytes_forwarded_unchanged(self):
+
+        r = OpenTSDBResponse(self.response2.encode())
+
+        # the series are not re-serialized
+        body = r.to_bytes()
+        self.assertTrue(self.response2.encode().startswith(body[:-1]))
+        self.assertEqual(self.response2_ret, json.loads(body))
+        self.assertDictEqual(self.stats2, r.get_stats())
+
+    def test_summary_only_response(self):
+
+        r = OpenTSDBResponse('[{"statsSummary": {"emittedDPs": 0, "queryIdx_00": {}}}]')
+        self.assertEqual(b'[]', r.to_bytes())
+        self.assertDictEqual({"emittedDPs": 0}, r.get_stats())
+
+    def test_summary_mentioned_in_tag_value(self):
+
+        data = '[{"metric": "m", "tags": {"t": "\\"statsSummary\\": {"}, "dps": {"1623619500": 1}}]'
+        r = OpenTSDBResponse(data)
+        self.assertEqual(json.loads(data), json.loads(r.to_bytes()))
+        self.assertTrue(not r.get_stats())
+
+    def test_range_key(self):
+
+        queries = [{"metric": "m", "aggregator": "sum"}]
+        relative = OpenTSDBQuery(json.dumps({"start": "1h-ago", "queries": queries}))
+        seconds = OpenTSDBQuery(json.dumps({"start": 1623619500, "end": 1623623100, "queries": queries}))
+        millis = OpenTSDBQuery(json.dumps({"start": 1623619500000, "end": 1623623100000, "queries": queries}))
+        timezone = OpenTSDBQuery(json.dumps({"start": "1h-ago", "timezone": "UTC", "queries": queries}))
+
+        self.assertEqual(relative.get_id(), seconds.get_id())
+        self.assertEqual(seconds.get_range_key(), millis.get_range_key())
+        self.assertNotEqual(relative.get_range_key(), seconds.get_range_key())
+        self.assertNotEqual(relative.get_range_key(), timezone.get_range_key())
@@ -0,0 +1,562 @@
+#  Copyright 2019 Adobe
+#  All Rights Reserved.
+#
+#  NOTICE: Adobe permits you to use, modify, and distribute this file in
+#  accordance with the terms of the Adobe license agreement accompanying
+#  it. If you have received this file from a source other than Adobe,
+#  then your use, modification, or distribution of it requires the prior
+#  written permission of Adobe.
+#
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import redis
+
+from protector.store import history as history_encoding
+from protector.store import sketch
+from protector.store.base import StoreError, ranked
+from protector.store.loader import load_store
+from protector.store.memory_store import MemoryStore
+from protector.store.redis_store import RedisStore, DAY_TOP_TTL, ZADD_MAX
+from protector.store.sqlite_store import SqliteStore
+
+# host:port/db of a Redis server (>= 6.0) the Redis store tests may flush, skipped if not set
+REDIS_URL = os.environ.get('PROTECTOR_TEST_REDIS')
+
+
+def make_record(query_id="q1", interval=60, duration=1.5, sum_dp=100, timeout=False, timestamp=1000, hour=10):
+    global_stats = {'duration': duration, 'timestamp': timestamp}
+    if timeout:
+        global_stats['timeout_last'] = timestamp
+    else:
+        global_stats['emittedDPs'] = sum_dp
+    stats = {'timestamp': timestamp, 'start': timestamp - 3600, 'end': None, 'duration': duration,
+             'summary': {} if timeout else {'emittedDPs': sum_dp}, 'timeout': timeout}
+    return {
+        'id': query_id,
+        'query': json.dumps({'queries': [{'metric': query_id}]}),
+        'stats': history_encoding.encode(stats),
+        'hourly': history_encoding.increments(stats),
+        'hourly_max': history_encoding.hourly_max(stats),
+        'sketch': sketch.increments(interval, duration, None if timeout else sum_dp),
+        'interval_key': "{}_{}".format(query_id, interval),
+        'global_stats': global_stats,
+        'timestamp': timestamp,
+        'duration': duration,
+        'sum_dp': sum_dp,
+        'timeout': timeout,
+        'day': 1,
+        'hour': hour
+    }
+
+
+class StoreConformance(object):
+    """
+    Behaviour every stats store must have, the test cases provide create_store(ttl)
+    """
+
+    def create_store(self, ttl=0):
+        raise NotImplementedError()
+
+    def test_write_and_load(self):
+        store = self.create_store()
+        self.assertEqual(store.load("q1_60"), {})
+
+        self.assertEqual(store.write([make_record(timestamp=1000)]), [True])
+        self.assertEqual(store.write([make_record(duration=2.5, timestamp=1010)]), [False])
+
+        self.assertEqual(store.load("q1_60"), {
+            'duration': '2.5', 'timestamp': '1010', 'emittedDPs': '100', 'first_occurrence': '1000',
+            'total_counter': '2'
+        })
+
+    def test_timeout(self):
+        store = self.create_store()
+        store.write([make_record(), make_record(timeout=True, timestamp=1020, duration=20)])
+
+        stats = store.load("q1_60")
+        self.assertEqual(stats['timeout_last'], '1020')
+        self.assertEqual(stats['timeout_counter'], '1')
+        self.assertEqual(stats['total_counter'], '2')
+        self.assertEqual(stats['duration'], '20')
+
+    def test_batch_creates_each_hash_once(self):
+        store = self.create_store()
+        created = store.write([make_record("q1"), make_record("q2"), make_record("q1", interval=5), make_record("q2")])
+        self.assertEqual(created, [True, True, True, False])
+
+    def test_history(self):
+        store = self.create_store()
+        store.write([make_record(timestamp=1000), make_record(timestamp=1010, timeout=True)])
+        history = store.history("q1")
+        self.assertEqual([h['timestamp'] for h in history], [1000, 1010])
+        self.assertEqual([h['timeout'] for h in history], [False, True])
+        self.assertEqual(store.history("unknown"), [])
+
+    def test_history_capped(self):
+        store = self.create_store()
+        store.history_size = 3
+        store.write([make_record(timestamp=1000 + i) for i in range(5)])
+        store.write([make_record(timestamp=1005)])
+        self.assertEqual([h['timestamp'] for h in store.history("q1")], [1003, 1004, 1005])
+        self.assertEqual(store.history("q1")[0]['summary'], {'emittedDPs': 100})
+
+    def test_aggregates(self):
+        store = self.create_store()
+        store.write([make_record(timestamp=3600, duration=1.5), make_record(timestamp=7199, duration=2.0, sum_dp=50),
+                     make_record(timestamp=7200, timeout=True, duration=20)])
+
+        self.assertEqual(store.aggregates("q1"), {
+            3600: {'count': 2, 'timeouts': 0, 'duration': 3.5, 'dps': 150, 'max_duration': 2.0, 'max_dps': 100},
+            7200: {'count': 1, 'timeouts': 1, 'duration': 20.0, 'dps': 0, 'max_duration': 20.0, 'max_dps': 0},
+        })
+        self.assertEqual(store.aggregates("unknown"), {})
+
+    def test_compact(self):
+        store = self.create_store()
+        now = int(time.time())
+        store.write([make_record(query_id, timestamp=timestamp, duration=duration)
+                     for timestamp, duration in ((now - 20000, 5), (now - 19000, 3), (now - 100, 1))
+                     for query_id in ("q1", "q2")])
+
+        self.assertEqual(store.compact(3600, count=1), (4, 0))
+        self.assertEqual([h['timestamp'] for h in store.history("q1")], [now - 100])
+        self.assertEqual(len(store.history("q2")), 1)
+        self.assertEqual(store.compact(3600), (0, 0))
+        # The dropped executions still count
+        self.assertEqual(sum(a['count'] for a in store.aggregates("q1").values()), 3)
+        self.assertEqual(max(a['max_duration'] for a in store.aggregates("q1").values()), 5.0)
+
+        dropped = store.compact(3600, hourly_retention=7200, count=1)
+        self.assertEqual(dropped[0], 0)
+        self.assertIn(dropped[1], (2, 4))
+        self.assertEqual(store.aggregates("q1"), {history_encoding.hour_of(now - 100): {
+            'count': 1, 'timeouts': 0, 'duration': 1.0, 'dps': 100, 'max_duration': 1.0, 'max_dps': 100}})
+
+    def test_sketches(self):
+        store = self.create_store()
+        store.write([make_record(duration=d, sum_dp=d * 100) for d in range(1, 11)])
+        store.write([make_record(interval=5, duration=0.5, timeout=True)])
+
+        sketches = store.sketches("q1")
+        self.assertEqual(sorted(sketches), [5, 60])
+        self.assertEqual(sketches[60]['duration'].count, 10)
+        self.assertAlmostEqual(sketches[60]['duration'].quantile(0.5), 5, delta=5 * sketch.RELATIVE_ACCURACY)
+        self.assertAlmostEqual(sketches[60]['dps'].quantile(0.9), 900, delta=900 * sketch.RELATIVE_ACCURACY)
+        self.assertAlmostEqual(sketches[60]['dps'].quantile(1), 1000, delta=1000 * sketch.RELATIVE_ACCURACY)
+        self.assertEqual(sketches[5]['duration'].count, 1)
+        self.assertEqual(sketches[5]['dps'].count, 0)
+        self.assertEqual(store.sketches("unknown"), {})
+
+    def test_top_keeps_max(self):
+        store = self.create_store()
+        store.write([make_record("q1", duration=5, sum_dp=10), make_record("q2", duration=1, sum_dp=300),
+                     make_record("q1", duration=2, sum_dp=20), make_record("q3", timeout=True, duration=20),
+                     make_record("q4", duration=7, hour=9)])
+
+        top = store.top("duration", [(1, 10), (1, 9), (1, 8)])
+        self.assertEqual([(m, float(s)) for m, s in top[0]], [("q3_60", 20.0), ("q1_60", 5.0), ("q2_60", 1.0)])
+        self.assertEqual([(m, float(s)) for m, s in top[1]], [("q4_60", 7.0)])
+        self.assertEqual(list(top[2]), [])
+
+        top = store.top("dps", [(1, 10)])
+        self.assertEqual([(m, float(s)) for m, s in top[0]], [("q2_60", 300.0), ("q1_60", 20.0)])
+
+    def test_top_limit(self):
+        store = self.create_store()
+        store.write([make_record("q{}".format(i), duration=i) for i in range(10)])
+
+        top = store.top("duration", [(1, 10), (1, 9)], limit=3)
+        self.assertEqual([m for m, s in top[0]], ["q9_60", "q8_60", "q7_60"])
+        self.assertEqual(list(top[1]), [])
+        top = store.top("duration", [(1, 10)], limit=3, offset=8)
+        self.assertEqual([m for m, s in top[0]], ["q1_60", "q0_60"])
+
+    def test_top_days(self):
+        store = self.create_store()
+        store.write([make_record("q1", duration=5, hour=0), make_record("q2", duration=3, hour=0),
+                     make_record("q2", duration=8, hour=23), make_record("q3", duration=1, hour=12),
+                     make_record("q4", duration=9, hour=13)])
+
+        days = [(1, range(24), True), (1, range(13), False), (2, range(24), True)]
+        top = store.top_days("duration", days)
+        self.assertEqual([(m, float(s)) for m, s in top[0]],
+                         [("q4_60", 9.0), ("q2_60", 8.0), ("q1_60", 5.0), ("q3_60", 1.0)])
+        self.assertEqual([(m, float(s)) for m, s in top[1]], [("q1_60", 5.0), ("q2_60", 3.0), ("q3_60", 1.0)])
+        self.assertEqual(list(top[2]), [])
+
+        # Complete days may be served from a precomputed leaderboard
+        store.write([make_record("q3", duration=2, hour=12)])
+        top = store.top_days("duration", days, limit=2, offset=1)
+        self.assertEqual([m for m, s in top[0]], ["q2_60", "q1_60"])
+        self.assertEqual([(m, float(s)) for m, s in top[1]], [("q2_60", 3.0), ("q3_60", 2.0)])
+
+    def test_ttl(self):
+        store = self.create_store(ttl=1)
+        store.write([make_record()])
+        self.assertNotEqual(store.load("q1_60"), {})
+
+        time.sleep(1.1)
+        self.assertEqual(store.load("q1_60"), {})
+        self.assertEqual(store.history("q1"), [])
+        self.assertEqual(store.aggregates("q1"), {})
+        self.assertEqual(list(store.top("duration", [(1, 10)])[0]), [])
+        # Created again, with a new TTL
+        self.assertEqual(store.write([make_record()]), [True])
+        self.assertEqual(store.load("q1_60")['total_counter'], '1')
+
+
+class TestMemoryStore(StoreConformance, unittest.TestCase):
+
+    def create_store(self, ttl=0):
+        return MemoryStore(ttl)
+
+    def test_eviction(self):
+        store = MemoryStore(max_keys=9)
+        store.write([make_record("q1")])
+        store.load("q1_60")
+        store.write([make_record("q2")])
+
+        # q1 keys were used less recently than q1_60
+        self.assertEqual(store.load("q1_60")['total_counter'], '1')
+        self.assertEqual(store.history("q1"), [])
+        self.assertEqual(len(store.keys), 9)
+
+
+class TestSqliteStore(StoreConformance, unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def create_store(self, ttl=0):
+        store = SqliteStore(os.path.join(self.dir, "stats.db"), ttl)
+        self.addCleanup(store.close)
+        return store
+
+    def test_purge(self):
+        store = SqliteStore(os.path.join(self.dir, "stats.db"), ttl=1, purge_interval=0)
+        self.addCleanup(store.close)
+        store.write([make_record("q1")])
+        time.sleep(1.1)
+        store.write([make_record("q2")])
+
+        keys = store.connect().execute("SELECT DISTINCT key FROM hashes ORDER BY key").fetchall()
+        self.assertEqual(keys, [("q2_60",), ("q2_hourly",), ("q2_sketch",)])
+
+    def test_error(self):
+        store = SqliteStore(os.path.join(self.dir, "missing", "stats.db"))
+        with self.assertRaises(StoreError):
+            store.write([make_record()])
+
+
+@unittest.skipIf(not REDIS_URL, "PROTECTOR_TEST_REDIS not set")
+class TestRedisStore(StoreConformance, unittest.TestCase):
+
+    def create_store(self, ttl=0):
+        address, db = REDIS_URL.split('/')
+        host, port = address.split(':')
+        client = redis.Redis(host=host, port=int(port), db=int(db), decode_responses=True)
+        client.flushdb()
+        self.addCleanup(client.close)
+        return RedisStore(client, ttl)
+
+
+class TestLoadStore(unittest.TestCase):
+
+    def test_types(self):
+        self.assertIsInstance(load_store({'type': 'memory', 'expire': 60}), MemoryStore)
+        self.assertIsInstance(load_store({'type': 'sqlite', 'sqlite': {'path': ':memory:'}}), SqliteStore)
+        self.assertIsInstance(load_store({'redis': {'host': 'localhost', 'port': 6379, 'password': ''}}), RedisStore)
+        self.assertEqual(load_store({'type': 'memory', 'expire': 60}).ttl, 60)
+
+        with self.assertRaisesRegex(Exception, 'Unknown db type'):
+            load_store({'type': 'lmdb'})
+
+
+class MigrationPipeline(object):
+    """
+    The commands of a Redis transaction used by the history migration, on a single list
+    """
+
+    def __init__(self, entries, ttl):
+        self.entries = entries
+        self.ttl = ttl
+        self.hourly = {}
+        self.hourly_max = {}
+        self.expires = {}
+
+    def lrange(self, key, start, end):
+        return list(self.entries)
+
+    def pttl(self, key):
+        return self.ttl
+
+    def multi(self):
+        pass
+
+    def delete(self, key):
+        self.entries = []
+
+    def rpush(self, key, *values):
+        self.entries.extend(values)
+
+    def pexpire(self, key, ttl):
+        self.expires[key] = ttl
+
+    def eval(self, script, numkeys, *keys_and_args):
+        keys, args = keys_and_args[:numkeys], keys_and_args[numkeys:]
+        if script == ZADD_MAX:
+            for score, member in zip(args[::2], args[1::2]):
+                self.hourly_max[member] = max(score, self.hourly_max.get(member, score))
+        else:
+            # PEXPIRE_NEW, the keys have no TTL yet
+            for key in keys:
+                self.pexpire(key, args[0])
+
+    def hincrby(self, key, field, value):
+        self.hourly[field] = self.hourly.get(field, 0) + value
+
+    hincrbyfloat = hincrby
+
+
+class CompactionRedis(object):
+    """
+    The Redis commands of the compaction, on lists, hashes and sorted sets
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.round_trips = 0
+
+    def scan_iter(self, match, count, _type):
+        # Sorted sets are dicts as well, none ends like a list or a hash
+        types = {'list': list, 'hash': dict}
+        return iter([k for k, v in self.keys.items() if k.endswith(match[1:]) and isinstance(v, types[_type])])
+
+    def pipeline(self, transaction=True):
+        return CompactionPipeline(self)
+
+    def lrange(self, key, start, end):
+        return list(self.keys.get(key, []))
+
+    def ltrim(self, key, start, end):
+        self.keys[key] = self.keys[key][start:]
+
+    def hkeys(self, key):
+        return list(self.keys.get(key, {}))
+
+    def zrange(self, key, start, end):
+        return list(self.keys.get(key, {}))
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            del self.keys[key][field]
+
+    zrem = hdel
+
+
+class CompactionPipeline(object):
+
+    def __init__(self, db):
+        self.db = db
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((getattr(self.db, name), args, kwargs))
+        return queue
+
+    def __len__(self):
+        return len(self.commands)
+
+    def execute(self):
+        self.db.round_trips += 1
+        return [command(*args, **kwargs) for command, args, kwargs in self.commands]
+
+
+class TopRedis(object):
+    """
+    The Redis commands of the day leaderboards, on sorted sets
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.ttls = {}
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return CompactionPipeline(self)
+
+    def exists(self, key):
+        return int(key in self.keys)
+
+    def zunionstore(self, dest, keys, aggregate):
+        union = {}
+        for key in keys:
+            for member, score in self.keys.get(key, {}).items():
+                union[member] = max(score, union.get(member, score))
+        self.keys[dest] = union
+        return len(union)
+
+    def expire(self, key, ttl):
+        self.ttls[key] = ttl
+
+    def zrevrange(self, key, start, end, withscores):
+        return ranked(self.keys.get(key, {}).items())[start:None if end == -1 else end + 1]
+
+
+class TestTopDaysRedis(unittest.TestCase):
+
+    def setUp(self):
+        self.keys = {'top_duration_16_{}'.format(h): {'q{}_60'.format(h % 3): float(h)} for h in range(24)}
+        self.keys.update({'top_duration_17_{}'.format(h): {'q{}_60'.format(h % 2): float(h)} for h in range(24)})
+        self.db = TopRedis(self.keys)
+
+    def test_complete(self):
+        days = [(16, range(24), True)]
+        top = RedisStore(self.db).top_days("duration", days, limit=2)
+
+        self.assertEqual(top, [[('q2_60', 23.0), ('q1_60', 22.0)]])
+        self.assertEqual(self.db.ttls, {'top_duration_16': DAY_TOP_TTL})
+        self.assertEqual(self.db.round_trips, 2)
+
+        # Served from the leaderboard, late writes are not merged anymore
+        self.keys['top_duration_16_23']['q0_60'] = 30.0
+        self.assertEqual(RedisStore(self.db).top_days("duration", days, limit=2), top)
+
+    def test_current_day(self):
+        # 23:xx, all the hours of today are there but it is not over
+        days = [(17, range(24), False)]
+        top = RedisStore(self.db).top_days("duration", days)
+
+        self.assertEqual(top, [[('q1_60', 23.0), ('q0_60', 22.0)]])
+        self.assertNotIn('top_duration_17', self.keys)
+        self.assertEqual(self.db.ttls, {'top_duration_17_current': 60})
+
+        self.keys['top_duration_17_23']['q2_60'] = 30.0
+        self.assertEqual(RedisStore(self.db).top_days("duration", days)[0][0], ('q2_60', 30.0))
+
+
+class TestHistory(unittest.TestCase):
+
+    legacy = json.dumps({'timestamp': 3700, 'start': 100, 'end': None, 'duration': 2.5, 'timeout': False,
+                         'summary': {'emittedDPs': 10, 'avgHBaseTime': 3.8, 'dpsPreFilter': 145}})
+
+    def test_encode(self):
+        entry = history_encoding.encode(json.loads(self.legacy))
+        self.assertEqual(entry, '[3700,100,null,2.5,0,10,145,null,null,null]')
+        self.assertEqual(history_encoding.decode(entry), {
+            'timestamp': 3700, 'start': 100, 'end': None, 'duration': 2.5, 'timeout': False,
+            'summary': {'emittedDPs': 10, 'dpsPreFilter': 145}
+        })
+        self.assertLess(len(entry), len(self.legacy) / 2)
+
+    def test_decode_legacy(self):
+        self.assertEqual(history_encoding.decode(self.legacy), json.loads(self.legacy))
+
+    def test_expired(self):
+        entries = [self.legacy, make_record(timestamp=3800)['stats'], make_record(timestamp=4000)['stats']]
+        self.assertEqual(history_encoding.expired(entries, 3700), 0)
+        self.assertEqual(history_encoding.expired(entries, 3900), 2)
+        self.assertEqual(history_encoding.expired(entries, 5000), 3)
+
+    def test_compact_redis(self):
+        now = int(time.time())
+        old, recent = history_encoding.hour_of(now - 20000), history_encoding.hour_of(now)
+        keys = {}
+        for query_id in ("q1", "q2", "q3"):
+            keys[query_id + "_stats"] = [self.legacy, make_record(timestamp=now - 100)['stats']]
+            keys[query_id + "_hourly"] = {"{}:n".format(old): '1', "{}:n".format(recent): '1'}
+            keys[query_id + "_hourly_max"] = {"{}:d".format(old): 2.5, "{}:d".format(recent): 1.5}
+        db = CompactionRedis(keys)
+
+        self.assertEqual(RedisStore(db).compact(3600, hourly_retention=7200, count=2), (3, 3))
+        self.assertEqual(keys["q3_stats"], [make_record(timestamp=now - 100)['stats']])
+        self.assertEqual(keys["q3_hourly"], {"{}:n".format(recent): '1'})
+        self.assertEqual(keys["q3_hourly_max"], {"{}:d".format(recent): 1.5})
+        # Read and trim round trips, for the 2 batches of histories and hourly aggregates
+        self.assertEqual(db.round_trips, 8)
+
+    def test_migrate(self):
+        store = RedisStore(None, history_size=2)
+        recent = make_record(timestamp=7300)['stats']
+        pipe = MigrationPipeline([self.legacy, self.legacy, recent], ttl=5000)
+
+        self.assertTrue(store._migrate(pipe, "q1"))
+        # Only the former entries are counted, the others already were
+        self.assertEqual(pipe.hourly, {'3600:n': 2, '3600:d': 5.0, '3600:p': 20})
+        self.assertEqual(pipe.entries, [history_encoding.encode(json.loads(self.legacy)), recent])
+        self.assertEqual(pipe.hourly_max, {'3600:d': 2.5, '3600:p': 10})
+        self.assertEqual(pipe.expires, {'q1_stats': 5000, 'q1_hourly': 5000, 'q1_hourly_max': 5000})
+
+        self.assertFalse(store._migrate(MigrationPipeline([recent], ttl=-1), "q1"))
+
+
+class TestSketch(unittest.TestCase):
+
+    def test_quantiles(self):
+        values = sketch.Sketch()
+        for i in range(1, 1001):
+            values.add(i / 100.0)
+
+        self.assertEqual(values.count, 1000)
+        for q in sketch.QUANTILES:
+            expected = round(q * 999 + 1) / 100.0
+            self.assertAlmostEqual(values.quantile(q), expected, delta=expected * sketch.RELATIVE_ACCURACY)
+        self.assertIsNone(sketch.Sketch().quantile(0.5))
+
+    def test_collapse(self):
+        values = sketch.Sketch()
+        values.add(0)
+        # 1ms to 1000s, several hundred buckets
+        for i in range(1, 1000001):
+            values.add(i / 1000.0)
+
+        self.assertEqual(len(values.counts), sketch.MAX_BUCKETS + 1)
+        self.assertEqual(values.count, 1000001)
+        self.assertEqual(values.quantile(0), 0.0)
+        # The high quantiles keep their accuracy, the lowest ones are overestimated
+        for q in sketch.QUANTILES:
+            expected = q * 1000
+            self.assertAlmostEqual(values.quantile(q), expected, delta=expected * sketch.RELATIVE_ACCURACY)
+        self.assertGreater(values.quantile(0.001), 1)
+
+        fields = {"60:d:{}".format(b): 1 for b in range(1, 400)}
+        decoded = sketch.decode(fields)[60]['duration']
+        self.assertEqual(len(decoded.counts), sketch.MAX_BUCKETS)
+        self.assertEqual(decoded.count, 399)
+        self.assertEqual(decoded.counts[399 - sketch.MAX_BUCKETS + 1], 399 - sketch.MAX_BUCKETS + 1)
+
+    def test_zero(self):
+        values = sketch.Sketch()
+        values.add(0)
+        values.add(0.0001)
+        values.add(5)
+        self.assertEqual(values.quantile(0.5), 0.0)
+        self.assertAlmostEqual(values.quantile(1), 5, delta=5 * sketch.RELATIVE_ACCURACY)
+
+    def test_merge(self):
+        first, second, both = sketch.Sketch(), sketch.Sketch(), sketch.Sketch()
+        for i in range(100):
+            first.add(i)
+            second.add(i * 10)
+            both.add(i)
+            both.add(i * 10)
+        self.assertEqual(first.merge(second).counts, both.counts)
+
+    def test_encoding(self):
+        fields = {}
+        for duration, dps in ((1.5, 100), (1.5, 120), (30, None)):
+            for field, value in sketch.increments(60, duration, dps).items():
+                fields[field] = str(int(fields.get(field, 0)) + value)
+
+        sketches = sketch.decode(fields)
+        self.assertEqual(sketches[60]['duration'].count, 3)
+        self.assertEqual(sketches[60]['dps'].count, 2)
+        self.assertAlmostEqual(sketches[60]['dps'].quantile(0.5), 100, delta=100 * sketch.RELATIVE_ACCURACY)
@@ -31,7 +31,7 @@ requires = [
     "PyYAML>=4.2b1",
     "result==0.3.0",
     "prometheus_client==0.7.1",
-    "redis==3.2.1",
+    "redis==3.5.3",
     "wheel==0.33.4",
     "setuptools==41.0.1",
     "typing-extensions==3.10.0.2"